@@ -0,0 +1,91 @@
+"""
+Compare envelope codecs on realistic incoming and outgoing frames.
+
+    python -m benchmarks.bench_codecs
+"""
+
+from benchmarks.utils import bench
+from benchmarks.utils import setup_django
+
+CODECS = (
+    "envelope.core.codecs.JSONCodec",
+    "envelope.core.codecs.OrjsonCodec",
+    "envelope.core.codecs.MsgPackCodec",
+    "envelope.core.codecs.CBORCodec",
+)
+
+
+def mk_messages():
+    from envelope.channels.messages import Subscribed
+    from envelope.messages.common import ProgressNum
+    from envelope.messages.ping import Pong
+
+    rows = [
+        {
+            "t": "poll.vote",
+            "p": {
+                "pk": i,
+                "poll": 3,
+                "choice": i % 5,
+                "title": "Ett förslag",
+                "weight": 1.5,
+            },
+        }
+        for i in range(200)
+    ]
+    return {
+        "pong": Pong(mm={"id": "abc", "state": "s"}),
+        "progress": ProgressNum(curr=5, total=100, msg="Importing"),
+        "subscribed (200 rows)": Subscribed(
+            mm={"id": "sub1", "state": "s"},
+            pk=1,
+            channel_type="user",
+            channel_name="user_1",
+            app_state=rows,
+        ),
+    }
+
+
+def validated_dumps(envelope, message):
+    """
+    How messages were serialized before serializers existed: validated envelope schema + json()
+    """
+    kwargs = message.mm.dict(exclude={"consumer_name"}, exclude_none=True)
+    if message.data is not None:
+        kwargs["p"] = message.data.dict()
+    return envelope.dumps(envelope.schema(t=message.name, **kwargs))
+
+
+def main():
+    setup_django()
+    from django.test import override_settings
+    from envelope.envelopes import incoming
+    from envelope.envelopes import outgoing
+
+    messages = mk_messages()
+    incoming_data = {
+        "ping": {"t": "s.ping", "i": "abc"},
+        "subscribe": {
+            "t": "channel.subscribe",
+            "i": "abc",
+            "p": {"pk": 1, "channel_type": "user"},
+        },
+    }
+    for codec in CODECS:
+        print(f"\n{codec}")
+        with override_settings(ENVELOPE_CODEC=codec):
+            for name, msg in messages.items():
+                text_data = outgoing.serialize(msg)
+                bench(
+                    f"validated dumps {name} ({len(text_data)} chars/bytes)",
+                    lambda: validated_dumps(outgoing, msg),
+                )
+                bench(f"serialize {name}", lambda: outgoing.serialize(msg))
+                bench(f"parse {name}", lambda: outgoing.parse(text_data))
+            for name, data in incoming_data.items():
+                frame = incoming.codec.dumps(data)
+                bench(f"parse incoming {name}", lambda: incoming.parse(frame))
+
+
+if __name__ == "__main__":
+    main()
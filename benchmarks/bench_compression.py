@@ -0,0 +1,57 @@
+"""
+Compression cost and ratio for a large outgoing frame, and the cost of
+compressing once per layer event in a process compared to once per consumer.
+
+    python -m benchmarks.bench_compression
+"""
+
+from benchmarks.bench_codecs import mk_messages
+from benchmarks.utils import bench
+from benchmarks.utils import setup_django
+
+CONSUMERS = 50
+
+
+def main():
+    setup_django()
+    from django.test import override_settings
+    from envelope.core.compression import ZlibCompressor
+    from envelope.envelopes import outgoing
+
+    msg = mk_messages()["subscribed (200 rows)"]
+    compressor = ZlibCompressor()
+    text_data = outgoing.serialize(msg).encode()
+    compressed = compressor.compress(text_data)
+    print(
+        f"{len(text_data)} bytes -> {len(compressed)} bytes "
+        f"(ratio {len(compressed) / len(text_data):.2f})"
+    )
+    bench("zlib compress", lambda: compressor.compress(text_data), number=200)
+    bench("zlib decompress", lambda: compressor.decompress(compressed), number=200)
+    bench("transport", lambda: outgoing.transport(outgoing, msg), number=200)
+
+    def per_event():
+        from envelope.testing import mk_consumer
+
+        event = outgoing.transport(outgoing, msg)
+        for i in range(CONSUMERS):
+            consumer = mk_consumer(consumer_name=f"c{i}")
+            consumer.set_compression(["zlib"])
+            consumer.encode_event(dict(event), outgoing)
+
+    with override_settings(ENVELOPE_COMPRESSION_THRESHOLD=1024):
+        bench(
+            f"transport, compressed once for {CONSUMERS} consumers",
+            per_event,
+            number=10,
+        )
+
+    def per_consumer():
+        for _ in range(CONSUMERS):
+            compressor.compress(text_data)
+
+    bench(f"compressed by {CONSUMERS} consumers", per_consumer, number=10)
+
+
+if __name__ == "__main__":
+    main()
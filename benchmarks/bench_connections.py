@@ -0,0 +1,90 @@
+"""
+Queries and time per connection lifecycle (connect, activity, close) with update_or_create
+compared to single statement upserts, and many connects upserted at once.
+Runs against a test database created from the current settings.
+
+    python -m benchmarks.bench_connections
+"""
+
+from benchmarks.utils import bench
+from benchmarks.utils import setup_django
+
+BATCH = 100
+
+
+def report(label: str, ctx):
+    queries = [x["sql"] for x in ctx.captured_queries]
+    statements = [x for x in queries if x not in ("BEGIN", "COMMIT")]
+    print(
+        f"{label:<50} {len(queries):>4} queries, {len(statements)} excluding BEGIN/COMMIT"
+    )
+
+
+def main():
+    setup_django()
+    from itertools import count
+
+    from django.contrib.auth import get_user_model
+    from django.db import connection
+    from django.test.runner import DiscoverRunner
+    from django.test.utils import CaptureQueriesContext
+    from django.utils.timezone import now
+
+    from envelope.models import Connection
+    from envelope.utils import update_connection_status
+    from envelope.utils import upsert_connection_statuses
+
+    runner = DiscoverRunner(verbosity=0)
+    old_config = runner.setup_databases()
+    try:
+        user = get_user_model().objects.create(username="bench")
+        names = count()
+
+        def update_or_create(user_pk, channel_name, **kwargs):
+            defaults = {k: v for k, v in kwargs.items() if v is not None}
+            return Connection.objects.update_or_create(
+                user_id=user_pk, channel_name=channel_name, defaults=defaults
+            )[0]
+
+        def lifecycle(func):
+            name = f"c{next(names)}"
+            at = now()
+            func(user.pk, name, online=True, online_at=at, last_action=at)
+            func(user.pk, name, last_action=now())
+            func(user.pk, name, online=False, offline_at=now())
+
+        def connect_many():
+            at = now()
+            upsert_connection_statuses(
+                {
+                    "user_pk": user.pk,
+                    "channel_name": f"c{next(names)}",
+                    "online_at": at,
+                    "last_action": at,
+                }
+                for _ in range(BATCH)
+            )
+
+        for label, func in (
+            ("update_or_create", update_or_create),
+            ("update_connection_status (upsert)", update_connection_status),
+        ):
+            with CaptureQueriesContext(connection) as ctx:
+                lifecycle(func)
+            report(label, ctx)
+        for label, func in (
+            ("update_or_create", update_or_create),
+            ("update_connection_status (upsert)", update_connection_status),
+        ):
+            bench(f"lifecycle, {label}", lambda: lifecycle(func), number=100)
+        connection.queries_log.clear()
+        with CaptureQueriesContext(connection) as ctx:
+            connect_many()
+        report(f"{BATCH} connects, upsert_connection_statuses", ctx)
+        bench(f"{BATCH} connects, upsert_connection_statuses", connect_many, number=10)
+    finally:
+        runner.teardown_databases(old_config)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Message creation on the consumer hot path.
+
+    python -m benchmarks.bench_messages
+"""
+
+from benchmarks.utils import bench
+from benchmarks.utils import setup_django
+
+
+def main():
+    setup_django()
+    from pydantic import BaseModel
+    from pydantic import Field
+
+    from envelope.envelopes import incoming
+    from envelope.messages.ping import Ping
+    from envelope.messages.ping import Pong
+    from envelope.schemas import MessageMeta
+    from envelope.testing import mk_consumer
+
+    class PydanticMessageMeta(BaseModel):
+        """
+        What MessageMeta used to be
+        """
+
+        id: str | None = Field(alias="i")
+        user_pk: int | None
+        consumer_name: str | None
+        language: str | None = Field(alias="l")
+        state: str | None = Field(alias="s")
+        env: str | None = None
+
+        class Config:
+            allow_population_by_field_name = True
+
+    kwargs = {"i": "abc", "user_pk": 1, "consumer_name": "specific.abc", "l": "sv"}
+    bench("pydantic meta", lambda: PydanticMessageMeta(**kwargs), number=10000)
+    bench("slotted meta", lambda: MessageMeta(**kwargs), number=10000)
+    pmm = PydanticMessageMeta(**kwargs)
+    bench(
+        "pydantic meta copy with state",
+        lambda: PydanticMessageMeta(state="s", **pmm.dict(exclude={"state"})),
+        number=10000,
+    )
+    mm = MessageMeta(**kwargs)
+    bench("slotted meta derive", lambda: mm.derive(state="s"), number=10000)
+    ping = Ping(mm=mm)
+    bench("Pong.from_message", lambda: Pong.from_message(ping, state="s"), number=10000)
+
+    consumer = mk_consumer(consumer_name="specific.abc")
+    text_data = '{"t": "s.ping", "i": "abc"}'
+    bench(
+        "parse + unpack incoming ping",
+        lambda: incoming.unpack(incoming.parse(text_data), consumer=consumer),
+        number=10000,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+"""
+Message type lookups, via registries compared to precomputed routing tables.
+
+    python -m benchmarks.bench_routing
+"""
+
+from benchmarks.utils import bench
+from benchmarks.utils import setup_django
+
+
+def main():
+    setup_django()
+    from envelope import WS_INCOMING
+    from envelope.registries import freeze_registries
+    from envelope.registries import unfreeze_registries
+    from envelope.utils import get_envelope
+
+    incoming = get_envelope(WS_INCOMING)
+    bench("get_envelope", lambda: get_envelope(WS_INCOMING), number=100_000)
+    bench("registry lookup", lambda: incoming.registry["s.ping"], number=100_000)
+    bench("routes lookup", lambda: incoming.routes["s.ping"], number=100_000)
+    freeze_registries()
+    bench("routes lookup, frozen", lambda: incoming.routes["s.ping"], number=100_000)
+    unfreeze_registries()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Sends per second from sync code, as on a worker: async_to_sync per message compared to
+submitting to a long lived SenderLoop. Uses the in memory channel layer, so it measures
+the sync to async bridge rather than the layer. With Redis, each async_to_sync call
+may also set up a new connection.
+
+    python -m benchmarks.bench_sender
+"""
+
+from time import perf_counter
+
+from benchmarks.utils import setup_django
+
+SENDS = 5000
+
+
+def run(label: str, func: callable):
+    start = perf_counter()
+    func()
+    elapsed = perf_counter() - start
+    print(f"{label:<50} {SENDS / elapsed:>10.0f} sends/s")
+
+
+def main():
+    setup_django()
+    from django.test import override_settings
+
+    from envelope.messages.ping import Pong
+    from envelope.sender_loop import get_sender_loop
+    from envelope.utils import websocket_send
+
+    layers = {
+        "default": {
+            "BACKEND": "channels.layers.InMemoryChannelLayer",
+            "CONFIG": {"capacity": SENDS * 10},
+        }
+    }
+
+    def send_all():
+        for i in range(SENDS):
+            websocket_send(Pong(), channel_name=f"abc{i % 10}", on_commit=False)
+
+    with override_settings(CHANNEL_LAYERS=layers):
+        run("async_to_sync", send_all)
+        sender_loop = get_sender_loop()
+        sender_loop.start()
+
+        def send_all_on_loop():
+            send_all()
+            sender_loop.flush()
+
+        try:
+            run("SenderLoop, including flush", send_all_on_loop)
+        finally:
+            sender_loop.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Message signal dispatch: receivers filtering with isinstance compared to
+MessageSignal receiver plans.
+
+    python -m benchmarks.bench_signals
+"""
+
+import asyncio
+
+from benchmarks.utils import bench
+from benchmarks.utils import setup_django
+
+RECEIVERS = 4
+
+
+def main():
+    setup_django()
+    from async_signals import Signal
+
+    from envelope.async_signals import MessageSignal
+    from envelope.async_signals import message_types
+    from envelope.core.message import AsyncRunnable
+    from envelope.deferred_jobs.message import DeferredJob
+    from envelope.messages.ping import Pong
+
+    legacy = Signal(debug=True)
+    signal = MessageSignal()
+    for i in range(RECEIVERS):
+        kind = AsyncRunnable if i % 2 else DeferredJob
+
+        async def isinstance_receiver(*, message, kind=kind, **kwargs):
+            if isinstance(message, kind):
+                pass  # pragma: no cover
+
+        @message_types(kind)
+        async def typed_receiver(**kwargs):
+            pass  # pragma: no cover
+
+        legacy.connect(isinstance_receiver, weak=False)
+        signal.connect(typed_receiver, weak=False)
+
+    msg = Pong()
+    loop = asyncio.new_event_loop()
+    bench(
+        f"Signal, {RECEIVERS} receivers with isinstance",
+        lambda: loop.run_until_complete(legacy.send(Pong, message=msg)),
+        number=10_000,
+    )
+    bench(
+        f"MessageSignal, {RECEIVERS} typed receivers",
+        lambda: loop.run_until_complete(signal.send(Pong, message=msg)),
+        number=10_000,
+    )
+    bench("Signal.has_listeners", lambda: legacy.has_listeners(Pong), number=10_000)
+    bench(
+        "MessageSignal.has_listeners", lambda: signal.has_listeners(Pong), number=10_000
+    )
+    loop.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Jobs per second with RQs SimpleWorker compared to EnvelopeWorker, on fakeredis.
+The stock Worker forks per job and can't be compared on fakeredis, forking
+typically adds a few milliseconds per job on top of SimpleWorker.
+
+    python -m benchmarks.bench_worker
+"""
+
+from time import perf_counter
+
+from benchmarks.utils import setup_django
+
+JOBS = 500
+THREADS = 4
+
+
+def run(label: str, enqueue: callable, work: callable):
+    enqueue()
+    start = perf_counter()
+    work()
+    elapsed = perf_counter() - start
+    print(f"{label:<50} {JOBS / elapsed:>10.0f} jobs/s")
+
+
+def main():
+    setup_django()
+    import logging
+
+    from django_rq import get_queue
+    from fakeredis import FakeStrictRedis
+    from rq import SimpleWorker
+
+    from envelope.deferred_jobs.worker import EnvelopeJob
+    from envelope.deferred_jobs.worker import EnvelopeWorker
+    from envelope.deferred_jobs.worker import ThreadedEnvelopeWorker
+    from envelope.deferred_jobs.worker import run_threaded
+
+    logging.getLogger("rq.worker").setLevel(logging.WARNING)
+
+    for func, args, label in (
+        ("operator.truth", (1,), "no-op job"),
+        ("time.sleep", (0.002,), "2 ms I/O bound job"),
+    ):
+        connection = FakeStrictRedis()
+        queue = get_queue(connection=connection, job_class=EnvelopeJob)
+
+        def enqueue():
+            for _ in range(JOBS):
+                queue.enqueue(func, *args)
+
+        run(
+            f"SimpleWorker, {label}",
+            enqueue,
+            lambda: SimpleWorker([queue], connection=connection).work(
+                burst=True, logging_level="WARNING"
+            ),
+        )
+        run(
+            f"EnvelopeWorker, {label}",
+            enqueue,
+            lambda: EnvelopeWorker([queue], connection=connection).work(
+                burst=True, logging_level="WARNING"
+            ),
+        )
+        run(
+            f"EnvelopeWorker x {THREADS} threads, {label}",
+            enqueue,
+            lambda: run_threaded(
+                [
+                    ThreadedEnvelopeWorker([queue], connection=connection)
+                    for _ in range(THREADS)
+                ],
+                burst=True,
+                logging_level="WARNING",
+            ),
+        )
+
+
+if __name__ == "__main__":
+    main()
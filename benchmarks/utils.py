@@ -0,0 +1,24 @@
+"""
+Shared helpers for benchmarks. Run them from the project root, for instance:
+
+    python -m benchmarks.bench_codecs
+"""
+
+import os
+from timeit import Timer
+
+
+def setup_django(settings_module: str = "dev_settings.settings"):
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", settings_module)
+    import django
+
+    django.setup()
+
+
+def bench(label: str, func: callable, number: int = 1000, repeat: int = 5) -> float:
+    """
+    Print and return the best time per call in microseconds.
+    """
+    best = min(Timer(func).repeat(repeat=repeat, number=number)) / number * 1_000_000
+    print(f"{label:<50} {best:>10.2f} µs")
+    return best
@@ -23,6 +23,34 @@ class MessageStates:
     MESSAGE_STATES = {ACKNOWLEDGED, QUEUED, RUNNING, SUCCESS, FAILED}
 
 
+# How messages are handled when received, see envelope.core.routing
+class Handler:
+    MESSAGE = "message"  # Only signals
+    ASYNC_RUNNABLE = "async_runnable"  # Run within the consumer
+    DEFERRED_JOB = "deferred_job"  # Queued
+
+
+# How incoming messages are ordered when the consumer pipeline is on, see envelope.consumers.pipeline
+class Ordering:
+    TYPE = "type"  # In order with messages of the same type
+    ID = "id"  # In order with messages with the same id (i), or the same type if there's no id
+    SERIAL = "serial"  # In order with all other serial messages
+    NONE = "none"  # Whenever there's room
+
+
+# Priority of deferred jobs, used to route them to queues, see envelope.deferred_jobs.routing
+class Priority:
+    INTERACTIVE = "interactive"  # Someone is waiting for the result
+    NORMAL = "normal"
+    BULK = "bulk"  # Can wait while there's a lot to do
+
+
+# Where deferred jobs run, see envelope.deferred_jobs.local
+class JobBackend:
+    RQ = "rq"  # Enqueued and run by workers
+    LOCAL = "local"  # Run in a thread pool within the process that received the message
+
+
 # Common errors
 class Error:
     GENERIC = "error.generic"
@@ -9,7 +9,6 @@ from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
 from django.utils.module_loading import import_string
 
-
 logger = getLogger(__name__)
 
 
@@ -36,6 +35,10 @@ class ChannelsEnvelopeConfig(AppConfig):
         self.check_registries_names()
         self.check_rq_config()
         self.check_layer_config()
+        if getattr(settings, "ENVELOPE_FREEZE_REGISTRIES", True):
+            from envelope.registries import freeze_registries
+
+            freeze_registries()
 
     @staticmethod
     def check_settings_and_import():
@@ -102,6 +105,11 @@ class ChannelsEnvelopeConfig(AppConfig):
         Traceback (most recent call last):
         ...
         django.core.exceptions.ImproperlyConfigured:
+        >>> with override_settings(ENVELOPE_QUEUE_ROUTES={'bulk': ['nope']}):
+        ...     ChannelsEnvelopeConfig.check_rq_config()
+        Traceback (most recent call last):
+        ...
+        django.core.exceptions.ImproperlyConfigured: settings.ENVELOPE_QUEUE_ROUTES route 'bulk' uses queue 'nope' ...
         """
         from envelope.utils import get_global_message_registry
         from envelope.deferred_jobs.message import DeferredJob
@@ -115,6 +123,13 @@ class ChannelsEnvelopeConfig(AppConfig):
                         raise ImproperlyConfigured(
                             f"Message {msg} set to queue {msg.queue} which doesn't exist in settings.RQ_QUEUES"
                         )
+        routes = getattr(settings, "ENVELOPE_QUEUE_ROUTES", None) or {}
+        for route, queue_names in routes.items():
+            for queue_name in queue_names:
+                if queue_name not in rq_queues:
+                    raise ImproperlyConfigured(
+                        f"settings.ENVELOPE_QUEUE_ROUTES route '{route}' uses queue '{queue_name}' which doesn't exist in RQ_QUEUES"
+                    )
         for name in ("ENVELOPE_TIMESTAMP_QUEUE", "ENVELOPE_CONNECTIONS_QUEUE"):
             if queue_name := getattr(settings, name, None):
                 if queue_name not in rq_queues:
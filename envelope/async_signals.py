@@ -1,9 +1,22 @@
 from __future__ import annotations
 
-from async_signals import Signal
+import asyncio
+import weakref
+from collections.abc import Callable
+from collections.abc import Hashable
+from typing import Any
+from typing import NamedTuple
 
+from async_signals import Signal
+from async_signals.dispatcher import NONE_ID
+from async_signals.dispatcher import _make_id
+from async_signals.dispatcher import logger
+from django.conf import settings
 
 __all__ = (
+    "MessageSignal",
+    "message_types",
+    "concurrent",
     "consumer_connected",
     "consumer_closed",
     "incoming_internal_message",
@@ -13,9 +26,274 @@ __all__ = (
 )
 
 
+# Marks receivers that didn't run
+_not_run = object()
+
+
+def message_types(*types: type):
+    """
+    Decorator for receivers of message signals, the receiver will only be called for these message types.
+    Must be applied before the receiver is connected, i.e. below @receiver.
+
+    >>> from envelope.core.message import AsyncRunnable
+    >>> @message_types(AsyncRunnable)
+    ... async def hello(**kwargs):
+    ...     pass
+    >>> hello.message_types
+    (<class 'envelope.core.message.AsyncRunnable'>,)
+    """
+
+    def _inner(func):
+        func.message_types = types
+        return func
+
+    return _inner
+
+
+class Plan(NamedTuple):
+    # (receiver or weak reference to it, is weak, is coroutine function, is concurrent)
+    receivers: tuple[tuple[Callable, bool, bool, bool], ...]
+    # Any receivers marked as concurrent?
+    concurrent: bool
+
+
+def concurrent(func):
+    """
+    Decorator for receivers of message signals that don't depend on other receivers,
+    and that other receivers don't depend on. Concurrent receivers are run with asyncio.gather
+    alongside the rest, which still run one after another in the order they were connected.
+    Must be applied before the receiver is connected, i.e. below @receiver.
+
+    >>> @concurrent
+    ... async def hello(**kwargs):
+    ...     pass
+    >>> hello.concurrent
+    True
+    """
+    func.concurrent = True
+    return func
+
+
+class MessageSignal(Signal):
+    """
+    Signal where the sender is the message class.
+    The receivers that apply to each message class are worked out once and kept as a plan,
+    which is cleared whenever receivers connect or disconnect.
+    Receivers may declare which message types they're for with @message_types,
+    and that they may run concurrently with other receivers with @concurrent.
+    Set ENVELOPE_CONCURRENT_RECEIVERS to False to run all receivers in order.
+
+    Receivers are only checked when they're connected if debug is on.
+    It defaults to ENVELOPE_SIGNAL_DEBUG, or DEBUG if that isn't set.
+
+    Plans are built from the receiver list of async_signals.Signal and its private helpers,
+    so the async-signals version is pinned in pyproject.toml.
+
+    >>> from envelope.messages.ping import Ping
+    >>> from envelope.messages.ping import Pong
+    >>> from envelope.core.message import AsyncRunnable
+    >>> signal = MessageSignal()
+    >>> @message_types(AsyncRunnable)
+    ... async def runnable_receiver(**kwargs):
+    ...     return 'Runnable'
+    >>> signal.connect(runnable_receiver)
+    >>> signal.has_listeners(Ping)
+    True
+    >>> signal.has_listeners(Pong)
+    False
+    """
+
+    plans: dict[Hashable, Plan]
+
+    def __init__(self, debug: bool | None = None):
+        self.plans = {}
+        super().__init__(debug=debug)
+
+    @property
+    def debug(self) -> bool:
+        if self._debug is None:
+            return getattr(settings, "ENVELOPE_SIGNAL_DEBUG", settings.DEBUG)
+        return self._debug
+
+    @debug.setter
+    def debug(self, value: bool | None):
+        self._debug = value
+
+    def connect(self, *args, **kwargs) -> None:
+        super().connect(*args, **kwargs)
+        self.plans.clear()
+
+    def disconnect(self, *args, **kwargs) -> bool:
+        result = super().disconnect(*args, **kwargs)
+        self.plans.clear()
+        return result
+
+    def _remove_receiver(self, receiver: Callable | None = None) -> None:
+        super()._remove_receiver(receiver)
+        self.plans.clear()
+
+    def get_plan(self, sender: Hashable) -> Plan:
+        try:
+            return self.plans[sender]
+        except KeyError:
+            pass
+        receivers = []
+        with self.lock:
+            self._clear_dead_receivers()
+            senderkey = _make_id(sender)
+            for (_receiverkey, r_senderkey), receiver in self.receivers:
+                if r_senderkey != NONE_ID and r_senderkey != senderkey:
+                    continue
+                is_weak = isinstance(receiver, weakref.ReferenceType)
+                func = receiver() if is_weak else receiver
+                if func is None:
+                    continue
+                types = getattr(func, "message_types", None)
+                if types and not (
+                    isinstance(sender, type) and issubclass(sender, types)
+                ):
+                    continue
+                receivers.append(
+                    (
+                        receiver,
+                        is_weak,
+                        asyncio.iscoroutinefunction(func),
+                        getattr(func, "concurrent", False),
+                    )
+                )
+        plan = self.plans[sender] = Plan(
+            receivers=tuple(receivers),
+            concurrent=any(x[3] for x in receivers),
+        )
+        return plan
+
+    def has_listeners(self, sender: Hashable | None = None) -> bool:
+        return bool(self.get_plan(sender).receivers)
+
+    def get_receivers(self, sender: Hashable) -> list[Callable]:
+        """
+        Receivers that will be called for sender, in order.
+        """
+        return [x[0] for x in self._live_receivers_from_plan(self.get_plan(sender))]
+
+    @staticmethod
+    def _live_receivers_from_plan(plan: Plan):
+        for receiver, is_weak, is_coroutine, is_concurrent in plan.receivers:
+            if is_weak:
+                receiver = receiver()
+                if receiver is None:
+                    continue
+            yield receiver, is_coroutine, is_concurrent
+
+    async def _call(self, receiver, is_coroutine: bool, sender: Hashable, named: dict):
+        if is_coroutine:
+            return await receiver(signal=self, sender=sender, **named)
+        return receiver(signal=self, sender=sender, **named)
+
+    @staticmethod
+    def _log_error(receiver, err: Exception):
+        logger.error(
+            "Error calling %s when sending signal (%s)",
+            receiver.__qualname__,
+            err,
+            exc_info=err,
+        )
+
+    async def send(self, sender: Hashable, **named: Any) -> list[tuple[Callable, Any]]:
+        """
+        >>> from envelope.messages.ping import Ping
+        >>> from envelope.messages.ping import Pong
+        >>> from asgiref.sync import async_to_sync
+        >>> signal = MessageSignal()
+        >>> def sync_receiver(sender, **kwargs):
+        ...     return sender.name
+        >>> signal.connect(sync_receiver)
+        >>> async_to_sync(signal.send)(Pong, message=Pong())
+        [(<function sync_receiver at ...>, 's.pong')]
+        """
+        plan = self.get_plan(sender)
+        if plan.concurrent and getattr(settings, "ENVELOPE_CONCURRENT_RECEIVERS", True):
+            return await self._send_concurrent(plan, sender, named, robust=False)
+        responses = []
+        for receiver, is_coroutine, _ in self._live_receivers_from_plan(plan):
+            response = await self._call(receiver, is_coroutine, sender, named)
+            responses.append((receiver, response))
+        return responses
+
+    async def send_robust(
+        self, sender: Hashable, **named: Any
+    ) -> list[tuple[Callable, Any]]:
+        plan = self.get_plan(sender)
+        if plan.concurrent and getattr(settings, "ENVELOPE_CONCURRENT_RECEIVERS", True):
+            return await self._send_concurrent(plan, sender, named, robust=True)
+        responses = []
+        for receiver, is_coroutine, _ in self._live_receivers_from_plan(plan):
+            try:
+                response = await self._call(receiver, is_coroutine, sender, named)
+            except Exception as err:
+                self._log_error(receiver, err)
+                responses.append((receiver, err))
+            else:
+                responses.append((receiver, response))
+        return responses
+
+    async def _send_concurrent(
+        self, plan: Plan, sender: Hashable, named: dict, robust: bool
+    ) -> list[tuple[Callable, Any]]:
+        """
+        Run ordered receivers one after another, concurrently with each of the concurrent receivers.
+        Exceptions are logged per receiver. Unless robust, the ordered receivers stop at the first exception,
+        and the first exception (in connected order) is raised when all are done.
+        """
+        receivers = list(self._live_receivers_from_plan(plan))
+        results = [_not_run] * len(receivers)
+
+        async def run_ordered():
+            for i, (receiver, is_coroutine, is_concurrent) in enumerate(receivers):
+                if is_concurrent:
+                    continue
+                try:
+                    results[i] = await self._call(receiver, is_coroutine, sender, named)
+                except Exception as err:
+                    results[i] = err
+                    if not robust:
+                        return
+
+        concurrent_indexes = [i for i, x in enumerate(receivers) if x[2]]
+        # Concurrent receivers are started first, so anything that runs to completion
+        # without awaiting behaves the same way as when receivers run in order.
+        outcomes = await asyncio.gather(
+            *(
+                self._call(receivers[i][0], receivers[i][1], sender, named)
+                for i in concurrent_indexes
+            ),
+            run_ordered(),
+            return_exceptions=True,
+        )
+        for i, outcome in zip(concurrent_indexes, outcomes):
+            if isinstance(outcome, BaseException) and not isinstance(
+                outcome, Exception
+            ):
+                raise outcome
+            results[i] = outcome
+        responses = []
+        first_error = None
+        for (receiver, _, _), result in zip(receivers, results):
+            if result is _not_run:
+                continue
+            if isinstance(result, Exception):
+                self._log_error(receiver, result)
+                if first_error is None:
+                    first_error = result
+            responses.append((receiver, result))
+        if first_error is not None and not robust:
+            raise first_error
+        return responses
+
+
 consumer_connected = Signal(debug=True)
 consumer_closed = Signal(debug=True)
-incoming_websocket_message = Signal(debug=True)
-outgoing_websocket_message = Signal(debug=True)
-outgoing_websocket_error = Signal(debug=True)
-incoming_internal_message = Signal(debug=True)
+incoming_websocket_message = MessageSignal()
+outgoing_websocket_message = MessageSignal()
+outgoing_websocket_error = MessageSignal()
+incoming_internal_message = MessageSignal()
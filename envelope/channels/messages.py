@@ -1,11 +1,11 @@
 from __future__ import annotations
 
 from typing import TYPE_CHECKING
-from asgiref.sync import async_to_sync
 from pydantic import BaseModel
 
 from envelope import Error
 from envelope import INTERNAL
+from envelope import Priority
 from envelope import WS_INCOMING
 from envelope import WS_OUTGOING
 from envelope.channels.models import AppState
@@ -18,6 +18,7 @@ from envelope.core.message import AsyncRunnable
 from envelope.decorators import add_message
 from envelope.core.message import Message
 from envelope.deferred_jobs.message import DeferredJob
+from envelope.sender_loop import run_sync
 from envelope.signals import channel_subscribed
 from envelope.utils import get_error_type
 from envelope.utils import websocket_send
@@ -43,6 +44,29 @@ class ChannelCommand:
     schema = ChannelSchema
     data: ChannelSchema
 
+    def ordering_key(self) -> tuple:
+        """
+        Commands for the same channel are kept in order, regardless of type.
+        Passthrough commands haven't been validated yet, so their raw payload is used.
+
+        >>> class LazySubscribe(Subscribe):
+        ...     passthrough = True
+        >>> LazySubscribe.from_payload(mm={}, data={'pk': 1, 'channel_type': 'user'}).ordering_key()
+        ('channel', 'user', 1)
+        >>> LazySubscribe.from_payload(mm={}, data={'pk': [1]}).ordering_key()
+        ('type', 'channel.subscribe')
+        """
+        if self.data is not None:
+            return ("channel", self.data.channel_type, self.data.pk)
+        raw = getattr(self, "raw_data", None) or {}
+        key = ("channel", raw.get("channel_type"), raw.get("pk"))
+        try:
+            hash(key)
+        except TypeError:
+            # Will fail validation on the worker anyway
+            return super().ordering_key()
+        return key
+
     def get_channel(
         self, channel_type: str, pk: int, consumer_name: str
     ) -> ContextChannel:
@@ -56,6 +80,7 @@ class Subscribe(ChannelCommand, DeferredJob):
     name = SUBSCRIBE
     ttl = 20
     job_timeout = 20
+    priority = Priority.INTERACTIVE
 
     def get_app_state(self, channel: ContextChannel) -> list | None:
         """
@@ -92,7 +117,7 @@ class Subscribe(ChannelCommand, DeferredJob):
             self.data.channel_type, self.data.pk, self.mm.consumer_name
         )
         if channel.allow_subscribe(self.user):
-            async_to_sync(channel.subscribe)()
+            run_sync(channel.subscribe)
             app_state = self.get_app_state(channel)
             data_dict = self.data.dict()
             msg = Subscribed.from_message(
@@ -151,6 +176,7 @@ class Subscribed(AsyncRunnable):
     name = SUBSCRIBED
     schema = ChannelSubscription
     data: ChannelSubscription
+    trusted = True
 
     async def run(self, *, consumer: WebsocketConsumer, **kwargs):
         assert consumer
@@ -163,6 +189,7 @@ class Left(AsyncRunnable):
     name = LEFT
     schema = ChannelSchema
     data: ChannelSchema
+    trusted = True
 
     async def run(self, *, consumer: WebsocketConsumer, **kwargs):
         assert consumer
@@ -186,6 +213,7 @@ class Subscriptions(Message):
     name = SUBSCRIPTIONS
     schema = SubscriptionsSchema
     data: SubscriptionsSchema
+    trusted = True
 
 
 class RecheckSubscriptionsSchema(SubscriptionsSchema):
@@ -234,7 +262,7 @@ class RecheckChannelSubscriptions(DeferredJob):
                 raise ValueError("consumer_name shouldn't be none here")
             ch = ch_class(channel_info.pk, consumer_channel=self.data.consumer_name)
             if not ch.allow_subscribe(self.user):
-                async_to_sync(ch.leave)()
+                run_sync(ch.leave)
                 msg = Left.from_message(
                     self,
                     state=self.SUCCESS,
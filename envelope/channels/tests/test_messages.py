@@ -289,6 +289,7 @@ class RecheckChannelSubscriptionsTests(TestCase):
         self.assertEqual([sub_bad], response)
         self.assertTrue(mocked_send.called)
         payload = mocked_send.mock_calls[0].args[1]
+        self.assertIsInstance(payload.pop("e"), str)  # Unique event key
         self.assertEqual(
             {
                 "text_data": '{"t": "channel.left", "p": {"pk": -1, "channel_type": "user"}, "i": null, "s": "s"}',
@@ -296,6 +297,7 @@ class RecheckChannelSubscriptionsTests(TestCase):
                 "i": None,
                 "t": "channel.left",
                 "s": "s",
+                "p": {"pk": -1, "channel_type": "user"},
             },
             payload,
         )
@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from collections import deque
+from collections.abc import Awaitable
+from collections.abc import Callable
+from collections.abc import Hashable
+from typing import TYPE_CHECKING
+
+from django.conf import settings
+
+if TYPE_CHECKING:
+    from envelope.core.message import Message
+
+__all__ = (
+    "Overflow",
+    "MessagePipeline",
+    "get_pipeline",
+)
+
+logger = logging.getLogger(__name__)
+
+
+# What to do with incoming messages when the pipeline is full
+class Overflow:
+    WAIT = "wait"  # Stop reading from the socket until there's room
+    ERROR = "error"  # Drop the message and send error.bad_request
+    CLOSE = "close"  # Close the connection
+
+
+class MessagePipeline:
+    """
+    Handles incoming messages for one consumer as tasks, so one slow message won't stall the others.
+    At most concurrency messages are handled at the same time, and at most max_pending
+    are in flight (running or waiting). Messages with the same ordering key are handled
+    one after another in the order they were submitted, see Message.ordering_key.
+
+    >>> from envelope.messages.ping import Ping
+    >>> from asgiref.sync import async_to_sync
+    >>> handled = []
+    >>> async def handler(message):
+    ...     handled.append(message.mm.id)
+    >>> pipeline = MessagePipeline(handler, concurrency=2, max_pending=2)
+    >>> async def run():
+    ...     for i in 'abc':
+    ...         print(pipeline.submit(Ping(mm={'id': i})))
+    ...     await pipeline.join()
+    >>> async_to_sync(run)()
+    True
+    True
+    False
+    >>> handled
+    ['a', 'b']
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[Message], Awaitable],
+        *,
+        concurrency: int,
+        max_pending: int,
+        overflow: str = Overflow.ERROR,
+    ):
+        self.handler = handler
+        self.concurrency = concurrency
+        self.max_pending = max_pending
+        self.overflow = overflow
+        self.semaphore = asyncio.Semaphore(concurrency)
+        # Messages waiting or running by ordering key. The running one is first.
+        self.queues: dict[Hashable, deque[Message]] = {}
+        self.tasks: set[asyncio.Task] = set()
+        self.pending = 0
+        self.closed = False
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._space = asyncio.Event()
+        self._space.set()
+
+    @property
+    def full(self) -> bool:
+        return self.pending >= self.max_pending
+
+    def submit(self, message: Message) -> bool:
+        """
+        Schedule message, returns False if the pipeline is full or closed.
+        """
+        if self.closed or self.full:
+            return False
+        key = message.ordering_key()
+        self.pending += 1
+        self._idle.clear()
+        if self.full:
+            self._space.clear()
+        if key is None:
+            self._start(deque([message]))
+        elif key in self.queues:
+            self.queues[key].append(message)
+        else:
+            self.queues[key] = queue = deque([message])
+            self._start(queue, key)
+        return True
+
+    def _start(self, queue: deque[Message], key: Hashable | None = None):
+        task = asyncio.create_task(self._run(queue, key))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _run(self, queue: deque[Message], key: Hashable | None):
+        try:
+            while queue and not self.closed:
+                message = queue[0]
+                try:
+                    async with self.semaphore:
+                        await self.handler(message)
+                except Exception:
+                    logger.exception("Error handling %s", message.name)
+                finally:
+                    queue.popleft()
+                    self._done()
+        finally:
+            if queue:
+                # Closed or cancelled, drop the rest
+                self._done(len(queue))
+                queue.clear()
+            if key is not None and self.queues.get(key) is queue:
+                del self.queues[key]
+
+    def _done(self, count: int = 1):
+        self.pending -= count
+        if not self.full:
+            self._space.set()
+        if not self.pending:
+            self._idle.set()
+
+    async def wait_for_space(self):
+        await self._space.wait()
+
+    async def join(self):
+        """
+        Wait until all messages have been handled.
+        """
+        await self._idle.wait()
+
+    def close(self):
+        """
+        Drop messages that haven't started, the ones running will finish.
+        """
+        if self.pending:
+            logger.debug("Closing with %s messages pending", self.pending)
+        self.closed = True
+
+
+def get_pipeline(handler: Callable[[Message], Awaitable]) -> MessagePipeline | None:
+    """
+    Pipeline for a consumer if ENVELOPE_PIPELINE_CONCURRENCY is set.
+    """
+    concurrency = getattr(settings, "ENVELOPE_PIPELINE_CONCURRENCY", None)
+    if not concurrency:
+        return None
+    return MessagePipeline(
+        handler,
+        concurrency=concurrency,
+        max_pending=getattr(settings, "ENVELOPE_PIPELINE_MAX_PENDING", 100),
+        overflow=getattr(settings, "ENVELOPE_PIPELINE_OVERFLOW", Overflow.ERROR),
+    )
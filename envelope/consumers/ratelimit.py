@@ -0,0 +1,175 @@
+from __future__ import annotations
+
+from collections import Counter
+from time import monotonic
+from weakref import WeakValueDictionary
+
+from django.conf import settings
+
+__all__ = (
+    "RateLimitAction",
+    "TokenBucket",
+    "RateLimiter",
+    "rejections",
+    "get_rejections",
+    "get_rate_limiter",
+)
+
+# Rejected frames by (scope, message type), where scope is "consumer" or "user".
+# Type is "*" for the limit on all frames.
+rejections: Counter[tuple[str, str]] = Counter()
+
+# Buckets shared by all consumers of a user within this process, by (user_pk, message type).
+# Buckets are kept as long as some consumer uses them.
+_user_buckets: WeakValueDictionary[tuple[int, str], TokenBucket] = WeakValueDictionary()
+
+ALL_TYPES = "*"
+
+
+# What to do with frames over the limit
+class RateLimitAction:
+    DROP = "drop"  # Ignore the frame
+    ERROR = "error"  # Send error.bad_request
+    CLOSE = "close"  # Close the connection with 1008 (policy violation)
+
+
+class TokenBucket:
+    """
+    Allows rate frames per second on average, and burst frames at once.
+
+    >>> bucket = TokenBucket(rate=1, burst=2)
+    >>> bucket.consume(now=0.0), bucket.consume(now=0.0), bucket.consume(now=0.0)
+    (True, True, False)
+    >>> bucket.consume(now=1.0)
+    True
+    >>> bucket.has_token(now=2.0), bucket.has_token(now=2.0)
+    (True, True)
+    """
+
+    __slots__ = ("rate", "burst", "tokens", "updated", "__weakref__")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated: float | None = None
+
+    def has_token(self, now: float | None = None) -> bool:
+        """
+        Refill and check without consuming anything.
+        """
+        if now is None:
+            now = monotonic()
+        if self.updated is not None:
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.updated) * self.rate
+            )
+        self.updated = now
+        return self.tokens >= 1
+
+    def consume(self, now: float | None = None) -> bool:
+        if self.has_token(now):
+            self.tokens -= 1
+            return True
+        return False
+
+
+class RateLimiter:
+    """
+    Token bucket limits for one consumer, per consumer and per user.
+    Limits are dicts of message type to (rate per second, burst).
+    "*" is a limit on all frames, checked in addition to the limit for the type.
+
+    >>> limiter = RateLimiter(consumer={'*': (10, 2), 's.ping': (1, 1)})
+    >>> limiter.allow('s.ping', None)
+    True
+    >>> limiter.allow('s.ping', None)
+    False
+    >>> limiter.allow('other', None)
+    True
+    >>> limiter.allow(None, None)
+    False
+    >>> limiter.rejected
+    2
+    """
+
+    def __init__(
+        self,
+        *,
+        consumer: dict[str, tuple[float, float]] | None = None,
+        user: dict[str, tuple[float, float]] | None = None,
+        action: str = RateLimitAction.ERROR,
+    ):
+        self.consumer_limits = consumer or {}
+        self.user_limits = user or {}
+        self.action = action
+        self.buckets: dict[tuple[str, str], TokenBucket] = {}
+        self.rejected = 0
+
+    def get_bucket(self, scope: str, msg_type: str, user_pk: int | None):
+        key = (scope, msg_type)
+        try:
+            return self.buckets[key]
+        except KeyError:
+            pass
+        if scope == "user":
+            rate, burst = self.user_limits[msg_type]
+            bucket = _user_buckets.get((user_pk, msg_type))
+            if bucket is None:
+                bucket = _user_buckets[(user_pk, msg_type)] = TokenBucket(rate, burst)
+        else:
+            rate, burst = self.consumer_limits[msg_type]
+            bucket = TokenBucket(rate, burst)
+        self.buckets[key] = bucket
+        return bucket
+
+    def allow(
+        self, msg_type: str | None, user_pk: int | None, *, all_types: bool = True
+    ) -> bool:
+        """
+        Check frame against all limits that apply. msg_type is None if it's unknown,
+        in which case only limits on all frames apply. Without all_types, only the limits
+        for msg_type are checked, for frames that were already counted.
+        Tokens are only taken if every limit allows the frame, so a rejected frame
+        doesn't use up any other budget.
+        """
+        now = monotonic()
+        keys = (msg_type, ALL_TYPES) if all_types else (msg_type,)
+        buckets = []
+        for scope, limits in (
+            ("consumer", self.consumer_limits),
+            ("user", self.user_limits if user_pk is not None else {}),
+        ):
+            for key in keys:
+                if key is None or key not in limits:
+                    continue
+                bucket = self.get_bucket(scope, key, user_pk)
+                if not bucket.has_token(now):
+                    self.rejected += 1
+                    rejections[(scope, key)] += 1
+                    return False
+                buckets.append(bucket)
+        for bucket in buckets:
+            bucket.tokens -= 1
+        return True
+
+
+def get_rejections() -> dict[tuple[str, str], int]:
+    """
+    Rejected frames in this process by (scope, message type), for monitoring.
+    """
+    return dict(rejections)
+
+
+def get_rate_limiter() -> RateLimiter | None:
+    """
+    Rate limiter for a consumer if ENVELOPE_RATE_LIMITS is set.
+    """
+    limits = getattr(settings, "ENVELOPE_RATE_LIMITS", None)
+    if not limits:
+        return None
+    return RateLimiter(
+        consumer=limits.get("consumer"),
+        user=limits.get("user"),
+        action=getattr(settings, "ENVELOPE_RATE_LIMIT_ACTION", RateLimitAction.ERROR),
+    )
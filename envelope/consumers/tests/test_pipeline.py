@@ -0,0 +1,121 @@
+import asyncio
+
+from django.test import SimpleTestCase
+
+from envelope.channels.messages import Leave
+from envelope.channels.messages import Subscribe
+from envelope.messages.ping import Ping
+from envelope.messages.ping import Pong
+
+
+class MessagePipelineTests(SimpleTestCase):
+    def setUp(self):
+        self.events = []
+        self.running = 0
+        self.max_running = 0
+
+    @property
+    def _cut(self):
+        from envelope.consumers.pipeline import MessagePipeline
+
+        return MessagePipeline
+
+    async def handler(self, message):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        self.events.append(f"{message.mm.id} start")
+        await asyncio.sleep(0.01)
+        self.events.append(f"{message.mm.id} end")
+        self.running -= 1
+        if message.mm.id == "bad":
+            raise ValueError("bad")
+
+    def _mk_one(self, concurrency=2, max_pending=10):
+        return self._cut(self.handler, concurrency=concurrency, max_pending=max_pending)
+
+    async def test_same_key_ordered(self):
+        pipeline = self._mk_one()
+        for i in "abc":
+            self.assertTrue(pipeline.submit(Ping(mm={"id": i})))
+        await pipeline.join()
+        self.assertEqual(
+            ["a start", "a end", "b start", "b end", "c start", "c end"], self.events
+        )
+        self.assertEqual({}, pipeline.queues)
+        self.assertEqual(0, pipeline.pending)
+
+    async def test_different_keys_concurrent(self):
+        pipeline = self._mk_one()
+        pipeline.submit(Ping(mm={"id": "a"}))
+        pipeline.submit(Pong(mm={"id": "b"}))
+        await pipeline.join()
+        self.assertEqual(["a start", "b start", "a end", "b end"], self.events)
+
+    async def test_concurrency_limit(self):
+        pipeline = self._mk_one(concurrency=2)
+        for i in "abcd":
+            msg = Ping(mm={"id": i})
+            msg.ordering = "none"
+            pipeline.submit(msg)
+        await pipeline.join()
+        self.assertEqual(2, self.max_running)
+        self.assertEqual(8, len(self.events))
+
+    async def test_channel_commands_share_key(self):
+        subscribe = Subscribe(mm={"id": "a"}, pk=1, channel_type="user")
+        leave = Leave(mm={"id": "b"}, pk=1, channel_type="user")
+        other = Leave(mm={"id": "c"}, pk=2, channel_type="user")
+        self.assertEqual(subscribe.ordering_key(), leave.ordering_key())
+        pipeline = self._mk_one()
+        for msg in (subscribe, leave, other):
+            pipeline.submit(msg)
+        await pipeline.join()
+        self.assertLess(self.events.index("a end"), self.events.index("b start"))
+        self.assertLess(self.events.index("c start"), self.events.index("a end"))
+
+    async def test_passthrough_channel_command(self):
+        class LazySubscribe(Subscribe):
+            passthrough = True
+
+        subscribe = LazySubscribe.from_payload(
+            mm={"id": "a"}, data={"pk": 1, "channel_type": "user"}
+        )
+        leave = Leave(mm={"id": "b"}, pk=1, channel_type="user")
+        self.assertIsNone(subscribe.data)
+        self.assertEqual(leave.ordering_key(), subscribe.ordering_key())
+        pipeline = self._mk_one()
+        for msg in (subscribe, leave):
+            self.assertTrue(pipeline.submit(msg))
+        await pipeline.join()
+        self.assertEqual(["a start", "a end", "b start", "b end"], self.events)
+
+    async def test_full(self):
+        pipeline = self._mk_one(max_pending=2)
+        self.assertTrue(pipeline.submit(Ping(mm={"id": "a"})))
+        self.assertTrue(pipeline.submit(Ping(mm={"id": "b"})))
+        self.assertTrue(pipeline.full)
+        self.assertFalse(pipeline.submit(Ping(mm={"id": "c"})))
+        await pipeline.wait_for_space()
+        self.assertFalse(pipeline.full)
+        self.assertTrue(pipeline.submit(Ping(mm={"id": "c"})))
+        await pipeline.join()
+        self.assertEqual(6, len(self.events))
+
+    async def test_error_logged_and_continues(self):
+        pipeline = self._mk_one()
+        with self.assertLogs("envelope.consumers.pipeline", level="ERROR"):
+            pipeline.submit(Ping(mm={"id": "bad"}))
+            pipeline.submit(Ping(mm={"id": "a"}))
+            await pipeline.join()
+        self.assertEqual(["bad start", "bad end", "a start", "a end"], self.events)
+
+    async def test_close(self):
+        pipeline = self._mk_one()
+        for i in "abc":
+            pipeline.submit(Ping(mm={"id": i}))
+        await asyncio.sleep(0)
+        pipeline.close()
+        self.assertFalse(pipeline.submit(Ping(mm={"id": "d"})))
+        await pipeline.join()
+        self.assertEqual(["a start", "a end"], self.events)
+        self.assertEqual(0, pipeline.pending)
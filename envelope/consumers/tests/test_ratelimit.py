@@ -0,0 +1,43 @@
+from django.test import SimpleTestCase
+
+from envelope.consumers.ratelimit import RateLimiter
+from envelope.consumers.ratelimit import get_rejections
+
+
+class RateLimiterTests(SimpleTestCase):
+    def test_user_buckets_shared(self):
+        limits = {"s.ping": (0.001, 2)}
+        first = RateLimiter(user=limits)
+        second = RateLimiter(user=limits)
+        other_user = RateLimiter(user=limits)
+        before = get_rejections().get(("user", "s.ping"), 0)
+        self.assertTrue(first.allow("s.ping", 1))
+        self.assertTrue(second.allow("s.ping", 1))
+        self.assertFalse(first.allow("s.ping", 1))
+        self.assertFalse(second.allow("s.ping", 1))
+        self.assertTrue(other_user.allow("s.ping", 2))
+        self.assertEqual(1, first.rejected)
+        self.assertEqual(before + 2, get_rejections()[("user", "s.ping")])
+
+    def test_user_limits_need_user(self):
+        limiter = RateLimiter(user={"*": (0.001, 1)})
+        for _ in range(3):
+            self.assertTrue(limiter.allow("s.ping", None))
+
+    def test_unknown_type(self):
+        limiter = RateLimiter(consumer={"s.ping": (0.001, 1)})
+        for _ in range(3):
+            self.assertTrue(limiter.allow(None, None))
+
+    def test_rejected_frame_not_charged(self):
+        limiter = RateLimiter(
+            consumer={"*": (0.001, 2), "s.ping": (0.001, 2)}, user={"*": (0.001, 1)}
+        )
+        other_connection = RateLimiter(user={"*": (0.001, 1)})
+        self.assertTrue(other_connection.allow("s.ping", 13))
+        # The user is throttled, so the consumers own budget is left as it was
+        for _ in range(3):
+            self.assertFalse(limiter.allow("s.ping", 13))
+        self.assertEqual(3, limiter.rejected)
+        self.assertLess(1.99, limiter.buckets[("consumer", "*")].tokens)
+        self.assertLess(1.99, limiter.buckets[("consumer", "s.ping")].tokens)
@@ -1,4 +1,7 @@
+import asyncio
+from copy import deepcopy
 from json import loads
+from unittest.mock import patch
 
 from asgiref.sync import sync_to_async
 from django.contrib.auth import get_user_model
@@ -16,8 +19,13 @@ from envelope.async_signals import outgoing_websocket_message
 from envelope.channels.messages import Leave
 from envelope.channels.messages import ListSubscriptions
 from envelope.channels.messages import Subscribe
+from envelope.channels.schemas import ChannelSchema
+from envelope.core.codecs import MsgPackCodec
+from envelope.core.compression import ZlibCompressor
 from envelope.envelopes import incoming
 from envelope.envelopes import outgoing
+from envelope.messages.common import ProgressNum
+from envelope.messages.common import Status
 from envelope.messages.errors import MessageTypeError
 from envelope.messages.errors import ValidationErrorMsg
 from envelope.messages.ping import Ping
@@ -383,3 +391,488 @@ class WebsocketConsumerTests(TransactionTestCase):
             payload = outgoing.parse(response)
             message = outgoing.unpack(payload)
             self.assertEqual(lang, message.data.lang)
+
+
+@override_settings(
+    CHANNEL_LAYERS=testing_channel_layers_setting, ENVELOPE_CONNECTIONS_QUEUE=None
+)
+class WebsocketSendFanOutTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="hello")
+
+    def _mk_event(self):
+        from envelope.channels.messages import Subscribed
+
+        msg = Subscribed(
+            mm={"id": "a", "state": "s"},
+            pk=self.user.pk,
+            channel_type="user",
+            channel_name=f"user_{self.user.pk}",
+        )
+        return outgoing.transport(outgoing, msg)
+
+    async def test_event_has_structured_data(self):
+        event = self._mk_event()
+        self.assertIn("e", event)
+        self.assertEqual(loads(event["text_data"])["p"], event["p"])
+
+    async def test_plain_payload_not_decoded(self):
+        with patch.object(outgoing.codec, "loads") as mock_loads:
+            event = self._mk_event()
+        self.assertFalse(mock_loads.called)
+        self.assertEqual(loads(event["text_data"])["p"], event["p"])
+
+    async def test_consumers_share_payload(self):
+        event = self._mk_event()
+        consumers = [
+            mk_consumer(consumer_name=f"c{i}", user=self.user) for i in range(3)
+        ]
+        messages = []
+
+        async def msg_check(*, message, consumer, **kwargs):
+            messages.append((message, consumer))
+
+        with TempSignal(outgoing_websocket_message, msg_check):
+            with patch.object(outgoing, "parse") as mock_parse:
+                for consumer in consumers:
+                    with patch.object(consumer, "send") as mock_send:
+                        # Each consumer gets its own copy from the layer
+                        await consumer.websocket_send(deepcopy(event))
+                    mock_send.assert_called_once_with(text_data=event["text_data"])
+        self.assertFalse(mock_parse.called)
+        self.assertEqual(3, len(messages))
+        first_data = messages[0][0].data
+        for message, consumer in messages:
+            self.assertIs(first_data, message.data)
+            self.assertEqual(consumer.channel_name, message.mm.consumer_name)
+            self.assertEqual("a", message.mm.id)
+            self.assertIn(
+                ChannelSchema(pk=self.user.pk, channel_type="user"),
+                consumer.subscriptions,
+            )
+
+    async def test_event_without_structured_data(self):
+        event = self._mk_event()
+        del event["p"]
+        del event["e"]
+        consumer = mk_consumer(user=self.user)
+        with patch.object(consumer, "send"):
+            await consumer.websocket_send(event)
+        self.assertEqual(1, len(consumer.subscriptions))
+
+
+@override_settings(
+    CHANNEL_LAYERS=testing_channel_layers_setting,
+    ENVELOPE_CONNECTIONS_QUEUE=None,
+    ENVELOPE_SUBPROTOCOLS={"envelope.msgpack": "envelope.core.codecs.MsgPackCodec"},
+)
+class SubprotocolCodecTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="hello")
+        self.client.force_login(self.user)
+        self.codec = MsgPackCodec()
+
+    async def test_binary_ping_pong(self):
+        communicator = await mk_communicator(
+            self.client, subprotocols=["other", "envelope.msgpack"]
+        )
+        await communicator.send_to(
+            bytes_data=self.codec.dumps({"t": "s.ping", "i": "a"})
+        )
+        response = await communicator.receive_from()
+        self.assertIsInstance(response, bytes)
+        self.assertEqual(
+            {"t": "s.pong", "p": None, "i": "a", "s": "s"}, self.codec.loads(response)
+        )
+        await communicator.disconnect()
+
+    async def test_binary_validation_error(self):
+        communicator = await mk_communicator(
+            self.client, subprotocols=["envelope.msgpack"]
+        )
+        await communicator.send_to(bytes_data=b"\xc1")
+        response = self.codec.loads(await communicator.receive_from())
+        self.assertEqual("error.validation", response["t"])
+        await communicator.disconnect()
+
+    async def test_text_without_subprotocol(self):
+        communicator = await mk_communicator(self.client)
+        await communicator.send_to(text_data='{"t": "s.ping"}')
+        response = await communicator.receive_from()
+        self.assertIsInstance(response, str)
+        await communicator.disconnect()
+
+    async def test_websocket_send_uses_frames(self):
+        consumer = mk_consumer(user=self.user)
+        consumer.scope = {"subprotocols": ["envelope.msgpack"]}
+        self.assertEqual("envelope.msgpack", consumer.select_subprotocol())
+        event = outgoing.transport(outgoing, Pong(mm={"id": "a"}))
+        self.assertIn("msgpack", event["frames"])
+        with patch.object(consumer, "send") as mock_send:
+            await consumer.websocket_send(event)
+        mock_send.assert_called_once_with(bytes_data=event["frames"]["msgpack"])
+        # Encoded from text_data if the transport didn't add it
+        del event["frames"]
+        with patch.object(consumer, "send") as mock_send:
+            await consumer.websocket_send(event)
+        self.assertEqual(
+            {"t": "s.pong", "p": None, "i": "a", "s": None},
+            self.codec.loads(mock_send.mock_calls[0].kwargs["bytes_data"]),
+        )
+
+
+@override_settings(
+    CHANNEL_LAYERS=testing_channel_layers_setting,
+    ENVELOPE_CONNECTIONS_QUEUE=None,
+    ENVELOPE_COMPRESSION_THRESHOLD=100,
+)
+class CompressionTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="hello")
+        self.client.force_login(self.user)
+
+    async def test_capabilities(self):
+        communicator = await mk_communicator(self.client)
+        await communicator.send_to(
+            text_data='{"t": "s.capabilities", "p": {"compression": ["br", "zlib"]}}'
+        )
+        response = await communicator.receive_from()
+        self.assertEqual(
+            {
+                "t": "s.capabilities_accepted",
+                "p": {"compression": "zlib", "batch": False},
+                "i": None,
+                "s": "s",
+            },
+            loads(response),
+        )
+        # Below threshold
+        await communicator.send_to(text_data='{"t": "s.ping"}')
+        response = await communicator.receive_from()
+        self.assertEqual("s.pong", loads(response)["t"])
+        # Above, a validation error since i is too long
+        await communicator.send_to(text_data='{"t": "s.ping", "i": "%s"}' % ("a" * 100))
+        response = await communicator.receive_from()
+        self.assertIsInstance(response, bytes)
+        self.assertEqual(
+            "error.validation", loads(ZlibCompressor().decompress(response))["t"]
+        )
+        await communicator.disconnect()
+
+    async def test_no_capabilities(self):
+        communicator = await mk_communicator(self.client)
+        await communicator.send_to(text_data='{"t": "s.ping", "i": "%s"}' % ("a" * 100))
+        response = await communicator.receive_from()
+        self.assertIsInstance(response, str)
+        await communicator.disconnect()
+
+    async def test_websocket_send_compressed_once(self):
+        with patch.object(ZlibCompressor, "compress") as mock_compress:
+            event = outgoing.transport(outgoing, Pong(mm={"id": "a" * 100}))
+        self.assertFalse(mock_compress.called)
+        self.assertIn("e", event)
+        consumers = [
+            mk_consumer(consumer_name=f"c{i}", user=self.user) for i in range(3)
+        ]
+        sent = []
+        with patch.object(
+            ZlibCompressor, "compress", return_value=b"x"
+        ) as mock_compress:
+            for consumer in consumers:
+                consumer.set_compression(["zlib"])
+                with patch.object(consumer, "send") as mock_send:
+                    # Each consumer gets its own copy from the layer
+                    await consumer.websocket_send(deepcopy(event))
+                sent.append(mock_send.call_args.kwargs["bytes_data"])
+        mock_compress.assert_called_once()
+        self.assertEqual([b"x"] * 3, sent)
+
+    async def test_websocket_send_not_compressed_without_support(self):
+        event = outgoing.transport(outgoing, Pong(mm={"id": "a" * 100}))
+        consumer = mk_consumer(user=self.user)
+        with patch.object(ZlibCompressor, "compress") as mock_compress:
+            with patch.object(consumer, "send") as mock_send:
+                await consumer.websocket_send(event)
+        self.assertFalse(mock_compress.called)
+        mock_send.assert_called_once_with(text_data=event["text_data"])
+
+
+@override_settings(
+    CHANNEL_LAYERS=testing_channel_layers_setting,
+    ENVELOPE_CONNECTIONS_QUEUE=None,
+    ENVELOPE_PIPELINE_CONCURRENCY=2,
+    ENVELOPE_PIPELINE_MAX_PENDING=2,
+)
+class PipelineTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="hello")
+        self.client.force_login(self.user)
+
+    def slow_run(self):
+        run = ListSubscriptions.run
+
+        async def _run(message, **kwargs):
+            await asyncio.sleep(0.2)
+            return await run(message, **kwargs)
+
+        return patch.object(ListSubscriptions, "run", _run)
+
+    async def test_slow_message_doesnt_block_ping(self):
+        communicator = await mk_communicator(self.client)
+        with self.slow_run():
+            await communicator.send_json_to({"t": ListSubscriptions.name, "i": "1"})
+            await communicator.send_json_to({"t": Ping.name, "i": "2"})
+            response = await communicator.receive_json_from()
+            self.assertEqual("s.pong", response["t"])
+            response = await communicator.receive_json_from()
+            self.assertEqual("channel.subscriptions", response["t"])
+        await communicator.disconnect()
+
+    async def test_overflow_error(self):
+        communicator = await mk_communicator(self.client)
+        with self.slow_run():
+            for i in "abc":
+                await communicator.send_json_to({"t": ListSubscriptions.name, "i": i})
+            response = await communicator.receive_json_from()
+            self.assertEqual(
+                {
+                    "t": "error.bad_request",
+                    "p": {"msg": "Too many messages in progress"},
+                    "i": "c",
+                    "s": "f",
+                },
+                response,
+            )
+            for i in "ab":
+                response = await communicator.receive_json_from()
+                self.assertEqual(i, response["i"])
+        await communicator.disconnect()
+
+    @override_settings(ENVELOPE_PIPELINE_OVERFLOW="wait")
+    async def test_overflow_wait(self):
+        communicator = await mk_communicator(self.client)
+        with self.slow_run():
+            for i in "abc":
+                await communicator.send_json_to({"t": ListSubscriptions.name, "i": i})
+            for i in "abc":
+                response = await communicator.receive_json_from(1)
+                self.assertEqual(i, response["i"])
+        await communicator.disconnect()
+
+    @override_settings(ENVELOPE_PIPELINE_OVERFLOW="close")
+    async def test_overflow_close(self):
+        communicator = await mk_communicator(self.client)
+        with self.slow_run():
+            for i in "abc":
+                await communicator.send_json_to({"t": ListSubscriptions.name, "i": i})
+            response = await communicator.receive_output()
+            self.assertEqual({"type": "websocket.close", "code": 1013}, response)
+        await communicator.disconnect()
+
+
+@override_settings(
+    CHANNEL_LAYERS=testing_channel_layers_setting,
+    ENVELOPE_CONNECTIONS_QUEUE=None,
+    ENVELOPE_RATE_LIMITS={"consumer": {"s.ping": (0.001, 2)}},
+)
+class RateLimitTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="hello")
+        self.client.force_login(self.user)
+
+    async def _send_pings(self, communicator, count=3):
+        for i in range(count):
+            await communicator.send_to(text_data='{"t": "s.ping", "i": "%s"}' % i)
+
+    async def test_error(self):
+        communicator = await mk_communicator(self.client)
+        with patch.object(incoming, "parse", wraps=incoming.parse) as mock_parse:
+            await self._send_pings(communicator)
+            responses = [await communicator.receive_json_from() for _ in range(3)]
+        self.assertEqual(2, mock_parse.call_count)
+        self.assertEqual(["s.pong", "s.pong"], [x["t"] for x in responses[:2]])
+        self.assertEqual(
+            {
+                "t": "error.bad_request",
+                "p": {"msg": "Rate limit exceeded"},
+                "i": None,
+                "s": "f",
+            },
+            responses[2],
+        )
+        # Other types aren't limited
+        await communicator.send_json_to({"t": ListSubscriptions.name})
+        response = await communicator.receive_json_from()
+        self.assertEqual("channel.subscriptions", response["t"])
+        await communicator.disconnect()
+
+    async def test_peeked_type_in_payload(self):
+        communicator = await mk_communicator(self.client)
+        responses = []
+        for i in range(3):
+            # Peeking finds the type within the payload first
+            await communicator.send_to(
+                text_data='{"p": {"t": "cheap"}, "t": "s.ping", "i": "%s"}' % i
+            )
+            responses.append(await communicator.receive_json_from())
+        self.assertEqual(
+            ["s.pong", "s.pong", "error.bad_request"], [x["t"] for x in responses]
+        )
+        await communicator.disconnect()
+
+    @override_settings(ENVELOPE_RATE_LIMIT_ACTION="drop")
+    async def test_drop(self):
+        communicator = await mk_communicator(self.client)
+        await self._send_pings(communicator)
+        for _ in range(2):
+            response = await communicator.receive_json_from()
+            self.assertEqual("s.pong", response["t"])
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+    @override_settings(ENVELOPE_RATE_LIMIT_ACTION="close")
+    async def test_close(self):
+        communicator = await mk_communicator(self.client)
+        await self._send_pings(communicator)
+        for _ in range(2):
+            await communicator.receive_json_from()
+        response = await communicator.receive_output()
+        self.assertEqual({"type": "websocket.close", "code": 1008}, response)
+        await communicator.disconnect()
+
+
+@override_settings(
+    CHANNEL_LAYERS=testing_channel_layers_setting,
+    ENVELOPE_CONNECTIONS_QUEUE=None,
+    ENVELOPE_COALESCE_WINDOW=0,
+)
+class CoalesceTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="hello")
+        self.client.force_login(self.user)
+
+    async def test_capabilities(self):
+        communicator = await mk_communicator(self.client)
+        await communicator.send_json_to({"t": "s.capabilities", "p": {"batch": True}})
+        response = await communicator.receive_json_from()
+        self.assertEqual({"compression": None, "batch": True}, response["p"])
+        await communicator.disconnect()
+
+    @override_settings(ENVELOPE_COALESCE_WINDOW=None)
+    async def test_capabilities_not_enabled(self):
+        communicator = await mk_communicator(self.client)
+        await communicator.send_json_to({"t": "s.capabilities", "p": {"batch": True}})
+        response = await communicator.receive_json_from()
+        self.assertEqual({"compression": None, "batch": False}, response["p"])
+        await communicator.disconnect()
+
+    async def test_coalesce(self):
+        consumer = mk_consumer(user=self.user)
+        self.assertTrue(consumer.set_coalesce(True))
+        events = [
+            outgoing.transport(outgoing, ProgressNum(curr=i, total=3)) for i in range(3)
+        ]
+        events.append(outgoing.transport(outgoing, Status()))
+        events.append(outgoing.transport(outgoing, ProgressNum(curr=3, total=3)))
+        with patch.object(consumer, "send") as mock_send:
+            for event in events:
+                await consumer.websocket_send(event)
+            self.assertFalse(mock_send.called)
+            await asyncio.sleep(0.01)
+        frames = [loads(x.kwargs["text_data"]) for x in mock_send.mock_calls]
+        self.assertEqual(
+            ["s.batch", "s.stat", "progress.num"], [x["t"] for x in frames]
+        )
+        self.assertEqual(
+            {
+                "t": "progress.num",
+                "payloads": [
+                    {"curr": 0, "total": 3, "msg": None},
+                    {"curr": 1, "total": 3, "msg": None},
+                    {"curr": 2, "total": 3, "msg": None},
+                ],
+            },
+            frames[0]["p"],
+        )
+
+    async def test_different_ids_not_coalesced(self):
+        consumer = mk_consumer(user=self.user)
+        consumer.set_coalesce(True)
+        with patch.object(consumer, "send") as mock_send:
+            for msg_id in ("a", "b", "b"):
+                await consumer.websocket_send(
+                    outgoing.transport(
+                        outgoing, ProgressNum(mm={"id": msg_id}, curr=1, total=2)
+                    )
+                )
+            await asyncio.sleep(0.01)
+        frames = [loads(x.kwargs["text_data"]) for x in mock_send.mock_calls]
+        self.assertEqual(
+            [("progress.num", "a"), ("s.batch", "b")],
+            [(x["t"], x["i"]) for x in frames],
+        )
+
+    async def test_bypass_flushes_first(self):
+        consumer = mk_consumer(user=self.user)
+        consumer.set_coalesce(True)
+        with patch.object(consumer, "send") as mock_send:
+            for i in range(2):
+                await consumer.websocket_send(
+                    outgoing.transport(outgoing, ProgressNum(curr=i, total=2))
+                )
+            await consumer.websocket_send(outgoing.transport(outgoing, Pong()))
+        frames = [loads(x.kwargs["text_data"]) for x in mock_send.mock_calls]
+        self.assertEqual(["s.batch", "s.pong"], [x["t"] for x in frames])
+        self.assertEqual([], consumer.outbox)
+
+    def _slow_send(self, frames: list):
+        async def send(text_data=None, bytes_data=None):
+            await asyncio.sleep(0.01)
+            frames.append(loads(text_data))
+
+        return send
+
+    async def test_events_during_slow_send(self):
+        consumer = mk_consumer(user=self.user)
+        consumer.set_coalesce(True)
+        frames = []
+        with patch.object(consumer, "send", self._slow_send(frames)):
+            await consumer.websocket_send(
+                outgoing.transport(outgoing, ProgressNum(curr=0, total=3))
+            )
+            await asyncio.sleep(0.005)
+            # Arrive while the first frame is being sent
+            for i in (1, 2):
+                await consumer.websocket_send(
+                    outgoing.transport(outgoing, ProgressNum(curr=i, total=3))
+                )
+            await asyncio.sleep(0.05)
+        self.assertEqual(["progress.num", "s.batch"], [x["t"] for x in frames])
+        self.assertEqual([], consumer.outbox)
+
+    async def test_bypass_waits_for_slow_send(self):
+        consumer = mk_consumer(user=self.user)
+        consumer.set_coalesce(True)
+        frames = []
+        with patch.object(consumer, "send", self._slow_send(frames)):
+            for msg_id in ("a", "b"):
+                await consumer.websocket_send(
+                    outgoing.transport(
+                        outgoing, ProgressNum(mm={"id": msg_id}, curr=1, total=2)
+                    )
+                )
+            await asyncio.sleep(0.005)
+            await consumer.websocket_send(outgoing.transport(outgoing, Pong()))
+            await asyncio.sleep(0.05)
+        self.assertEqual(
+            [("progress.num", "a"), ("progress.num", "b"), ("s.pong", None)],
+            [(x["t"], x.get("i")) for x in frames],
+        )
+
+    async def test_not_coalesced_without_capability(self):
+        consumer = mk_consumer(user=self.user)
+        with patch.object(consumer, "send") as mock_send:
+            await consumer.websocket_send(
+                outgoing.transport(outgoing, ProgressNum(curr=1, total=2))
+            )
+            self.assertTrue(mock_send.called)
@@ -1,7 +1,9 @@
 from __future__ import annotations
 
+import asyncio
 from datetime import datetime
 from datetime import timedelta
+from itertools import groupby
 from typing import TYPE_CHECKING
 
 from channels.auth import get_user
@@ -22,11 +24,22 @@ from envelope import WS_INCOMING
 from envelope import WS_OUTGOING
 from envelope.async_signals import consumer_connected
 from envelope.async_signals import consumer_closed
+from envelope.consumers.pipeline import Overflow
+from envelope.consumers.pipeline import get_pipeline
+from envelope.consumers.ratelimit import RateLimitAction
+from envelope.consumers.ratelimit import get_rate_limiter
 from envelope.consumers.utils import get_language
 from envelope.logging import getEventLogger
 from envelope.schemas import MessageMeta
+from envelope.core.compression import compress
+from envelope.core.transport import compressed_memo
+from envelope.utils import get_batch_message
+from envelope.utils import get_coalesce_window
+from envelope.utils import get_compression_threshold
+from envelope.utils import get_compressors
 from envelope.utils import get_envelope
 from envelope.utils import get_error_type
+from envelope.utils import get_subprotocol_codecs
 
 if TYPE_CHECKING:
     from envelope.envelopes import Envelope
@@ -35,6 +48,11 @@ if TYPE_CHECKING:
     from envelope.messages.errors import ValidationErrorMsg
     from envelope.channels.schemas import ChannelSchema
     from envelope.logging import EventLoggerAdapter
+    from envelope.core.codecs import Codec
+    from envelope.core.compression import Compressor
+    from envelope.consumers.pipeline import MessagePipeline
+    from envelope.consumers.ratelimit import RateLimiter
+    from envelope.core.routing import Route
 
 __all__ = ("WebsocketConsumer",)
 
@@ -62,6 +80,21 @@ class WebsocketConsumer(AsyncWebsocketConsumer):
     language: str | None = None
     allow_unauthenticated: bool = False
     event_logger: EventLoggerAdapter
+    # Codec negotiated via websocket subprotocol. None means each envelopes own codec.
+    codec: Codec | None = None
+    # Compressor picked from what the client said it supports. See Capabilities message.
+    compressor: Compressor | None = None
+    # Handles incoming messages concurrently if ENVELOPE_PIPELINE_CONCURRENCY is set
+    pipeline: MessagePipeline | None = None
+    # Limits incoming frames if ENVELOPE_RATE_LIMITS is set
+    rate_limiter: RateLimiter | None = None
+    # Coalesce websocket_send frames into batch messages. See Capabilities message and ENVELOPE_COALESCE_WINDOW.
+    coalesce: bool = False
+    # Events from websocket_send waiting to be flushed when coalescing
+    outbox: list[dict]
+    # Held while sending from the outbox, so sends that bypass it wait for earlier events
+    outbox_lock: asyncio.Lock
+    _flush_task: asyncio.Task | None = None
 
     def __init__(
         self,
@@ -71,6 +104,8 @@ class WebsocketConsumer(AsyncWebsocketConsumer):
         super().__init__(**kwargs)
         self.event_logger = event_logger
         self.subscriptions = set()
+        self.outbox = []
+        self.outbox_lock = asyncio.Lock()
         seconds = getattr(settings, "ENVELOPE_CONNECTION_UPDATE_INTERVAL", 180)
         if seconds:
             self.connection_update_interval = timedelta(seconds=180)
@@ -79,6 +114,8 @@ class WebsocketConsumer(AsyncWebsocketConsumer):
         self.allow_unauthenticated = (
             getattr(settings, "ENVELOPE_ALLOW_UNAUTHENTICATED", False) is True
         )
+        self.pipeline = get_pipeline(self.handle_incoming)
+        self.rate_limiter = get_rate_limiter()
 
     @cached_property
     def base_error(self) -> type[ErrorMessage]:
@@ -110,11 +147,26 @@ class WebsocketConsumer(AsyncWebsocketConsumer):
             )
         else:
             self.event_logger.info("Authenticated connection accepted", consumer=self)
-        await self.accept()
+        await self.accept(self.select_subprotocol())
         await consumer_connected.send(sender=self.__class__, consumer=self)
 
+    def select_subprotocol(self) -> str | None:
+        """
+        Pick the first subprotocol requested by the client that we have a codec for,
+        see ENVELOPE_SUBPROTOCOLS.
+        """
+        codecs = get_subprotocol_codecs()
+        for subprotocol in self.scope.get("subprotocols", ()):
+            if subprotocol in codecs:
+                self.codec = codecs[subprotocol]
+                return subprotocol
+
     async def disconnect(self, close_code):
         # https://developer.mozilla.org/en-US/docs/Web/API/CloseEvent
+        if self.pipeline is not None:
+            self.pipeline.close()
+        if self._flush_task is not None:
+            self._flush_task.cancel()
         await consumer_closed.send(
             sender=self.__class__, consumer=self, close_code=close_code
         )
@@ -136,20 +188,72 @@ class WebsocketConsumer(AsyncWebsocketConsumer):
         self.last_sent = now()
         await super().send(text_data, bytes_data, close)
 
+    def set_compression(self, names: list[str]) -> str | None:
+        """
+        Pick the first compressor the client supports that we have.
+        """
+        self.compressor = None
+        compressors = get_compressors()
+        for name in names:
+            if name in compressors:
+                self.compressor = compressors[name]
+                return name
+
+    def set_coalesce(self, enabled: bool) -> bool:
+        """
+        Coalesce frames if the client supports batch messages and ENVELOPE_COALESCE_WINDOW is set.
+        """
+        self.coalesce = enabled and get_coalesce_window() is not None
+        return self.coalesce
+
+    def compress(self, data: str | bytes) -> str | bytes:
+        """
+        Compress data if the client supports it and it's above the threshold.
+        Compressed data is always sent as a binary frame.
+        """
+        if self.compressor is None:
+            return data
+        threshold = get_compression_threshold()
+        if threshold is None or len(data) < threshold:
+            return data
+        return compress(self.compressor, data)
+
+    async def send_encoded(self, data: str | bytes, compress: bool = True):
+        """
+        Send data from a codec, as a binary frame if it's bytes.
+        """
+        if compress:
+            data = self.compress(data)
+        if isinstance(data, bytes):
+            await self.send(bytes_data=data)
+        else:
+            await self.send(text_data=data)
+
     async def receive(self, text_data=None, bytes_data=None):
         """
         Websocket receive
         """
-        if text_data is None:  # pragma:no cover
-            self.event_logger.debug("Ignoring binary data", consumer=self)
-            return
+        if text_data is None:
+            if self.codec is None or not self.codec.binary:  # pragma:no cover
+                self.event_logger.debug("Ignoring binary data", consumer=self)
+                return
+            text_data = bytes_data
         incoming = get_envelope(WS_INCOMING)
+        msg_type = None
+        if self.rate_limiter is not None:
+            msg_type = (self.codec or incoming.codec).peek_type(text_data)
+            if not self.rate_limiter.allow(msg_type, self.user_pk):
+                return await self.rate_limited(msg_type)
         try:
-            data = incoming.parse(text_data)
+            data = incoming.parse(text_data, codec=self.codec)
         except ValidationError as exc:
             # FIXME: Count errors
             error = self.validation_err_msg(errors=exc.errors(), mm=self.get_msg_meta())
             return await self.send_ws_error(error)
+        if self.rate_limiter is not None and data.t != msg_type:
+            # The peeked type was only a guess, so charge the real one too
+            if not self.rate_limiter.allow(data.t, self.user_pk, all_types=False):
+                return await self.rate_limited(data.t)
         try:
             message = incoming.unpack(data, consumer=self)
         except self.base_error as error:
@@ -161,24 +265,62 @@ class WebsocketConsumer(AsyncWebsocketConsumer):
             return await self.send_ws_error(error)
         self.last_received = now()
         incoming.logger.debug("Received", consumer=self, message=message)
-        # Catch exceptions here?
-        await self.signal_message(message, incoming)
+        if self.pipeline is None:
+            # Catch exceptions here?
+            return await self.signal_message(message, incoming)
+        await self.submit_incoming(message)
+
+    async def rate_limited(self, msg_type: str | None):
+        """
+        Deal with a frame over the rate limit according to ENVELOPE_RATE_LIMIT_ACTION.
+        """
+        action = self.rate_limiter.action
+        self.event_logger.info(
+            f"Rate limited message type {msg_type}",
+            consumer=self,
+            extra=dict(action=action),
+        )
+        if action == RateLimitAction.CLOSE:
+            return await self.close(code=1008)  # Policy violation
+        if action == RateLimitAction.ERROR:
+            error = get_error_type(Error.BAD_REQUEST)(
+                msg="Rate limit exceeded", mm=self.get_msg_meta()
+            )
+            return await self.send_ws_error(error)
+
+    async def handle_incoming(self, message: Message):
+        await self.signal_message(message, get_envelope(WS_INCOMING))
+
+    async def submit_incoming(self, message: Message):
+        """
+        Hand message over to the pipeline, or deal with it according to the pipelines overflow setting.
+        """
+        if self.pipeline.full:
+            if self.pipeline.overflow == Overflow.WAIT:
+                await self.pipeline.wait_for_space()
+            elif self.pipeline.overflow == Overflow.CLOSE:
+                self.event_logger.info(
+                    "Pipeline full, closing connection", consumer=self, message=message
+                )
+                return await self.close(code=1013)  # Try again later
+            else:
+                error = get_error_type(Error.BAD_REQUEST).from_message(
+                    message, msg="Too many messages in progress"
+                )
+                return await self.send_ws_error(error)
+        self.pipeline.submit(message)
 
     async def send_ws_error(self, error: ErrorMessage):
         self.last_error = now()
         errors = get_envelope(ERRORS)
         await self.signal_message(error, errors)
-        envelope_data = errors.pack(error)
         self.event_logger.info("Sending error", consumer=self, message=error)
-        text_data = envelope_data.json()
-        await self.send(text_data=text_data)
+        await self.send_after_outbox(errors.serialize(error, codec=self.codec))
 
     async def send_ws_message(self, message: Message):
         outgoing = get_envelope(WS_OUTGOING)
         await self.signal_message(message, outgoing)
-        envelope_data = outgoing.pack(message)
-        text_data = envelope_data.json()
-        await self.send(text_data=text_data)
+        await self.send_after_outbox(outgoing.serialize(message, codec=self.codec))
 
     async def websocket_send(self, event: dict):
         """
@@ -187,18 +329,120 @@ class WebsocketConsumer(AsyncWebsocketConsumer):
         """
         self.last_sent = now()
         outgoing = get_envelope(WS_OUTGOING)
-        msg_class = outgoing.registry.get(event["t"])
-        if outgoing.message_signal and outgoing.message_signal.has_listeners(msg_class):
-            data = outgoing.parse(event["text_data"])
-            message = outgoing.unpack(data, consumer=self)
+        route = outgoing.routes.get(event["t"])
+        if route and route.signal and route.signal.has_listeners(route.msg_class):
+            message = outgoing.unpack_event(event, consumer=self)
             await self.signal_message(message, outgoing)
         else:
             self.event_logger.debug(
                 f"websocket_send message type {event['t']} without listeners",
                 consumer=self,
             )
-        # text_data = data.json()
-        await self.send(text_data=event["text_data"])
+        if self.coalesce and self.can_coalesce(route, outgoing):
+            return self.add_to_outbox(event)
+        await self.send_after_outbox(self.encode_event(event, outgoing), compress=False)
+
+    @staticmethod
+    def can_coalesce(route: Route | None, envelope: Envelope) -> bool:
+        return (
+            route is not None and envelope.allow_batch and route.msg_class.allow_batch
+        )
+
+    def add_to_outbox(self, event: dict):
+        self.outbox.append(event)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self.flush_outbox_later())
+
+    async def flush_outbox_later(self):
+        await asyncio.sleep(get_coalesce_window() or 0)
+        await self.flush_outbox()
+
+    async def send_after_outbox(self, data: str | bytes, compress: bool = True):
+        """
+        Send data once everything in the outbox has been sent.
+        """
+        async with self.outbox_lock:
+            await self._send_outbox()
+            await self.send_encoded(data, compress=compress)
+
+    async def flush_outbox(self):
+        """
+        Send events in the outbox, including events added while sending. Consecutive events
+        of the same type, state and message id are sent as one batch message. A batch only has
+        one message id, so replies to different messages are sent one by one.
+        """
+        async with self.outbox_lock:
+            await self._send_outbox()
+
+    async def _send_outbox(self):
+        outgoing = get_envelope(WS_OUTGOING)
+        while self.outbox:
+            events, self.outbox = self.outbox, []
+            for _, run in groupby(
+                events, key=lambda x: (x["t"], x.get("s"), x.get("i"))
+            ):
+                run = list(run)
+                if len(run) == 1:
+                    await self.send_encoded(
+                        self.encode_event(run[0], outgoing), compress=False
+                    )
+                else:
+                    batch = self.batch_events(run, outgoing)
+                    await self.send_encoded(outgoing.serialize(batch, codec=self.codec))
+
+    def batch_events(self, events: list[dict], envelope: Envelope) -> Message:
+        """
+        Events are from TextTransport so payloads are already valid.
+        """
+        msg_class = envelope.routes[events[0]["t"]].msg_class
+        batch = None
+        for event in events:
+            if "p" in event:
+                payload = event["p"]
+            else:
+                payload = envelope.codec.loads(event["text_data"])["p"]
+            message = msg_class.from_payload(
+                mm={"id": event.get("i"), "state": event.get("s")},
+                data=payload,
+                trusted=True,
+            )
+            if batch is None:
+                batch = get_batch_message().start(message)
+            else:
+                batch.append(message)
+        return batch
+
+    def encode_event(self, event: dict, envelope: Envelope) -> str | bytes:
+        """
+        Return the events data in the format this connection uses, compressed if needed.
+        Transports pre-encode data for each codec, so this will only encode it as a fallback.
+        """
+        if self.codec is None or self.codec.name == envelope.codec.name:
+            codec_name = envelope.codec.name
+            data = event["text_data"]
+        else:
+            codec_name = self.codec.name
+            try:
+                data = event["frames"][codec_name]
+            except KeyError:
+                data = self.codec.dumps(envelope.codec.loads(event["text_data"]))
+        if self.compressor is not None:
+            return self.compress_event(event, codec_name, data)
+        return data
+
+    def compress_event(self, event: dict, codec_name: str, data: str | bytes):
+        """
+        Compress data encoded from event. Consumers in this process share the result
+        when the event has a key, so group messages are compressed once per codec and compressor.
+        """
+        if "e" not in event:
+            return self.compress(data)
+        key = f"{event['e']}.{codec_name}.{self.compressor.name}"
+        try:
+            return compressed_memo[key]
+        except KeyError:
+            compressed = compressed_memo[key] = self.compress(data)
+            return compressed
 
     async def ws_error_send(self, event: dict):
         """
@@ -208,8 +452,8 @@ class WebsocketConsumer(AsyncWebsocketConsumer):
         self.last_error = self.last_sent = now()
         errors = get_envelope(ERRORS)
         data = errors.schema(**event)
-        msg_class = errors.registry.get(data.t)
-        if errors.message_signal and errors.message_signal.has_listeners(msg_class):
+        route = errors.routes.get(data.t)
+        if route and route.signal and route.signal.has_listeners(route.msg_class):
             message = errors.unpack(data, consumer=self)
             await self.signal_message(message, errors)
         else:
@@ -217,8 +461,7 @@ class WebsocketConsumer(AsyncWebsocketConsumer):
                 f"ws_error_send message type {data.t} without listeners",
                 consumer=self,
             )
-        text_data = data.json()
-        await self.send(text_data=text_data)
+        await self.send_after_outbox(errors.dumps(data, codec=self.codec))
 
     # async def send_internal(self, message: Message):
     #     internal = get_envelope(INTERNAL)
@@ -6,6 +6,7 @@ from async_signals import receiver
 from envelope.async_signals import incoming_internal_message
 from envelope.async_signals import incoming_websocket_message
 from envelope.async_signals import outgoing_websocket_error
+from envelope.async_signals import message_types
 from envelope.async_signals import outgoing_websocket_message
 from envelope.core.message import AsyncRunnable
 
@@ -22,8 +23,8 @@ if TYPE_CHECKING:
         outgoing_websocket_message,
     ),
 )
+@message_types(AsyncRunnable)
 async def run_async_runnable(
     *, consumer: WebsocketConsumer, message: AsyncRunnable, **kwargs
 ):
-    if isinstance(message, AsyncRunnable):
-        await message.run(consumer=consumer, **kwargs)
+    await message.run(consumer=consumer, **kwargs)
@@ -0,0 +1,212 @@
+from __future__ import annotations
+
+import json
+import re
+from abc import ABC
+from abc import abstractmethod
+
+from django.core.exceptions import ImproperlyConfigured
+from pydantic.json import pydantic_encoder
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:  # pragma: no cover
+    cbor2 = None
+
+__all__ = (
+    "peek_json_type",
+    "Codec",
+    "JSONCodec",
+    "OrjsonCodec",
+    "MsgPackCodec",
+    "CBORCodec",
+)
+
+
+_json_type_re = re.compile(r'"t"\s*:\s*"([^"\\]{1,100})"')
+_json_type_re_bytes = re.compile(_json_type_re.pattern.encode())
+
+
+def peek_json_type(data: str | bytes) -> str | None:
+    """
+    Message type from json data, without parsing it. It's only a guess,
+    the first "t" key found may be within the payload. Consumers check the real type
+    against the rate limits as well once the data is parsed, if it's something else.
+
+    >>> peek_json_type('{"t": "s.ping", "i": "1"}')
+    's.ping'
+    >>> peek_json_type(b'{"i":"1","t":"s.ping"}')
+    's.ping'
+    >>> peek_json_type('{"i": "1"}') is None
+    True
+    """
+    if isinstance(data, bytes):
+        match = _json_type_re_bytes.search(data)
+        return match and match.group(1).decode(errors="replace")
+    match = _json_type_re.search(data)
+    return match and match.group(1)
+
+
+class Codec(ABC):
+    """
+    Turns envelope data into something we can send over the wire, and back again.
+    Codecs are shared between envelopes and consumers so they mustn't keep any state.
+    """
+
+    name: str
+    # Binary codecs produce bytes rather than str
+    binary: bool = False
+
+    @abstractmethod
+    def dumps(self, data: dict) -> str | bytes: ...
+
+    @abstractmethod
+    def loads(self, data: str | bytes) -> dict:
+        """
+        Must raise ValueError (or a subclass of it) on malformed data.
+        """
+
+    def peek_type(self, data: str | bytes) -> str | None:
+        """
+        Cheap guess of the message type before data is decoded, used for rate limiting. None if unknown.
+        """
+        return None
+
+
+class JSONCodec(Codec):
+    """
+    Stdlib json. Output is exactly the same as pydantics json() method.
+
+    >>> from datetime import date
+    >>> codec = JSONCodec()
+    >>> codec.dumps({'t': 's.pong', 'p': None, 'd': date(2024, 1, 1)})
+    '{"t": "s.pong", "p": null, "d": "2024-01-01"}'
+    >>> codec.loads('{"t": "s.pong"}')
+    {'t': 's.pong'}
+    """
+
+    name = "json"
+
+    def dumps(self, data: dict) -> str:
+        return json.dumps(data, default=pydantic_encoder)
+
+    def loads(self, data: str | bytes) -> dict:
+        return json.loads(data)
+
+    def peek_type(self, data: str | bytes) -> str | None:
+        return peek_json_type(data)
+
+
+class OrjsonCodec(Codec):
+    """
+    Requires orjson. Produces compact json.
+
+    >>> from datetime import date
+    >>> codec = OrjsonCodec()
+    >>> codec.dumps({'t': 's.pong', 'p': None, 'd': date(2024, 1, 1), 1: 'a'})
+    '{"t":"s.pong","p":null,"d":"2024-01-01","1":"a"}'
+    >>> codec.loads('{"t": "s.pong"}')
+    {'t': 's.pong'}
+    >>> codec.loads(' ')
+    Traceback (most recent call last):
+    ...
+    orjson.JSONDecodeError: Input is a zero-length, empty document: line 1 column 2 (char 1)
+    """
+
+    name = "orjson"
+
+    def __init__(self):
+        if orjson is None:  # pragma: no cover
+            raise ImproperlyConfigured(
+                f"{self.__class__.__name__} requires orjson. Install it with 'pip install orjson'."
+            )
+        self.option = orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, data: dict) -> str:
+        return orjson.dumps(data, default=pydantic_encoder, option=self.option).decode()
+
+    def loads(self, data: str | bytes) -> dict:
+        return orjson.loads(data)
+
+    def peek_type(self, data: str | bytes) -> str | None:
+        return peek_json_type(data)
+
+
+class MsgPackCodec(Codec):
+    """
+    Requires msgpack. Binary, so consumers will send it as bytes.
+    Anything msgpack can't handle is encoded the same way as json, dates become strings for instance.
+
+    >>> from datetime import date
+    >>> codec = MsgPackCodec()
+    >>> data = codec.dumps({'t': 's.pong', 'p': None, 'd': date(2024, 1, 1)})
+    >>> data
+    b'\\x83\\xa1t\\xa6s.pong\\xa1p\\xc0\\xa1d\\xaa2024-01-01'
+    >>> codec.loads(data)
+    {'t': 's.pong', 'p': None, 'd': '2024-01-01'}
+    """
+
+    name = "msgpack"
+    binary = True
+
+    def __init__(self):
+        if msgpack is None:  # pragma: no cover
+            raise ImproperlyConfigured(
+                f"{self.__class__.__name__} requires msgpack. Install it with 'pip install msgpack'."
+            )
+
+    def dumps(self, data: dict) -> bytes:
+        return msgpack.packb(data, default=pydantic_encoder)
+
+    def loads(self, data: str | bytes) -> dict:
+        return msgpack.unpackb(data)
+
+
+class CBORCodec(Codec):
+    """
+    Requires cbor2. Binary, so consumers will send it as bytes.
+
+    >>> codec = CBORCodec()
+    >>> data = codec.dumps({'t': 's.pong', 'p': None})
+    >>> data
+    b'\\xa2atfs.pongap\\xf6'
+    >>> codec.loads(data)
+    {'t': 's.pong', 'p': None}
+    >>> codec.loads(b'\\xff')
+    Traceback (most recent call last):
+    ...
+    ValueError: ...
+    """
+
+    name = "cbor"
+    binary = True
+
+    def __init__(self):
+        if cbor2 is None:  # pragma: no cover
+            raise ImproperlyConfigured(
+                f"{self.__class__.__name__} requires cbor2. Install it with 'pip install cbor2'."
+            )
+
+    @staticmethod
+    def _default(encoder, value):
+        encoder.encode(pydantic_encoder(value))
+
+    def dumps(self, data: dict) -> bytes:
+        return cbor2.dumps(data, default=self._default)
+
+    def loads(self, data: str | bytes) -> dict:
+        try:
+            return cbor2.loads(data)
+        except cbor2.CBORDecodeError as exc:
+            # Not always a subclass of ValueError
+            raise ValueError(str(exc)) from exc
@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+import logging
+import zlib
+from abc import ABC
+from abc import abstractmethod
+from time import perf_counter
+
+__all__ = (
+    "Compressor",
+    "ZlibCompressor",
+    "compress",
+)
+
+logger = logging.getLogger(__name__)
+
+
+class Compressor(ABC):
+    """
+    Compresses encoded frames. Clients announce which compressors they can handle,
+    see envelope.messages.common.Capabilities. Compressors are shared so they mustn't keep any state.
+    """
+
+    name: str
+
+    @abstractmethod
+    def compress(self, data: bytes) -> bytes: ...
+
+    @abstractmethod
+    def decompress(self, data: bytes) -> bytes: ...
+
+
+class ZlibCompressor(Compressor):
+    """
+    zlib stream (RFC 1950), so the first byte will always be 0x78.
+    Subclass and set zdict to use a preset dictionary trained on your payloads,
+    clients must use the same dictionary and another name.
+
+    >>> compressor = ZlibCompressor()
+    >>> data = compressor.compress(b'{"t": "s.batch"}' * 10)
+    >>> data[:1]
+    b'x'
+    >>> len(data) < 160
+    True
+    >>> compressor.decompress(data) == b'{"t": "s.batch"}' * 10
+    True
+    """
+
+    name = "zlib"
+    level: int = 6
+    zdict: bytes | None = None
+
+    def compress(self, data: bytes) -> bytes:
+        if self.zdict is None:
+            return zlib.compress(data, self.level)
+        compressobj = zlib.compressobj(self.level, zdict=self.zdict)
+        return compressobj.compress(data) + compressobj.flush()
+
+    def decompress(self, data: bytes) -> bytes:
+        if self.zdict is None:
+            return zlib.decompress(data)
+        decompressobj = zlib.decompressobj(zdict=self.zdict)
+        return decompressobj.decompress(data) + decompressobj.flush()
+
+
+def compress(compressor: Compressor, data: str | bytes) -> bytes:
+    """
+    Compress encoded data and log ratio and time spent.
+
+    >>> compress(ZlibCompressor(), '{"t": "s.batch"}' * 10)[:1]
+    b'x'
+    """
+    if isinstance(data, str):
+        data = data.encode()
+    start = perf_counter()
+    compressed = compressor.compress(data)
+    ms = (perf_counter() - start) * 1000
+    ratio = len(compressed) / len(data)
+    logger.debug(
+        "Compressed %s bytes to %s with %s (ratio %.2f) in %.2f ms",
+        len(data),
+        len(compressed),
+        compressor.name,
+        ratio,
+        ms,
+        extra={
+            "compressor": compressor.name,
+            "size": len(data),
+            "compressed_size": len(compressed),
+            "ratio": ratio,
+            "ms": ms,
+        },
+    )
+    return compressed
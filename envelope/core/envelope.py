@@ -4,19 +4,30 @@ from typing import TYPE_CHECKING
 from async_signals import Signal
 from channels import DEFAULT_CHANNEL_LAYER
 from pydantic import BaseModel
+from pydantic import ValidationError
+from pydantic.error_wrappers import ErrorWrapper
+from pydantic.utils import ROOT_KEY
 
 from envelope import Error
 from envelope.logging import getEventLogger
 from envelope.schemas import EnvelopeSchema
+from envelope.core.serializers import MessageSerializer
+from envelope.core.routing import build_routes
+from envelope.core.transport import event_memo
+from envelope.registries import message_registry
 from envelope.schemas import MessageMeta
+from envelope.utils import get_codec
 from envelope.utils import get_error_type
 from envelope.utils import get_message_registry
 
 if TYPE_CHECKING:
+    from envelope.core.codecs import Codec
     from envelope.logging import EventLoggerAdapter
     from envelope.consumers.websocket import WebsocketConsumer
     from envelope.core.message import Message
-    from envelope.registries import MessageRegistry
+    from envelope.registries import MessageTypes
+    from envelope.core.routing import Route
+    from types import MappingProxyType
     from envelope.core.transport import Transport
 
 __all__ = ("Envelope",)
@@ -27,12 +38,16 @@ _default = object()
 class Envelope:
     name: str
     schema: type[EnvelopeSchema]
-    registry: MessageRegistry
+    registry: MessageTypes
     allow_batch: bool = False
     transport: Transport | None
     message_signal: Signal | None
     logger: EventLoggerAdapter
     layer_name: str
+    # None means use ENVELOPE_CODEC from settings
+    _codec: Codec | None = None
+    # Payloads unpacked by trusted envelopes are constructed without validation
+    trusted: bool = False
 
     def __init__(
         self,
@@ -44,6 +59,8 @@ class Envelope:
         allow_batch: bool = False,
         message_signal: Signal | None = None,
         layer_name: str = DEFAULT_CHANNEL_LAYER,
+        codec: Codec | None = None,
+        trusted: bool = False,
     ):
         if not issubclass(schema, BaseModel):  # pragma: no coverage
             raise TypeError("Must be a subclass of pydantic.BaseModel")
@@ -56,19 +73,72 @@ class Envelope:
             logger_name = "envelope." + name + ".event"
         self.logger = getEventLogger(logger_name)
         self.layer_name = layer_name
+        self._codec = codec
+        self.trusted = trusted
+        self._serializers = {}
+        self._routes = None
+        self._routes_key = None
 
     @property
-    def registry(self):
+    def registry(self) -> MessageTypes:
         return get_message_registry(self.name)
 
-    def parse(self, text_data: str) -> EnvelopeSchema:
+    @property
+    def routes(self) -> MappingProxyType[str, Route]:
+        """
+        Precomputed table of message type name -> Route. Rebuilt if the registry changes,
+        unless registries are frozen.
+
+        >>> from envelope.envelopes import incoming
+        >>> incoming.routes['s.ping'].handler
+        'async_runnable'
+        >>> incoming.routes is incoming.routes
+        True
+        """
+        if self._routes is not None:
+            if message_registry.frozen or self._routes_key == self.get_routes_key():
+                return self._routes
+        return self.build_routes()
+
+    def get_routes_key(self) -> tuple[int, int]:
+        reg = message_registry.data.get(self.name)
+        return message_registry.version, -1 if reg is None else reg.version
+
+    def build_routes(self) -> MappingProxyType[str, Route]:
+        self._routes_key = self.get_routes_key()
+        self._routes = build_routes(self)
+        return self._routes
+
+    @property
+    def codec(self) -> Codec:
+        if self._codec is None:
+            return get_codec()
+        return self._codec
+
+    def parse(
+        self, text_data: str | bytes, codec: Codec | None = None
+    ) -> EnvelopeSchema:
         """
+        Decode with codec if specified, otherwise with the envelopes codec.
+
         >>> env = Envelope(schema=EnvelopeSchema, name='testing')
         >>> txt = '{"t": "msg.name"}'
         >>> env.parse(txt)
         EnvelopeSchema(t='msg.name', p=None, i=None)
+
+        Decoding errors are reported the same way as validation errors
+        >>> env.parse('{"t": ')
+        Traceback (most recent call last):
+        ...
+        pydantic.error_wrappers.ValidationError: 1 validation error for EnvelopeSchema
+        __root__
+          Expecting value: line 1 column 7 (char 6) (type=value_error.jsondecode; ...)
         """
-        return self.schema.parse_raw(text_data)
+        try:
+            data = (codec or self.codec).loads(text_data)
+        except (ValueError, TypeError, UnicodeDecodeError) as exc:
+            raise ValidationError([ErrorWrapper(exc, loc=ROOT_KEY)], self.schema)
+        return self.schema.parse_obj(data)
 
     def unpack(
         self,
@@ -133,9 +203,15 @@ class Envelope:
         if bool(mm) == bool(consumer):
             raise ValueError("Can't specify both mm and consumer")
         if consumer:
-            mm = consumer.get_msg_meta(**data.dict(exclude={"t"}, exclude_none=True))
+            mm = consumer.get_msg_meta(
+                **{
+                    k: v
+                    for k, v in data.__dict__.items()
+                    if v is not None and k not in ("t", "p")
+                }
+            )
         try:
-            msg_class = self.registry[data.t]
+            msg_class = self.routes[data.t].msg_class
         except KeyError as exc:
             error = get_error_type(Error.MSG_TYPE)(
                 mm=mm,
@@ -148,14 +224,53 @@ class Envelope:
             mm["env"] = self.name
         elif isinstance(mm, MessageMeta):
             mm.env = self.name
-        msg = msg_class(
+        msg = msg_class.from_payload(
             mm=mm,
             data=data.p,
+            trusted=self.trusted,
         )
         if consumer and getattr(consumer, "user", None):
             msg.user = consumer.user
         return msg
 
+    def unpack_event(self, event: dict, *, consumer: WebsocketConsumer) -> Message:
+        """
+        Unpack a layer event created by TextTransport. The validated payload is kept in event_memo,
+        so other consumers in this process that receive the same event can reuse it.
+
+        >>> from envelope.testing import mk_consumer
+        >>> from envelope.schemas import OutgoingEnvelopeSchema
+        >>> env = Envelope(schema=OutgoingEnvelopeSchema, name='testing')
+        >>> event = {'t': 'testing.hello', 'text_data': '{"t": "testing.hello", "i": "1"}'}
+        >>> msg = env.unpack_event(event, consumer=mk_consumer(consumer_name='abc'))
+        >>> msg.mm
+        MessageMeta(id='1', user_pk=None, consumer_name='abc', language=None, state=None, env='testing')
+
+        With structured data, text_data won't be touched
+        >>> event = {'t': 'testing.hello', 'p': None, 'i': '2', 's': 'q', 'e': 'x', 'text_data': 'Not parsed'}
+        >>> msg = env.unpack_event(event, consumer=mk_consumer(consumer_name='abc'))
+        >>> msg.mm
+        MessageMeta(id='2', user_pk=None, consumer_name='abc', language=None, state='q', env='testing')
+        >>> 'x' in event_memo
+        True
+        """
+        key = event.get("e")
+        if key is not None and key in event_memo:
+            payload = event_memo[key]
+        elif "p" in event:
+            # Pre-validated by the sender
+            payload = event["p"]
+        else:
+            return self.unpack(self.parse(event["text_data"]), consumer=consumer)
+        data = self.schema.construct(
+            **{k: event.get(k) for k in self.schema.__fields__ if k in event},
+        )
+        data.p = payload
+        message = self.unpack(data, consumer=consumer)
+        if key is not None:
+            event_memo[key] = message.data
+        return message
+
     def pack(self, message: Message) -> EnvelopeSchema:
         """
         Pack (or insert) message into an envelope 👅
@@ -169,8 +284,46 @@ class Envelope:
                 mm={'consumer_name': 'abc', 'user_pk': 1, 'state': 'q', 'id': 5})
         >>> env.pack(hello_msg)
         OutgoingEnvelopeSchema(t='testing.hello', p=None, i='5', s='q')
+
+        The message was validated when it was created, so this won't validate it again.
+        """
+        return self.schema.construct(**self.get_serializer(message.__class__)(message))
+
+    def get_serializer(self, msg_class: type[Message]) -> MessageSerializer:
+        try:
+            return self._serializers[msg_class]
+        except KeyError:
+            serializer = self._serializers[msg_class] = MessageSerializer(
+                self, msg_class
+            )
+            return serializer
+
+    def serialize(self, message: Message, codec: Codec | None = None) -> str | bytes:
+        """
+        Pack and serialize message with codec or this envelopes codec, without creating the envelope schema.
+
+        >>> from envelope.schemas import OutgoingEnvelopeSchema
+        >>> env = Envelope(schema=OutgoingEnvelopeSchema, name='testing')
+        >>> msg_class = env.registry['testing.hello']
+        >>> env.serialize(msg_class(mm={'consumer_name': 'abc', 'state': 'q', 'id': 5}))
+        '{"t": "testing.hello", "p": null, "i": "5", "s": "q"}'
+        """
+        return (codec or self.codec).dumps(
+            self.get_serializer(message.__class__)(message)
+        )
+
+    def dumps(self, data: EnvelopeSchema, codec: Codec | None = None) -> str | bytes:
+        """
+        Serialize packed data with codec or this envelopes codec.
+
+        >>> from envelope.schemas import OutgoingEnvelopeSchema
+        >>> from envelope.core.codecs import OrjsonCodec
+        >>> data = OutgoingEnvelopeSchema(t='testing.hello', i='5')
+        >>> env = Envelope(schema=OutgoingEnvelopeSchema, name='testing')
+        >>> env.dumps(data)
+        '{"t": "testing.hello", "p": null, "i": "5", "s": null}'
+        >>> env = Envelope(schema=OutgoingEnvelopeSchema, name='testing', codec=OrjsonCodec())
+        >>> env.dumps(data)
+        '{"t":"testing.hello","p":null,"i":"5","s":null}'
         """
-        kwargs = message.mm.dict(exclude={"consumer_name"}, exclude_none=True)
-        if message.data is not None:
-            kwargs["p"] = message.data.dict()
-        return self.schema(t=message.name, **kwargs)
+        return (codec or self.codec).dumps(data.dict())
@@ -1,14 +1,19 @@
 from __future__ import annotations
 from abc import ABC
 from abc import abstractmethod
+from collections.abc import Hashable
 from typing import TYPE_CHECKING
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AbstractUser
 from django.utils.functional import cached_property
 from pydantic import BaseModel
+from pydantic.fields import SHAPE_LIST
+from pydantic.fields import SHAPE_SINGLETON
 
 from envelope import MessageStates
+from envelope import Ordering
 from envelope.schemas import MessageMeta
 from envelope.schemas import NoPayload
 
@@ -19,14 +24,71 @@ __all__ = (
     "Message",
     "ErrorMessage",
     "AsyncRunnable",
+    "construct_payload",
 )
 
 
+def validate_trusted() -> bool:
+    """
+    Setting ENVELOPE_VALIDATE_TRUSTED will cause trusted messages to be validated anyway.
+    Useful in tests.
+    """
+    return getattr(settings, "ENVELOPE_VALIDATE_TRUSTED", False)
+
+
+def construct_payload(schema: type[BaseModel], data: dict) -> BaseModel:
+    """
+    Build schema without validation. Keys that aren't fields are dropped, and dicts
+    for fields that are models (or lists of models) are constructed the same way,
+    so serialized output matches what a validated schema would produce.
+
+    >>> from envelope.channels.schemas import ChannelSubscription
+    >>> data = construct_payload(ChannelSubscription, {
+    ...     'pk': 1, 'channel_type': 'user', 'channel_name': 'abc', 'other': 1,
+    ...     'app_state': [{'t': 'testing.hello', 'p': None}],
+    ... })
+    >>> data
+    ChannelSubscription(pk=1, channel_type='user', channel_name='abc', \
+    app_state=[OutgoingEnvelopeSchema(t='testing.hello', p=None, i=None, s=None)])
+
+    Nothing is checked though
+
+    >>> construct_payload(ChannelSubscription, {'pk': 'Not validated'})
+    ChannelSubscription(pk='Not validated', app_state=None)
+    """
+    values = {}
+    for name, field in schema.__fields__.items():
+        if field.alias in data:
+            value = data[field.alias]
+        elif name in data:
+            value = data[name]
+        else:
+            continue
+        type_ = field.type_
+        if isinstance(type_, type) and issubclass(type_, BaseModel):
+            if field.shape == SHAPE_SINGLETON and isinstance(value, dict):
+                value = construct_payload(type_, value)
+            elif field.shape == SHAPE_LIST and isinstance(value, list):
+                value = [
+                    construct_payload(type_, x) if isinstance(x, dict) else x
+                    for x in value
+                ]
+        values[name] = value
+    return schema.construct(**values)
+
+
 class Message(MessageStates, ABC):
     mm: MessageMeta
     schema: type[BaseModel] = NoPayload
     data: BaseModel | None
     allow_batch: bool = True
+    # Trusted messages are built by our own code from data we already know is valid,
+    # so the payload is constructed without validation. Payloads from the outside
+    # are still validated unless they're unpacked by a trusted envelope.
+    trusted: bool = False
+    # How this message is ordered against others when the consumer pipeline is on,
+    # see envelope.Ordering. Override ordering_key for context specific ordering.
+    ordering: str = Ordering.TYPE
 
     @property
     @abstractmethod
@@ -50,18 +112,78 @@ class Message(MessageStates, ABC):
             self.mm = MessageMeta(**mm)
         if self.schema is NoPayload:
             self.data = None
+        elif isinstance(data, self.schema) and not kwargs:
+            # Already validated, for instance shared via EventMemo
+            self.data = data
         else:
             if data is None:
                 data = {}
             data.update(kwargs)
-            self.data = self.schema(**data)
+            if self.trusted and not validate_trusted():
+                self.data = construct_payload(self.schema, data)
+            else:
+                self.data = self.schema(**data)
+
+    @classmethod
+    def from_payload(
+        cls, *, mm: dict | MessageMeta, data: dict | None, trusted: bool = False
+    ) -> Message:
+        """
+        Called by envelopes when a message is unpacked. Override to change how payloads are handled.
+        Trusted is set by the envelope and decides if the payload should be validated,
+        regardless of the message class setting.
+
+        >>> from envelope.messages.common import ProgressNum
+        >>> ProgressNum.trusted
+        True
+        >>> ProgressNum.from_payload(mm={}, data={'curr': 'a', 'total': 2})
+        Traceback (most recent call last):
+        ...
+        pydantic.error_wrappers.ValidationError: 1 validation error for ProgressSchema
+        curr
+          value is not a valid integer (type=type_error.integer)
+        >>> ProgressNum.from_payload(mm={}, data={'curr': 1, 'total': 2}, trusted=True).data
+        ProgressSchema(curr=1, total=2, msg=None)
+        """
+        if cls.schema is NoPayload or isinstance(data, cls.schema):
+            return cls(mm=mm, data=data)
+        if data is None:
+            data = {}
+        if trusted and not validate_trusted():
+            return cls(mm=mm, data=construct_payload(cls.schema, data))
+        return cls(mm=mm, data=cls.schema(**data))
 
     @classmethod
     def from_message(
         cls, message: Message, state: str | None = None, **kwargs
     ) -> Message:
-        mm = MessageMeta(state=state, **message.mm.dict(exclude={"registry", "state"}))
-        return cls(mm=mm, **kwargs)
+        return cls(mm=message.mm.derive(state=state), **kwargs)
+
+    def ordering_key(self) -> Hashable | None:
+        """
+        Messages with the same key are handled one after another, in the order they were received.
+        None means no ordering at all.
+
+        >>> from envelope.messages.ping import Ping
+        >>> Ping().ordering_key()
+        ('type', 's.ping')
+        >>> Ping.ordering = Ordering.ID
+        >>> Ping(mm={'id': 'a'}).ordering_key()
+        ('id', 'a')
+        >>> Ping().ordering_key()
+        ('type', 's.ping')
+        >>> Ping.ordering = Ordering.NONE
+        >>> Ping().ordering_key() is None
+        True
+        >>> del Ping.ordering
+        """
+        if self.ordering == Ordering.NONE:
+            return None
+        if self.ordering == Ordering.SERIAL:
+            return (Ordering.SERIAL,)
+        if self.ordering == Ordering.ID and self.mm.id is not None:
+            return (Ordering.ID, self.mm.id)
+        return (Ordering.TYPE, self.name)
 
     @cached_property
     def user(self) -> None | AbstractUser:
@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+from types import MappingProxyType
+from typing import NamedTuple
+from typing import TYPE_CHECKING
+
+from envelope import Handler
+from envelope.core.message import AsyncRunnable
+
+if TYPE_CHECKING:
+    from async_signals import Signal
+    from envelope.core.envelope import Envelope
+    from envelope.core.message import Message
+
+__all__ = (
+    "Route",
+    "build_routes",
+)
+
+
+class Route(NamedTuple):
+    msg_class: type[Message]
+    signal: Signal | None
+    handler: str
+
+
+def get_handler(msg_class: type[Message]) -> str:
+    """
+    >>> from envelope.messages.ping import Ping
+    >>> from envelope.messages.ping import Pong
+    >>> from envelope.channels.messages import Subscribe
+    >>> get_handler(Ping)
+    'async_runnable'
+    >>> get_handler(Pong)
+    'message'
+    >>> get_handler(Subscribe)
+    'deferred_job'
+    """
+    from envelope.deferred_jobs.message import DeferredJob
+
+    if issubclass(msg_class, DeferredJob):
+        return Handler.DEFERRED_JOB
+    if issubclass(msg_class, AsyncRunnable):
+        return Handler.ASYNC_RUNNABLE
+    return Handler.MESSAGE
+
+
+def build_routes(envelope: Envelope) -> MappingProxyType[str, Route]:
+    """
+    Immutable table of type name -> Route for an envelope.
+
+    >>> from envelope.envelopes import incoming
+    >>> routes = build_routes(incoming)
+    >>> routes['s.ping']
+    Route(msg_class=<class 'envelope.messages.ping.Ping'>, signal=<envelope.async_signals.MessageSignal object at ...>, handler='async_runnable')
+    >>> routes['s.ping'] = None
+    Traceback (most recent call last):
+    ...
+    TypeError: 'mappingproxy' object does not support item assignment
+    """
+    return MappingProxyType(
+        {
+            name: Route(msg_class, envelope.message_signal, get_handler(msg_class))
+            for name, msg_class in envelope.registry.items()
+        }
+    )
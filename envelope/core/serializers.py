@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from envelope.core.envelope import Envelope
+    from envelope.core.message import Message
+
+__all__ = ("MessageSerializer",)
+
+
+class MessageSerializer:
+    """
+    Writes envelope data straight from a message of a specific class.
+    The plan is worked out once per envelope and message class from the envelopes schema,
+    so there's no need to validate messages again when they're sent. They're validated when they're created.
+
+    Keys other than t and p are read from message meta, using the fields alias. (i -> id, s -> state etc)
+    Fields with const=True will always have their default value.
+
+    >>> from envelope.core.envelope import Envelope
+    >>> from envelope.schemas import ErrorEnvelopeSchema
+    >>> from envelope.schemas import OutgoingEnvelopeSchema
+    >>> from envelope.testing import WebsocketHello
+    >>> from envelope.messages.errors import GenericError
+    >>> env = Envelope(schema=OutgoingEnvelopeSchema, name='testing')
+    >>> serializer = MessageSerializer(env, WebsocketHello)
+    >>> serializer(WebsocketHello(mm={'id': 1, 'state': 's', 'consumer_name': 'abc'}))
+    {'t': 'testing.hello', 'p': None, 'i': '1', 's': 's'}
+
+    >>> env = Envelope(schema=ErrorEnvelopeSchema, name='testing')
+    >>> serializer = MessageSerializer(env, GenericError)
+    >>> serializer(GenericError(msg='Oh no', mm={'state': 'a'}))
+    {'t': 'error.generic', 'p': {'msg': 'Oh no'}, 'i': None, 's': 'f'}
+    """
+
+    def __init__(self, envelope: Envelope, msg_class: type[Message]):
+        self.name = msg_class.name
+        # (key, message meta attribute or None for constants, default value)
+        self.plan = []
+        for key, field in envelope.schema.__fields__.items():
+            if key in ("t", "p"):
+                continue
+            if field.field_info.const:
+                self.plan.append((key, None, field.default))
+            else:
+                self.plan.append((key, field.alias, field.default))
+
+    def __call__(self, message: Message) -> dict:
+        data = {
+            "t": self.name,
+            "p": None if message.data is None else message.data.dict(),
+        }
+        mm = message.mm
+        for key, attr, default in self.plan:
+            if attr is None:
+                data[key] = default
+            else:
+                value = getattr(mm, attr, None)
+                data[key] = default if value is None else value
+        return data
@@ -0,0 +1,65 @@
+from json import loads
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.test import TransactionTestCase
+from django.test import override_settings
+from pydantic import ValidationError
+
+from envelope.envelopes import incoming
+from envelope.envelopes import outgoing
+from envelope.messages.ping import Ping
+from envelope.testing import mk_communicator
+from envelope.testing import testing_channel_layers_setting
+
+User = get_user_model()
+
+ORJSON = "envelope.core.codecs.OrjsonCodec"
+
+
+class EnvelopeCodecTests(TestCase):
+    def test_parse_same_result(self):
+        text_data = '{"t": "s.ping", "i": "a", "p": {"x": [1, 2.5, "ö"]}}'
+        default = incoming.parse(text_data)
+        with override_settings(ENVELOPE_CODEC=ORJSON):
+            self.assertEqual(default, incoming.parse(text_data))
+
+    def test_pack_same_data(self):
+        msg = Ping(mm={"id": "a", "state": "s"})
+        default = outgoing.dumps(outgoing.pack(msg))
+        with override_settings(ENVELOPE_CODEC=ORJSON):
+            fast = outgoing.dumps(outgoing.pack(msg))
+        self.assertNotEqual(default, fast)
+        self.assertEqual(loads(default), loads(fast))
+
+    @override_settings(ENVELOPE_CODEC=ORJSON)
+    def test_parse_errors_are_validation_errors(self):
+        for text_data in ("", " ", "{", b"\xff", "[]"):
+            with self.assertRaises(ValidationError):
+                incoming.parse(text_data)
+
+
+@override_settings(
+    CHANNEL_LAYERS=testing_channel_layers_setting,
+    ENVELOPE_CONNECTIONS_QUEUE=None,
+    ENVELOPE_CODEC=ORJSON,
+)
+class ConsumerCodecTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="hello")
+        self.client.force_login(self.user)
+
+    async def test_ping_pong(self):
+        communicator = await mk_communicator(self.client)
+        await communicator.send_to(text_data='{"t":"s.ping","i":"a"}')
+        response = await communicator.receive_from()
+        self.assertEqual('{"t":"s.pong","p":null,"i":"a","s":"s"}', response)
+        await communicator.disconnect()
+
+    async def test_error(self):
+        communicator = await mk_communicator(self.client)
+        await communicator.send_to(text_data="{")
+        response = loads(await communicator.receive_from())
+        self.assertEqual("error.validation", response["t"])
+        self.assertEqual("value_error.jsondecode", response["p"]["errors"][0]["type"])
+        await communicator.disconnect()
@@ -0,0 +1,56 @@
+from django.test import TestCase
+
+from envelope.channels.messages import Subscribed
+from envelope.envelopes import errors
+from envelope.envelopes import incoming
+from envelope.envelopes import internal
+from envelope.envelopes import outgoing
+from envelope.messages.common import ProgressNum
+from envelope.messages.errors import MessageTypeError
+from envelope.messages.ping import Ping
+from envelope.messages.ping import Pong
+
+
+class SerializerTests(TestCase):
+    def _validated(self, envelope, message) -> str:
+        """
+        How envelopes were packed before serializers existed
+        """
+        kwargs = message.mm.dict(exclude={"consumer_name"}, exclude_none=True)
+        if message.data is not None:
+            kwargs["p"] = message.data.dict()
+        return envelope.schema(t=message.name, **kwargs).json()
+
+    def test_same_as_validated(self):
+        mm = {"id": "abc", "state": "s", "consumer_name": "a", "language": "sv"}
+        checks = [
+            (outgoing, Pong(mm=mm)),
+            (outgoing, ProgressNum(curr=1, total=3, mm=mm)),
+            (
+                outgoing,
+                Subscribed(
+                    pk=1,
+                    channel_type="user",
+                    channel_name="user_1",
+                    app_state=[{"t": "a", "p": {"x": 1}}],
+                    mm=mm,
+                ),
+            ),
+            (incoming, Ping(mm=mm)),
+            (internal, Ping(mm=mm)),
+            (errors, MessageTypeError(envelope="x", type_name="y", mm=mm)),
+            (errors, MessageTypeError(envelope="x", type_name="y")),
+        ]
+        for envelope, message in checks:
+            with self.subTest(envelope=envelope.name, message=message.name):
+                self.assertEqual(
+                    self._validated(envelope, message), envelope.serialize(message)
+                )
+                self.assertEqual(
+                    envelope.parse(envelope.serialize(message)),
+                    envelope.pack(message),
+                )
+
+    def test_serializer_cached(self):
+        self.assertIs(outgoing.get_serializer(Pong), outgoing.get_serializer(Pong))
+        self.assertIsNot(outgoing.get_serializer(Pong), incoming.get_serializer(Pong))
@@ -0,0 +1,73 @@
+from django.test import TestCase
+from django.test import override_settings
+from pydantic import ValidationError
+
+from envelope.channels.messages import Subscribed
+from envelope.channels.models import AppState
+from envelope.channels.schemas import ChannelSubscription
+from envelope.core.envelope import Envelope
+from envelope.envelopes import outgoing
+from envelope.messages.common import ProgressNum
+from envelope.schemas import OutgoingEnvelopeSchema
+from envelope.testing import WebsocketHello
+
+
+class TrustedMessageTests(TestCase):
+    def _mk_subscribed(self, **kwargs):
+        app_state = AppState()
+        app_state.append(WebsocketHello())
+        app_state.append(ProgressNum(curr=1, total=2))
+        return Subscribed(
+            pk=1,
+            channel_type="user",
+            channel_name="user_1",
+            app_state=list(app_state),
+            **kwargs,
+        )
+
+    def test_trusted_not_validated(self):
+        msg = ProgressNum(curr="Not validated", total=2)
+        self.assertEqual("Not validated", msg.data.curr)
+
+    @override_settings(ENVELOPE_VALIDATE_TRUSTED=True)
+    def test_validate_trusted_setting(self):
+        with self.assertRaises(ValidationError):
+            ProgressNum(curr="Not validated", total=2)
+        with self.assertRaises(ValidationError):
+            ProgressNum.from_payload(
+                mm={}, data={"curr": "a", "total": 2}, trusted=True
+            )
+
+    def test_app_state_constructed(self):
+        msg = self._mk_subscribed()
+        self.assertIsInstance(msg.data, ChannelSubscription)
+        self.assertIsInstance(msg.data.app_state[0], OutgoingEnvelopeSchema)
+        self.assertEqual(
+            '{"t": "channel.subscribed", "p": {"pk": 1, "channel_type": "user", "channel_name": "user_1", '
+            '"app_state": [{"t": "testing.hello", "p": null, "i": null, "s": null}, '
+            '{"t": "progress.num", "p": {"curr": 1, "total": 2, "msg": null}, "i": null, "s": null}]}, '
+            '"i": null, "s": null}',
+            outgoing.serialize(msg),
+        )
+
+    def test_same_output_as_validated(self):
+        trusted = self._mk_subscribed()
+        with override_settings(ENVELOPE_VALIDATE_TRUSTED=True):
+            validated = self._mk_subscribed()
+        self.assertEqual(outgoing.serialize(validated), outgoing.serialize(trusted))
+
+    def test_extra_keys_dropped(self):
+        msg = ProgressNum(curr=1, total=2, other="Not a field")
+        self.assertEqual({"curr": 1, "total": 2, "msg": None}, msg.data.dict())
+
+    def test_untrusted_envelope_validates(self):
+        data = outgoing.parse('{"t": "progress.num", "p": {"curr": "a", "total": 2}}')
+        with self.assertRaises(ValidationError):
+            outgoing.unpack(data)
+
+    def test_trusted_envelope(self):
+        env = Envelope(schema=OutgoingEnvelopeSchema, name=outgoing.name, trusted=True)
+        # Note that registry is shared with the outgoing envelope
+        data = env.parse('{"t": "progress.num", "p": {"curr": "a", "total": 2}}')
+        msg = env.unpack(data)
+        self.assertEqual("a", msg.data.curr)
@@ -1,9 +1,15 @@
 from __future__ import annotations
 from abc import ABC
 from abc import abstractmethod
+from collections import OrderedDict
 from typing import TYPE_CHECKING
+from uuid import uuid4
+
+from envelope.utils import get_compression_threshold
+from envelope.utils import get_subprotocol_codecs
 
 if TYPE_CHECKING:
+    from pydantic import BaseModel
     from envelope.core.envelope import Envelope
     from envelope.core.message import Message
 
@@ -11,9 +17,37 @@ __all__ = (
     "Transport",
     "TextTransport",
     "DictTransport",
+    "EventMemo",
+    "event_memo",
+    "compressed_memo",
 )
 
 
+_plain_scalars = (str, int, float, bool, type(None))
+
+
+def _is_plain(value) -> bool:
+    """
+    True if value would come back the same after a round trip through any codec.
+
+    >>> _is_plain({'a': [1, 'b', None, 1.5]})
+    True
+    >>> from datetime import date
+    >>> _is_plain({'a': [date(2024, 1, 1)]})
+    False
+    >>> _is_plain({1: 'a'})
+    False
+    """
+    tp = type(value)
+    if tp in _plain_scalars:
+        return True
+    if tp is list:
+        return all(_is_plain(x) for x in value)
+    if tp is dict:
+        return all(type(k) is str and _is_plain(v) for k, v in value.items())
+    return False
+
+
 class Transport(ABC):
     def __init__(self, type_name: str):
         self.type_name = type_name
@@ -23,20 +57,118 @@ class Transport(ABC):
 
 
 class TextTransport(Transport):
+    """
+    If the envelope has listeners for the message, the payload is added as 'p'
+    (decoded from text_data if it contains anything other than plain json types) and the event gets a unique key 'e' that receivers can use with EventMemo.
+
+    >>> from envelope.testing import testing_envelope
+    >>> from envelope.testing import WebsocketHello
+    >>> transport = TextTransport('websocket.send')
+    >>> event = transport(testing_envelope, WebsocketHello(mm={'id': 1}))
+    >>> event['text_data']
+    '{"t": "testing.hello", "p": null, "i": "1", "s": null}'
+    >>> sorted(event)
+    ['i', 's', 't', 'text_data', 'type']
+
+    Any other codecs used by subprotocols get their own pre-encoded version in 'frames',
+    so consumers in a group won't have to encode the message once each.
+
+    >>> from django.test import override_settings
+    >>> with override_settings(ENVELOPE_SUBPROTOCOLS={'envelope.msgpack': 'envelope.core.codecs.MsgPackCodec'}):
+    ...     event = transport(testing_envelope, WebsocketHello(mm={'id': 1}))
+    >>> event['frames']
+    {'msgpack': b'\\x84\\xa1t\\xadtesting.hello\\xa1p\\xc0\\xa1i\\xa11\\xa1s\\xc0'}
+
+    Large frames aren't compressed here, since most connections may not support it.
+    When ENVELOPE_COMPRESSION_THRESHOLD is set they get an 'e' key as well, so consumers
+    can compress them once per process with compressed_memo.
+
+    >>> with override_settings(ENVELOPE_COMPRESSION_THRESHOLD=10):
+    ...     event = transport(testing_envelope, WebsocketHello(mm={'id': 1}))
+    >>> sorted(event)
+    ['e', 'i', 's', 't', 'text_data', 'type']
+    """
+
     def __call__(self, envelope: Envelope, message: Message) -> dict:
-        packed = envelope.pack(message)
-        return {
-            "text_data": packed.json(),
+        packed = envelope.get_serializer(message.__class__)(message)
+        text_data = envelope.codec.dumps(packed)
+        data = {
+            "text_data": text_data,
             "type": self.type_name,
-            "i": packed.i,
-            "t": packed.t,
-            "s": getattr(packed, "s", None),
+            "i": packed.get("i"),
+            "t": packed["t"],
+            "s": packed.get("s"),
         }
+        frames = {}
+        for codec in get_subprotocol_codecs().values():
+            if codec.name != envelope.codec.name and codec.name not in frames:
+                frames[codec.name] = codec.dumps(packed)
+        if frames:
+            data["frames"] = frames
+        threshold = get_compression_threshold()
+        if threshold is not None and any(
+            len(x) >= threshold for x in (text_data, *frames.values())
+        ):
+            data["e"] = uuid4().hex
+        if envelope.message_signal and envelope.message_signal.has_listeners(
+            message.__class__
+        ):
+            # Layers may not be able to serialize whatever is in p, so anything that isn't plain is decoded
+            payload = packed["p"]
+            if not _is_plain(payload):
+                payload = envelope.codec.loads(text_data)["p"]
+            data["p"] = payload
+            data.setdefault("e", uuid4().hex)
+        return data
 
 
 class DictTransport(Transport):
     def __call__(self, envelope: Envelope, message: Message) -> dict:
-        packed = envelope.pack(message)
-        data = packed.dict()
+        data = envelope.get_serializer(message.__class__)(message)
         data["type"] = self.type_name
         return data
+
+
+class EventMemo:
+    """
+    Per-process memo of things derived from layer events, keyed by the events 'e' key.
+    Consumers on the same node that receive the same group message will share validated payloads
+    (event_memo) and compressed frames (compressed_memo) instead of working them out once per consumer.
+    Shared payloads must be treated as read-only!
+
+    >>> memo = EventMemo(maxsize=2)
+    >>> memo['a'] = 1
+    >>> memo['b'] = 2
+    >>> memo['a']
+    1
+    >>> memo['c'] = 3
+    >>> 'b' in memo
+    False
+    >>> sorted(memo.data)
+    ['a', 'c']
+    """
+
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self.data: OrderedDict[str, BaseModel | str | bytes | None] = OrderedDict()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.data
+
+    def __getitem__(self, key: str) -> BaseModel | str | bytes | None:
+        value = self.data[key]
+        self.data.move_to_end(key)
+        return value
+
+    def __setitem__(self, key: str, value: BaseModel | str | bytes | None):
+        self.data[key] = value
+        if len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def clear(self):
+        self.data.clear()
+
+
+event_memo = EventMemo()
+# Frames are large, so keep fewer of them
+compressed_memo = EventMemo(maxsize=64)
@@ -0,0 +1,169 @@
+from __future__ import annotations
+
+import threading
+from datetime import datetime
+from functools import reduce
+from logging import getLogger
+from operator import or_
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Case
+from django.db.models import F
+from django.db.models import Q
+from django.db.models import Value
+from django.db.models import When
+
+from envelope.models import Connection
+from envelope.utils import update_connection_status
+
+__all__ = (
+    "ActivityBuffer",
+    "get_activity_buffer",
+    "record_action",
+)
+
+logger = getLogger(__name__)
+
+_buffer: ActivityBuffer | None = None
+
+
+class ActivityBuffer:
+    """
+    Collects Connection.last_action per (user_pk, channel_name) in worker memory,
+    and writes them as one UPDATE every interval seconds from a background thread.
+    Only the latest timestamp for each connection is kept, and stored timestamps are never moved back.
+
+    Workers start the buffer when they start working and stop it when they're done,
+    the last one to stop flushes what's left. Until then, actions are written right away.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.pending: dict[tuple[int, str], datetime] = {}
+        self.lock = threading.Lock()
+        self.users = 0
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def active(self) -> bool:
+        return self.users > 0
+
+    def add(self, user_pk: int, channel_name: str, action_at: datetime):
+        key = (user_pk, channel_name)
+        with self.lock:
+            current = self.pending.get(key)
+            if current is None or current < action_at:
+                self.pending[key] = action_at
+
+    def flush(self) -> int:
+        """
+        Write pending timestamps, returns number of connections written.
+        """
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if not pending:
+            return 0
+        return write_actions(pending)
+
+    def start(self):
+        with self.lock:
+            self.users += 1
+            if self._thread is not None:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="envelope-activity", daemon=True
+            )
+        self._thread.start()
+
+    def stop(self):
+        with self.lock:
+            self.users = max(self.users - 1, 0)
+            if self.users or self._thread is None:
+                return
+            thread, self._thread = self._thread, None
+        self._stop.set()
+        thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._flush_logged()
+        self._flush_logged()
+
+    def _flush_logged(self):
+        close_old_connections()
+        try:
+            self.flush()
+        except Exception:  # pragma: no cover
+            logger.exception("Failed to write connection actions")
+        finally:
+            close_old_connections()
+
+
+def write_actions(actions: dict[tuple[int, str], datetime]) -> int:
+    """
+    Set last_action for many connections with one UPDATE.
+    Connections that don't exist are created, like update_connection_status does.
+    """
+    key_qs = {key: Q(user_id=key[0], channel_name=key[1]) for key in actions}
+    when = [
+        When(
+            key_qs[key] & (Q(last_action__isnull=True) | Q(last_action__lt=action_at)),
+            then=Value(action_at),
+        )
+        for key, action_at in actions.items()
+    ]
+    updated = Connection.objects.filter(reduce(or_, key_qs.values())).update(
+        last_action=Case(*when, default=F("last_action"))
+    )
+    if updated < len(actions):
+        existing = set(
+            Connection.objects.filter(reduce(or_, key_qs.values())).values_list(
+                "user_id", "channel_name"
+            )
+        )
+        Connection.objects.bulk_create(
+            [
+                Connection(user_id=key[0], channel_name=key[1], last_action=action_at)
+                for key, action_at in actions.items()
+                if key not in existing
+            ],
+            ignore_conflicts=True,
+        )
+    return len(actions)
+
+
+def get_activity_buffer() -> ActivityBuffer | None:
+    """
+    Buffer for this process, or None if ENVELOPE_ACTIVITY_FLUSH_INTERVAL is None.
+
+    >>> from django.test import override_settings
+    >>> get_activity_buffer()
+    <envelope.deferred_jobs.activity.ActivityBuffer object at ...>
+    >>> with override_settings(ENVELOPE_ACTIVITY_FLUSH_INTERVAL=None):
+    ...     get_activity_buffer() is None
+    True
+    """
+    global _buffer
+    interval = getattr(settings, "ENVELOPE_ACTIVITY_FLUSH_INTERVAL", 10)
+    if not interval:
+        return None
+    if _buffer is None:
+        _buffer = ActivityBuffer(interval)
+    return _buffer
+
+
+def record_action(user_pk: int, channel_name: str, action_at: datetime):
+    """
+    Set last_action on a connection. Buffered when running within an envelope worker,
+    otherwise it's written right away. Sync code only.
+    """
+    buffer = get_activity_buffer()
+    if buffer is not None and buffer.active:
+        buffer.add(user_pk, channel_name, action_at)
+    else:
+        update_connection_status(
+            user_pk, channel_name=channel_name, last_action=action_at
+        )
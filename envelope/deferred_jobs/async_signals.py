@@ -9,14 +9,19 @@ from django.utils.timezone import now
 from django_rq import get_queue
 
 from envelope.async_signals import consumer_connected
+from envelope.async_signals import concurrent
 from envelope.async_signals import consumer_closed
 from envelope.async_signals import incoming_internal_message
 from envelope.async_signals import incoming_websocket_message
 from envelope.async_signals import outgoing_websocket_error
+from envelope.async_signals import message_types
 from envelope.async_signals import outgoing_websocket_message
 from envelope.deferred_jobs.jobs import create_connection_status_on_websocket_connect
 from envelope.deferred_jobs.jobs import mark_connection_action
+from envelope.deferred_jobs.local import run_local
+from envelope.deferred_jobs.local import use_local_backend
 from envelope.deferred_jobs.jobs import update_connection_status_on_websocket_close
+from envelope.deferred_jobs.enqueue import run_enqueue
 from envelope.deferred_jobs.message import DeferredJob
 
 if TYPE_CHECKING:
@@ -31,7 +36,8 @@ async def dispatch_connection_job(consumer: WebsocketConsumer, **kwargs):
         if queue_name := getattr(settings, "ENVELOPE_CONNECTIONS_QUEUE", None):
             queue = get_queue(name=queue_name)
             consumer.last_job = now()
-            queue.enqueue(
+            await run_enqueue(
+                queue.enqueue,
                 create_connection_status_on_websocket_connect,
                 user_pk=consumer.user_pk,
                 consumer_name=consumer.channel_name,
@@ -53,7 +59,8 @@ async def dispatch_disconnection_job(
         if queue_name := getattr(settings, "ENVELOPE_CONNECTIONS_QUEUE", None):
             queue = get_queue(name=queue_name)
             consumer.last_job = now()  # We probably don't need to care about this :)
-            queue.enqueue(
+            await run_enqueue(
+                queue.enqueue,
                 update_connection_status_on_websocket_close,
                 user_pk=consumer.user_pk,
                 consumer_name=consumer.channel_name,
@@ -69,6 +76,7 @@ async def dispatch_disconnection_job(
 
 
 @receiver(incoming_websocket_message)
+@concurrent
 async def maybe_update_connection(*, consumer: WebsocketConsumer, **kwargs):
     if consumer.connection_update_interval is not None and consumer.user_pk:
         if queue_name := getattr(settings, "ENVELOPE_TIMESTAMP_QUEUE", None):
@@ -80,7 +88,8 @@ async def maybe_update_connection(*, consumer: WebsocketConsumer, **kwargs):
             ):
                 consumer.event_logger.debug("Queued conn update", consumer=consumer)
                 # FIXME: configurable probably
-                return queue.enqueue(
+                return await run_enqueue(
+                    queue.enqueue,
                     mark_connection_action,
                     user_pk=consumer.user_pk,
                     action_at=now(),
@@ -96,12 +105,29 @@ async def maybe_update_connection(*, consumer: WebsocketConsumer, **kwargs):
         outgoing_websocket_message,
     ),
 )
+@message_types(DeferredJob)
 async def queue_deferred_job(
     *, consumer: WebsocketConsumer, message: DeferredJob, **kwargs
 ):
-    if isinstance(message, DeferredJob):
-        await message.pre_queue(consumer=consumer, **kwargs)
-        if message.should_run:
-            job = message.enqueue()
-            consumer.last_job = now()
-            await message.post_queue(job=job, consumer=consumer, **kwargs)
+    await message.pre_queue(consumer=consumer, **kwargs)
+    if message.should_run and use_local_backend(message):
+        consumer.last_job = now()
+        # Before running, so acks are sent before anything the job sends
+        await message.post_queue(job=None, consumer=consumer, **kwargs)
+        await run_local(message)
+    elif message.should_run:
+        if message.idempotency_ttl and message.mm.id is not None:
+            job_id, created = await run_enqueue(message.claim_job_id)
+            if not created:
+                await message.on_duplicate(job_id=job_id, consumer=consumer, **kwargs)
+                return
+            message.job_id = job_id
+            try:
+                job = await message.async_enqueue()
+            except Exception:
+                await run_enqueue(message.release_job_id)
+                raise
+        else:
+            job = await message.async_enqueue()
+        consumer.last_job = now()
+        await message.post_queue(job=job, consumer=consumer, **kwargs)
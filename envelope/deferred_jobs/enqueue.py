@@ -0,0 +1,198 @@
+from __future__ import annotations
+
+import asyncio
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from logging import getLogger
+from typing import TYPE_CHECKING
+from typing import Any
+from typing import NamedTuple
+from weakref import WeakKeyDictionary
+
+from django.conf import settings
+from django_rq import get_queue
+
+if TYPE_CHECKING:
+    from rq import Queue
+    from rq.job import Job
+    from envelope.deferred_jobs.message import DeferredJob
+
+__all__ = (
+    "get_enqueue_executor",
+    "get_enqueue_semaphore",
+    "run_enqueue",
+    "EnqueueBatcher",
+    "get_enqueue_batcher",
+)
+
+logger = getLogger(__name__)
+
+_executors: dict[int, ThreadPoolExecutor] = {}
+_batchers: WeakKeyDictionary[asyncio.AbstractEventLoop, EnqueueBatcher] = (
+    WeakKeyDictionary()
+)
+# Running flushes, so they won't be garbage collected before they're done
+_tasks: set[asyncio.Task] = set()
+# Semaphores by loop and limit
+_semaphores: WeakKeyDictionary[
+    asyncio.AbstractEventLoop, dict[int, asyncio.Semaphore]
+] = WeakKeyDictionary()
+
+
+def get_enqueue_executor() -> ThreadPoolExecutor | None:
+    """
+    Thread pool for enqueueing jobs from the event loop, with ENVELOPE_ENQUEUE_WORKERS threads.
+    None if enqueueing should happen on the event loop.
+
+    >>> from django.test import override_settings
+    >>> get_enqueue_executor()
+    <concurrent.futures.thread.ThreadPoolExecutor object at ...>
+    >>> with override_settings(ENVELOPE_ENQUEUE_WORKERS=0):
+    ...     get_enqueue_executor() is None
+    True
+    """
+    max_workers = getattr(settings, "ENVELOPE_ENQUEUE_WORKERS", 4)
+    if not max_workers:
+        return None
+    try:
+        return _executors[max_workers]
+    except KeyError:
+        executor = _executors[max_workers] = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="envelope-enqueue"
+        )
+        return executor
+
+
+def get_enqueue_semaphore() -> asyncio.Semaphore | None:
+    """
+    Limits calls to run_enqueue waiting for or running in the executor on the running loop
+    to ENVELOPE_ENQUEUE_MAX_PENDING. None if there's no limit.
+    """
+    limit = getattr(settings, "ENVELOPE_ENQUEUE_MAX_PENDING", 100)
+    if not limit:
+        return None
+    by_limit = _semaphores.setdefault(asyncio.get_running_loop(), {})
+    try:
+        return by_limit[limit]
+    except KeyError:
+        semaphore = by_limit[limit] = asyncio.Semaphore(limit)
+        return semaphore
+
+
+async def run_enqueue(func: Callable, *args, **kwargs) -> Any:
+    """
+    Run a function that talks to Redis, like Queue.enqueue, without blocking the event loop.
+    Consumers on the same process share the executor, so a slow Redis will at most
+    tie up its threads rather than every socket. The executors work queue is unbounded,
+    so callers wait here when ENVELOPE_ENQUEUE_MAX_PENDING calls are already pending.
+
+    >>> from asgiref.sync import async_to_sync
+    >>> async_to_sync(run_enqueue)(sum, [1, 2])
+    3
+    """
+    executor = get_enqueue_executor()
+    if executor is None:
+        return func(*args, **kwargs)
+    loop = asyncio.get_running_loop()
+    semaphore = get_enqueue_semaphore()
+    if semaphore is None:
+        return await loop.run_in_executor(executor, partial(func, *args, **kwargs))
+    async with semaphore:
+        return await loop.run_in_executor(executor, partial(func, *args, **kwargs))
+
+
+class _Pending(NamedTuple):
+    message: DeferredJob
+    queue: Queue
+    # Options for Queue.enqueue, like ttl or job_timeout
+    kwargs: dict
+    future: asyncio.Future
+
+
+class EnqueueBatcher:
+    """
+    Gathers deferred jobs enqueued from consumers within one loop tick, and enqueues them together
+    with Queue.enqueue_many. One per event loop, so bursts from many consumers are batched too.
+    If enqueueing them together fails, they're enqueued one by one, so each consumer only gets
+    the errors of its own messages.
+    """
+
+    def __init__(self):
+        self.pending: list[_Pending] = []
+
+    async def enqueue(self, message: DeferredJob, **kwargs) -> Job:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        # Queues are picked right away, only talking to Redis happens in the executor
+        queue = get_queue(name=message.queue)
+        self.pending.append(_Pending(message, queue, kwargs, future))
+        if len(self.pending) == 1:
+            task = loop.create_task(self.flush())
+            _tasks.add(task)
+            task.add_done_callback(_flush_done)
+        return await future
+
+    @staticmethod
+    def enqueue_pending(items: list[_Pending]) -> list[Job]:
+        """
+        Enqueue items for the same queue with one Redis round-trip. Sync code.
+        """
+        return items[0].queue.enqueue_many(
+            [x.message.prepare_data(**x.kwargs) for x in items]
+        )
+
+    @staticmethod
+    async def enqueue_one(item: _Pending) -> Job:
+        return await run_enqueue(item.message.enqueue, item.queue, **item.kwargs)
+
+    async def flush(self):
+        pending, self.pending = self.pending, []
+        by_queue: dict[str, list[_Pending]] = {}
+        for item in pending:
+            by_queue.setdefault(item.message.queue, []).append(item)
+        for items in by_queue.values():
+            if len(items) == 1:
+                outcomes = await asyncio.gather(
+                    self.enqueue_one(items[0]), return_exceptions=True
+                )
+            else:
+                try:
+                    outcomes = await run_enqueue(self.enqueue_pending, items)
+                except Exception:
+                    # One bad message shouldn't fail the others, so enqueue them one by one
+                    logger.warning(
+                        "Enqueueing %s jobs together failed, enqueueing them one by one",
+                        len(items),
+                        exc_info=True,
+                    )
+                    outcomes = await asyncio.gather(
+                        *(self.enqueue_one(x) for x in items), return_exceptions=True
+                    )
+            for item, outcome in zip(items, outcomes):
+                if item.future.done():
+                    continue
+                if isinstance(outcome, BaseException):
+                    item.future.set_exception(outcome)
+                else:
+                    item.future.set_result(outcome)
+
+
+def _flush_done(task: asyncio.Task):
+    _tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Flushing enqueued jobs failed", exc_info=task.exception())
+
+
+def get_enqueue_batcher() -> EnqueueBatcher | None:
+    """
+    Batcher for the running loop, or None if ENVELOPE_BATCH_ENQUEUE is False.
+    """
+    if not getattr(settings, "ENVELOPE_BATCH_ENQUEUE", True):
+        return None
+    loop = asyncio.get_running_loop()
+    try:
+        return _batchers[loop]
+    except KeyError:
+        batcher = _batchers[loop] = EnqueueBatcher()
+        return batcher
@@ -7,6 +7,7 @@ from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.utils.translation import activate
 
+from envelope.deferred_jobs.activity import record_action
 from envelope.signals import connection_closed
 from envelope.signals import connection_created
 from envelope.utils import update_connection_status
@@ -16,8 +17,8 @@ User = get_user_model()
 logger = getLogger(__name__)
 
 
-# FIXME: We'll need our own worker class to have decent throughput
-# https://python-rq-docs-cn.readthedocs.io/en/latest/workers.html#performance-notes
+# Run these with the envelope_worker management command for decent throughput,
+# see envelope.deferred_jobs.worker
 
 
 def _set_lang(lang=None):
@@ -88,4 +89,4 @@ def mark_connection_action(
     consumer_name: str,
     action_at: datetime,
 ):
-    update_connection_status(user_pk, channel_name=consumer_name, last_action=action_at)
+    record_action(user_pk, consumer_name, action_at)
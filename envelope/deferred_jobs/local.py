@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+from typing import TYPE_CHECKING
+from weakref import WeakKeyDictionary
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+from envelope import JobBackend
+
+if TYPE_CHECKING:
+    from envelope.deferred_jobs.message import DeferredJob
+
+__all__ = (
+    "get_local_executor",
+    "get_local_semaphore",
+    "use_local_backend",
+    "run_local",
+)
+
+logger = getLogger(__name__)
+
+_executors: dict[int, ThreadPoolExecutor] = {}
+# Running jobs, so they won't be garbage collected before they're done
+_tasks: set[asyncio.Task] = set()
+# Semaphores by loop and limit
+_semaphores: WeakKeyDictionary[
+    asyncio.AbstractEventLoop, dict[int, asyncio.Semaphore]
+] = WeakKeyDictionary()
+
+
+def get_local_executor() -> ThreadPoolExecutor:
+    """
+    Thread pool for deferred jobs run within this process,
+    with ENVELOPE_LOCAL_JOB_WORKERS threads.
+
+    >>> get_local_executor()
+    <concurrent.futures.thread.ThreadPoolExecutor object at ...>
+    """
+    max_workers = getattr(settings, "ENVELOPE_LOCAL_JOB_WORKERS", 4)
+    try:
+        return _executors[max_workers]
+    except KeyError:
+        executor = _executors[max_workers] = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="envelope-job"
+        )
+        return executor
+
+
+def get_local_semaphore() -> asyncio.Semaphore | None:
+    """
+    Limits local jobs waiting for or running in the executor on the running loop
+    to ENVELOPE_LOCAL_JOB_MAX_PENDING. None if there's no limit.
+    """
+    limit = getattr(settings, "ENVELOPE_LOCAL_JOB_MAX_PENDING", 100)
+    if not limit:
+        return None
+    by_limit = _semaphores.setdefault(asyncio.get_running_loop(), {})
+    try:
+        return by_limit[limit]
+    except KeyError:
+        semaphore = by_limit[limit] = asyncio.Semaphore(limit)
+        return semaphore
+
+
+def use_local_backend(message: DeferredJob) -> bool:
+    """
+    >>> from django.test import override_settings
+    >>> from envelope.channels.messages import Subscribe
+    >>> msg = Subscribe(pk=1, channel_type='user')
+    >>> use_local_backend(msg)
+    False
+    >>> msg.backend = JobBackend.LOCAL
+    >>> use_local_backend(msg)
+    True
+    >>> with override_settings(ENVELOPE_FORCE_RQ=True):
+    ...     use_local_backend(msg)
+    False
+    """
+    return message.backend == JobBackend.LOCAL and not getattr(
+        settings, "ENVELOPE_FORCE_RQ", False
+    )
+
+
+def _run_job(message: DeferredJob, job_kwargs: dict):
+    close_old_connections()
+    try:
+        return message.init_job(**job_kwargs)
+    except Exception as exc:
+        # Same as jobs failing on RQ workers
+        logger.exception("Local job %s failed", message.name)
+        message.send_job_failure(job_kwargs["mm"], exc)
+    finally:
+        close_old_connections()
+
+
+async def run_local(message: DeferredJob) -> asyncio.Task:
+    """
+    Run init_job for message in the local thread pool without waiting for it, like enqueueing it would.
+    The job runs the same way it would on a worker: within a transaction if it's atomic,
+    with the language of the message, and errors are sent to the consumer.
+    The executors work queue is unbounded, so callers wait here until the job can start
+    when ENVELOPE_LOCAL_JOB_MAX_PENDING jobs are already pending.
+    """
+    semaphore = get_local_semaphore()
+    if semaphore is not None:
+        await semaphore.acquire()
+    func = sync_to_async(
+        _run_job, thread_sensitive=False, executor=get_local_executor()
+    )
+    task = asyncio.get_running_loop().create_task(
+        func(message, message.get_job_kwargs())
+    )
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    if semaphore is not None:
+        task.add_done_callback(lambda _: semaphore.release())
+    return task
@@ -1,32 +1,64 @@
 from __future__ import annotations
 
+import json
 from abc import ABC
 from abc import abstractmethod
+from collections.abc import Sequence
 from datetime import datetime
+from hashlib import sha1
+from time import monotonic
 from typing import TYPE_CHECKING
+from uuid import uuid4
 
+from django.conf import settings
 from django.db import transaction
 from django.utils.functional import cached_property
 from django.utils.timezone import now
 from django.utils.translation import activate
 from django_rq import get_queue
 from pydantic import BaseModel
+from pydantic import ValidationError
 from rq import Queue
 
 from envelope import DEFAULT_QUEUE_NAME
 from envelope import Error
+from envelope import JobBackend
+from envelope import Priority
 from envelope.core.message import ErrorMessage
 from envelope.core.message import Message
+from envelope.deferred_jobs.activity import record_action
+from envelope.deferred_jobs.enqueue import get_enqueue_batcher
+from envelope.deferred_jobs.enqueue import run_enqueue
+from envelope.deferred_jobs.routing import get_queue_router
+from envelope.schemas import MessageMeta
 from envelope.utils import get_error_type
-from envelope.utils import update_connection_status
+from envelope.utils import websocket_send
 from envelope.utils import websocket_send_error
 
 if TYPE_CHECKING:
     from envelope.consumers.websocket import WebsocketConsumer
     from django.db.models import Model
     from rq.job import Job
+    from rq.queue import EnqueueData
 
 _marker = object()
+# Outcome from run_jobs for messages that sent an ErrorMessage to the consumer, see run_isolated
+ERROR_SENT = object()
+# Options to Queue.enqueue that aren't passed on to the job, other than job_timeout. See prepare_data
+_enqueue_options = (
+    "description",
+    "result_ttl",
+    "ttl",
+    "failure_ttl",
+    "depends_on",
+    "job_id",
+    "at_front",
+    "meta",
+    "retry",
+    "on_success",
+    "on_failure",
+    "on_stopped",
+)
 
 
 class DeferredJob(Message, ABC):
@@ -40,10 +72,54 @@ class DeferredJob(Message, ABC):
     job_timeout: int | None = None  # Job exec timeout in seconds
     failure_ttl: int | None = None  # Keep result, in seconds
     queue: str = DEFAULT_QUEUE_NAME  # Queue name
+    # Used to pick a queue when ENVELOPE_QUEUE_ROUTES is set, see envelope.deferred_jobs.routing
+    priority: str = Priority.NORMAL
+    # Envelope workers run up to this many queued jobs of this type at once, see run_jobs
+    batch_size: int | None = None
+    # Small jobs can run within the consumers process instead, see envelope.deferred_jobs.local
+    backend: str = JobBackend.RQ
     # Envelope/Django things
     atomic: bool = True
     on_worker: bool = False
     should_run: bool = True  # Mark as false to abort run
+    # Don't validate the payload within the consumer, pass it along to the worker and validate it there.
+    # Only the basic envelope structure is checked by the consumer. Note that data will be None
+    # until the message reaches the worker, so pre_queue, should_run and post_queue can't use it.
+    passthrough: bool = False
+    raw_data: dict | None = None  # Payload kept as is when passthrough is used
+    # Enqueue a message only once within this many seconds. Clients retrying with the same id
+    # and payload get an ack with the existing job instead, see on_duplicate.
+    idempotency_ttl: int | None = None
+    job_id: str | None = None  # Set when the job id is picked before enqueueing
+    # Seconds between progress messages from report_progress, None means ENVELOPE_PROGRESS_INTERVAL
+    progress_interval: float | None = None
+    _progress_sent_at: float | None = None
+    _progress_pending: dict | None = None
+
+    @classmethod
+    def from_payload(
+        cls, *, mm: dict | MessageMeta, data: dict | None, trusted: bool = False
+    ) -> DeferredJob:
+        """
+        >>> from envelope.channels.messages import Subscribe
+        >>> class LazySubscribe(Subscribe):
+        ...     passthrough = True
+        ...
+        >>> msg = LazySubscribe.from_payload(mm={'id': 'a'}, data={'pk': 'Not validated'})
+        >>> msg.data is None
+        True
+        >>> msg.raw_data
+        {'pk': 'Not validated'}
+        >>> msg.mm.id
+        'a'
+        """
+        if not cls.passthrough or isinstance(data, BaseModel):
+            return super().from_payload(mm=mm, data=data, trusted=trusted)
+        message = cls.__new__(cls)
+        message.mm = mm if isinstance(mm, MessageMeta) else MessageMeta(**mm)
+        message.data = None
+        message.raw_data = {} if data is None else data
+        return message
 
     async def pre_queue(self, *, consumer: WebsocketConsumer, **kwargs):
         """
@@ -51,6 +127,118 @@ class DeferredJob(Message, ABC):
         It's a good idea to avoid using this if it's not needed.
         """
 
+    def get_idempotency_key(self) -> str | None:
+        """
+        Redis key for retries of this message, or None if it has no id to tell retries apart.
+
+        >>> from envelope.channels.messages import Subscribe
+        >>> msg = Subscribe(mm={'id': 'a', 'user_pk': 1}, pk=1, channel_type='user')
+        >>> msg.get_idempotency_key()
+        'envelope:idempotency:channel.subscribe:1:a:...'
+        >>> msg.get_idempotency_key() == Subscribe(mm={'id': 'a', 'user_pk': 1}, pk=2, channel_type='user').get_idempotency_key()
+        False
+        >>> Subscribe(pk=1, channel_type='user').get_idempotency_key() is None
+        True
+        """
+        if self.mm.id is None:
+            return None
+        if self.raw_data is not None:
+            data = self.raw_data
+        elif self.data:
+            data = self.data.dict()
+        else:
+            data = {}
+        digest = sha1(
+            json.dumps(data, sort_keys=True, default=str).encode()
+        ).hexdigest()
+        return (
+            f"envelope:idempotency:{self.name}:{self.mm.user_pk}:{self.mm.id}:{digest}"
+        )
+
+    def claim_job_id(self, queue: Queue | None = None) -> tuple[str, bool]:
+        """
+        Pick a job id for this message, unless it's already been enqueued within idempotency_ttl.
+        Returns the job id and True if it's new, or the existing job id and False.
+        This is sync code that talks to Redis.
+        """
+        if queue is None:
+            queue = get_queue(name=self.queue)
+        key = self.get_idempotency_key()
+        job_id = uuid4().hex
+        while True:
+            if queue.connection.set(key, job_id, nx=True, ex=self.idempotency_ttl):
+                return job_id, True
+            existing = queue.connection.get(key)
+            if existing is not None:
+                return existing.decode(), False
+            # Expired in between, try again
+
+    def release_job_id(self, queue: Queue | None = None):
+        """
+        Forget the claimed job id, for instance when enqueueing failed.
+        """
+        if queue is None:
+            queue = get_queue(name=self.queue)
+        queue.connection.delete(self.get_idempotency_key())
+
+    def report_progress(self, curr: int, total: int, msg: str | None = None):
+        """
+        Send progress.num with state running to the consumer from run_job.
+        Sent right away regardless of the job transaction, at most once per progress_interval.
+        Values reported in between are dropped except for the latest one, which is sent with the
+        next report or when the job is done. Reaching total is always sent.
+
+        >>> from unittest import mock
+        >>> from envelope.channels.messages import Subscribe
+        >>> msg = Subscribe(mm={'consumer_name': 'abc'}, pk=1, channel_type='user')
+        >>> msg.progress_interval = 60
+        >>> with mock.patch('envelope.deferred_jobs.message.websocket_send') as mock_send:
+        ...     for i in range(1, 101):
+        ...         msg.report_progress(i, 200)
+        ...     msg.flush_progress()
+        ...     msg.report_progress(200, 200, 'Done')
+        >>> [x.args[0].data.curr for x in mock_send.mock_calls]
+        [1, 100, 200]
+        """
+        if not self.mm.consumer_name:
+            return
+        self._progress_pending = {"curr": curr, "total": total, "msg": msg}
+        interval = self.progress_interval
+        if interval is None:
+            interval = getattr(settings, "ENVELOPE_PROGRESS_INTERVAL", 0.5)
+        if (
+            curr >= total
+            or self._progress_sent_at is None
+            or monotonic() - self._progress_sent_at >= interval
+        ):
+            self.flush_progress()
+
+    def flush_progress(self):
+        """
+        Send the latest progress reported, if it hasn't been sent already.
+        """
+        if self._progress_pending is None:
+            return
+        from envelope.messages.common import ProgressNum
+
+        progress = ProgressNum.from_message(
+            self, state=self.RUNNING, **self._progress_pending
+        )
+        self._progress_pending = None
+        self._progress_sent_at = monotonic()
+        websocket_send(progress, on_commit=False)
+
+    async def on_duplicate(self, *, job_id: str, consumer: WebsocketConsumer, **kwargs):
+        """
+        Called instead of enqueueing when this message was already enqueued within idempotency_ttl.
+        Sends s.queued with the existing job id and state queued by default.
+        """
+        from envelope.messages.common import Queued
+
+        await consumer.send_ws_message(
+            Queued.from_message(self, state=self.QUEUED, job_id=job_id)
+        )
+
     @staticmethod
     def handle_failure(job, connection, exc_type, exc_value, traceback):
         """
@@ -60,7 +248,13 @@ class DeferredJob(Message, ABC):
 
         See RQs docs
         """
-        mm = job.kwargs.get("mm", {})
+        return DeferredJob.send_job_failure(job.kwargs.get("mm", {}), exc_value)
+
+    @staticmethod
+    def send_job_failure(mm: dict, exc_value: BaseException) -> ErrorMessage | None:
+        """
+        Tell the consumer that a job failed, if we know which consumer it came from.
+        """
         if mm:
             if consumer_name := mm.get("consumer_name", None):
                 # FIXME: exc value might not be safe here
@@ -68,6 +262,49 @@ class DeferredJob(Message, ABC):
                 websocket_send_error(err, channel_name=consumer_name)
                 return err  # For testing, has no effect
 
+    @classmethod
+    def load_job_message(cls, data: dict, mm: dict) -> DeferredJob | None:
+        """
+        Create the message on the worker. With passthrough, None if the payload didn't validate,
+        in which case the consumer has been told. Otherwise the consumer already validated the payload,
+        so a ValidationError here is raised and fails the job.
+        """
+        try:
+            message = cls(mm=mm, data=data)
+        except ValidationError as exc:
+            if not cls.passthrough:
+                raise
+            err = get_error_type(Error.VALIDATION)(mm=mm, errors=exc.errors())
+            if err.mm.consumer_name:
+                websocket_send_error(err)
+            return
+        message.on_worker = True
+        message.activate_language()
+        return message
+
+    def activate_language(self):
+        if self.mm.language:
+            # Otherwise skip lang?
+            activate(self.mm.language)
+
+    def send_job_error(self, err: ErrorMessage):
+        """
+        Send an error raised by run_job to the consumer.
+        """
+        if err.mm.id is None:
+            err.mm.id = self.mm.id
+        if err.mm.consumer_name is None:
+            err.mm.consumer_name = self.mm.consumer_name
+        if err.mm.consumer_name:
+            websocket_send_error(err)
+
+    def job_done(self, enqueued_at: datetime | None, update_conn: bool = True):
+        """
+        Called when run_job went fine.
+        """
+        if update_conn and self.mm.user_pk and self.mm.consumer_name:
+            record_action(self.mm.user_pk, self.mm.consumer_name, enqueued_at)
+
     @classmethod
     def init_job(
         cls,
@@ -79,11 +316,9 @@ class DeferredJob(Message, ABC):
         update_conn: bool = True,
         **kwargs,
     ):
-        message = cls(mm=mm, data=data)
-        message.on_worker = True
-        if message.mm.language:
-            # Otherwise skip lang?
-            activate(message.mm.language)
+        message = cls.load_job_message(data, mm)
+        if message is None:
+            return
         result = None
         try:
             if message.atomic:
@@ -92,55 +327,200 @@ class DeferredJob(Message, ABC):
             else:
                 result = message.run_job()
         except ErrorMessage as err:  # Catchable, nice errors
-            if err.mm.id is None:
-                err.mm.id = message.mm.id
-            if err.mm.consumer_name is None:
-                err.mm.consumer_name = message.mm.consumer_name
-            if err.mm.consumer_name:
-                websocket_send_error(err)
+            message.send_job_error(err)
         else:
             # Everything went fine
-            if update_conn and message.mm.user_pk and message.mm.consumer_name:
-                update_connection_status(
-                    user_pk=message.mm.user_pk,
-                    channel_name=message.mm.consumer_name,
-                    last_action=enqueued_at,
-                )
+            message.job_done(enqueued_at, update_conn)
+        message.flush_progress()
         return result
 
-    def enqueue(self, queue: Queue | None = None, **kwargs):
-        if queue is None:
-            queue = get_queue(name=self.queue)
-        assert isinstance(queue, Queue)
+    @classmethod
+    def init_jobs(cls, jobs: Sequence[dict]) -> list:
+        """
+        Run several jobs of this type at once, see batch_size. Each item is the keyword arguments
+        to init_job. Returns the result of each job in the same order, or the exception if it failed.
+        """
+        results = [None] * len(jobs)
+        messages = {}
+        for i, job_kwargs in enumerate(jobs):
+            try:
+                message = cls.load_job_message(job_kwargs["data"], job_kwargs["mm"])
+            except ValidationError as exc:
+                results[i] = exc
+                continue
+            if message is not None:
+                messages[i] = message
+        if cls.atomic:
+            with transaction.atomic(durable=True):
+                outcomes = cls._run_jobs_checked(list(messages.values()))
+        else:
+            outcomes = cls._run_jobs_checked(list(messages.values()))
+        for (i, message), outcome in zip(messages.items(), outcomes):
+            # Like init_job, jobs that sent an error don't fail but aren't done either
+            if outcome is not ERROR_SENT:
+                results[i] = outcome
+                if not isinstance(outcome, BaseException):
+                    message.job_done(
+                        jobs[i].get("enqueued_at"), jobs[i].get("update_conn", True)
+                    )
+            message.flush_progress()
+        return results
+
+    @classmethod
+    def _run_jobs_checked(cls, messages: list[DeferredJob]) -> list:
+        # Within the transaction, so nothing is committed if outcomes can't be matched to messages
+        outcomes = cls.run_jobs(messages)
+        if len(outcomes) != len(messages):
+            raise ValueError(
+                f"{cls.__name__}.run_jobs returned {len(outcomes)} outcomes for {len(messages)} messages"
+            )
+        return outcomes
+
+    @classmethod
+    def run_jobs(cls, messages: list[DeferredJob]) -> list:
+        """
+        Run messages batched by the worker, within one transaction if the class is atomic.
+        Returns a result, an exception or ERROR_SENT for each message.
+        By default, each message runs in a savepoint with run_isolated, so failing messages
+        are rolled back without affecting the others. Override to do the work in bulk.
+        """
+        return [message.run_isolated() for message in messages]
+
+    def run_isolated(self):
+        """
+        Run this message within a savepoint. Errors are sent to the consumer and ERROR_SENT is returned,
+        other exceptions are returned rather than raised, so the worker can fail this job only.
+        """
+        self.activate_language()
+        try:
+            with transaction.atomic():
+                return self.run_job()
+        except ErrorMessage as err:
+            self.send_job_error(err)
+            return ERROR_SENT
+        except Exception as exc:
+            return exc
+
+    @classmethod
+    def get_job_qualname(cls) -> str:
+        return ".".join([cls.__module__, cls.__name__, "init_job"])
+
+    def get_job_kwargs(self) -> dict:
+        """
+        Keyword arguments to init_job.
+        """
         data = {}
-        if self.data:
+        if self.raw_data is not None:
+            data = self.raw_data
+        elif self.data:
             data = self.data.dict()
+        if self.mm.env is None:
+            raise ValueError(
+                "To call enqueue on DeferredJob messages, env must be present in message meta."
+            )
+        return dict(t=self.name, mm=self.mm.dict(), data=data, enqueued_at=now())
+
+    def get_enqueue_kwargs(self, **kwargs) -> dict:
+        """
+        Arguments for Queue.enqueue, both RQ options and keyword arguments to init_job.
+        """
         kwargs.setdefault("on_failure", self.handle_failure)
+        if self.job_id is not None:
+            kwargs.setdefault("job_id", self.job_id)
         for attr_name in ("job_timeout", "ttl", "result_ttl", "failure_ttl"):
             if attr_name in kwargs:
                 continue
             attr_v = getattr(self, attr_name, _marker)
             if attr_v != _marker:
                 kwargs[attr_name] = attr_v
-        if self.mm.env is None:
-            raise ValueError(
-                "To call enqueue on DeferredJob messages, env must be present in message meta."
-            )
-        qualname = ".".join(
-            [self.__class__.__module__, self.__class__.__name__, "init_job"]
-        )
+        kwargs.update(self.get_job_kwargs())
+        return kwargs
+
+    def route(self) -> str:
+        """
+        Pick the queue for this message and set it as queue, see envelope.deferred_jobs.routing.
+        Sync code, may talk to Redis.
+        """
+        if (router := get_queue_router()) is not None:
+            self.queue = router.route(self)
+        return self.queue
+
+    async def async_route(self) -> str:
+        if (router := get_queue_router()) is not None:
+            self.queue = await router.async_route(self)
+        return self.queue
+
+    def enqueue(self, queue: Queue | None = None, **kwargs):
+        if queue is None:
+            queue = get_queue(name=self.route())
+        assert isinstance(queue, Queue)
         return queue.enqueue(
-            qualname,
-            t=self.name,
-            mm=self.mm.dict(),
-            data=data,
-            enqueued_at=now(),
-            **kwargs,
+            self.get_job_qualname(), **self.get_enqueue_kwargs(**kwargs)
         )
 
-    async def post_queue(self, *, job: Job, consumer: WebsocketConsumer, **kwargs):
+    def prepare_data(self, **kwargs) -> EnqueueData:
+        """
+        Same as enqueue, but returns data for Queue.enqueue_many.
+
+        >>> from envelope.channels.messages import Subscribe
+        >>> msg = Subscribe(mm={'env': 'ws_incoming'}, pk=1, channel_type='user')
+        >>> job_data = msg.prepare_data(ttl=5)
+        >>> job_data.func
+        'envelope.channels.messages.Subscribe.init_job'
+        >>> job_data.ttl, job_data.timeout
+        (5, 20)
+        >>> sorted(job_data.kwargs)
+        ['data', 'enqueued_at', 'mm', 't']
+        >>> msg.prepare_data(job_id='abc', at_front=True).job_id
+        'abc'
+        """
+        job_kwargs = self.get_enqueue_kwargs(**kwargs)
+        options = {x: job_kwargs.pop(x) for x in _enqueue_options if x in job_kwargs}
+        if "job_timeout" in job_kwargs:
+            options["timeout"] = job_kwargs.pop("job_timeout")
+        return Queue.prepare_data(self.get_job_qualname(), kwargs=job_kwargs, **options)
+
+    @staticmethod
+    def enqueue_many(
+        messages: Sequence[DeferredJob], queue: Queue | None = None, **kwargs
+    ) -> list[Job]:
+        """
+        Enqueue messages with one Redis round-trip per queue, via RQs pipelined enqueue_many.
+        Messages go to their own queue unless queue is given. Jobs are returned in the same order as messages.
+        """
+        by_queue: dict[str | None, list[int]] = {}
+        for i, message in enumerate(messages):
+            by_queue.setdefault(None if queue else message.route(), []).append(i)
+        jobs: list[Job | None] = [None] * len(messages)
+        for queue_name, indexes in by_queue.items():
+            _queue = queue or get_queue(name=queue_name)
+            assert isinstance(_queue, Queue)
+            enqueued = _queue.enqueue_many(
+                [messages[i].prepare_data(**kwargs) for i in indexes]
+            )
+            for i, job in zip(indexes, enqueued):
+                jobs[i] = job
+        return jobs
+
+    async def async_enqueue(self, queue: Queue | None = None, **kwargs) -> Job:
+        """
+        Enqueue from the event loop, see envelope.deferred_jobs.enqueue.
+        The queue is picked here, only talking to Redis happens in the executor.
+        Without a specific queue, messages enqueued within the same loop tick are enqueued together.
+        """
+        if queue is None:
+            await self.async_route()
+            if (batcher := get_enqueue_batcher()) is not None:
+                return await batcher.enqueue(self, **kwargs)
+            queue = get_queue(name=self.queue)
+        return await run_enqueue(self.enqueue, queue, **kwargs)
+
+    async def post_queue(
+        self, *, job: Job | None, consumer: WebsocketConsumer, **kwargs
+    ):
         """
         Do something after entering the queue. Only called if the message was actually added to the queue.
+        Job is None with the local backend, and the job is started after this.
         """
 
     @abstractmethod
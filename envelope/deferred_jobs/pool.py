@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+from functools import partial
+from multiprocessing import Process
+
+import django
+from rq.worker_pool import WorkerPool
+from rq.worker_pool import run_worker
+
+__all__ = (
+    "EnvelopeWorkerPool",
+    "run_pooled_worker",
+)
+
+# Worker processes may be spawned rather than forked (the default on macOS),
+# so this module mustn't import anything that requires Django to be set up.
+
+
+class EnvelopeWorkerPool(WorkerPool):
+    """
+    Runs an EnvelopeWorker in each process of RQs worker pool, see envelope_worker --mode processes.
+    The worker and job classes are imported within the worker process, after Django is set up.
+    """
+
+    def __init__(self, *args, max_memory: int | None = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_memory = max_memory
+
+    def get_worker_process(
+        self,
+        name: str,
+        burst: bool,
+        _sleep: float = 0,
+        logging_level: str = "INFO",
+    ) -> Process:
+        return Process(
+            target=run_pooled_worker,
+            args=(
+                name,
+                self._queue_names,
+                self._connection_class,
+                self._pool_class,
+                self._pool_kwargs,
+            ),
+            kwargs={
+                "_sleep": _sleep,
+                "burst": burst,
+                "logging_level": logging_level,
+                "serializer": self.serializer,
+                "max_memory": self.max_memory,
+            },
+            name=f"Worker {name} (EnvelopeWorkerPool {self.name})",
+        )
+
+
+def run_pooled_worker(*args, max_memory: int | None = None, **kwargs):
+    """
+    Process target for EnvelopeWorkerPool. Sets up Django if the process was spawned.
+    """
+    from django.apps import apps
+
+    if not apps.ready:
+        django.setup()
+    from envelope.deferred_jobs.worker import EnvelopeJob
+    from envelope.deferred_jobs.worker import EnvelopeWorker
+
+    run_worker(
+        *args,
+        worker_class=partial(EnvelopeWorker, max_memory=max_memory),
+        job_class=EnvelopeJob,
+        **kwargs,
+    )
@@ -0,0 +1,163 @@
+from __future__ import annotations
+
+from logging import getLogger
+from time import monotonic
+from typing import TYPE_CHECKING
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+from django_rq import get_queue
+
+from envelope import DEFAULT_QUEUE_NAME
+from envelope.deferred_jobs.enqueue import run_enqueue
+
+if TYPE_CHECKING:
+    from envelope.deferred_jobs.message import DeferredJob
+
+__all__ = (
+    "QueueRouter",
+    "get_queue_router",
+)
+
+logger = getLogger(__name__)
+
+_routers: dict[tuple, QueueRouter] = {}
+
+
+class QueueRouter:
+    """
+    Picks the queue for each deferred job when it's enqueued.
+
+    Routes are message names or priorities (see envelope.Priority) mapped to candidate queues,
+    in order of preference. A message name route wins over a priority route. Priority routes only
+    apply to message classes on the default queue, so a class with its own queue stays there.
+    Messages without a route go to their own queue. The first candidate with a backlog below max_backlog is picked,
+    or the one with the smallest backlog if all of them are above it.
+    Backlogs are cached for interval seconds, so Redis is asked at most that often per queue.
+
+    >>> from envelope.channels.messages import Subscribe
+    >>> router = QueueRouter({'interactive': ['fast', 'default']}, max_backlog=10)
+    >>> router.backlogs = {'fast': (0, monotonic()), 'default': (0, monotonic())}
+    >>> msg = Subscribe(pk=1, channel_type='user')
+    >>> msg.priority
+    'interactive'
+    >>> router.route(msg)
+    'fast'
+    >>> router.backlogs['fast'] = (20, monotonic())
+    >>> router.route(msg)
+    'default'
+    >>> router.backlogs['default'] = (30, monotonic())
+    >>> router.route(msg)
+    'fast'
+    >>> class BulkSubscribe(Subscribe):
+    ...     queue = 'bulk'
+    >>> router.route(BulkSubscribe(pk=1, channel_type='user'))
+    'bulk'
+    """
+
+    def __init__(
+        self,
+        routes: dict[str, list[str]],
+        *,
+        max_backlog: int = 100,
+        interval: float = 1.0,
+    ):
+        self.routes = routes
+        self.max_backlog = max_backlog
+        self.interval = interval
+        # Queue name to (number of jobs, when it was checked)
+        self.backlogs: dict[str, tuple[int, float]] = {}
+
+    def get_candidates(self, message: DeferredJob) -> list[str]:
+        try:
+            return self.routes[message.name]
+        except KeyError:
+            pass
+        if message.__class__.queue != DEFAULT_QUEUE_NAME:
+            return [message.queue]
+        return self.routes.get(message.priority, [message.queue])
+
+    def get_stale(self, names: list[str]) -> list[str]:
+        now = monotonic()
+        return [
+            x
+            for x in names
+            if x not in self.backlogs or now - self.backlogs[x][1] > self.interval
+        ]
+
+    def refresh(self, names: list[str]):
+        """
+        Check backlog of queues. Talks to Redis.
+        """
+        for name in names:
+            self.backlogs[name] = (get_queue(name=name).count, monotonic())
+
+    def pick(self, message: DeferredJob, candidates: list[str]) -> str:
+        backlogs = {x: self.backlogs.get(x, (0, 0))[0] for x in candidates}
+        for name in candidates:
+            if backlogs[name] < self.max_backlog:
+                break
+        else:
+            name = min(candidates, key=backlogs.__getitem__)
+        if name == candidates[0]:
+            logger.debug("Routed %s to %s, backlogs: %s", message.name, name, backlogs)
+        else:
+            logger.info(
+                "Diverted %s (priority %s) to %s, backlogs: %s",
+                message.name,
+                message.priority,
+                name,
+                backlogs,
+            )
+        return name
+
+    def route(self, message: DeferredJob) -> str:
+        """
+        Queue name for message. Sync code, may talk to Redis.
+        """
+        candidates = self.get_candidates(message)
+        if len(candidates) == 1:
+            return candidates[0]
+        if stale := self.get_stale(candidates):
+            self.refresh(stale)
+        return self.pick(message, candidates)
+
+    async def async_route(self, message: DeferredJob) -> str:
+        """
+        Same as route, but backlogs are checked in the enqueue executor.
+        """
+        candidates = self.get_candidates(message)
+        if len(candidates) == 1:
+            return candidates[0]
+        if stale := self.get_stale(candidates):
+            await run_enqueue(self.refresh, stale)
+        return self.pick(message, candidates)
+
+
+def get_queue_router() -> QueueRouter | None:
+    """
+    Router for this process according to ENVELOPE_QUEUE_ROUTES, or None if there are no routes.
+    ENVELOPE_QUEUE_ROUTER can be set to a QueueRouter subclass.
+
+    >>> from django.test import override_settings
+    >>> get_queue_router() is None
+    True
+    >>> with override_settings(ENVELOPE_QUEUE_ROUTES={'bulk': ['bulk', 'default']}):
+    ...     get_queue_router()
+    <envelope.deferred_jobs.routing.QueueRouter object at ...>
+    """
+    routes = getattr(settings, "ENVELOPE_QUEUE_ROUTES", None)
+    if not routes:
+        return None
+    router_name = getattr(
+        settings, "ENVELOPE_QUEUE_ROUTER", "envelope.deferred_jobs.routing.QueueRouter"
+    )
+    max_backlog = getattr(settings, "ENVELOPE_QUEUE_MAX_BACKLOG", 100)
+    key = (router_name, repr(routes), max_backlog)
+    try:
+        return _routers[key]
+    except KeyError:
+        router = _routers[key] = import_string(router_name)(
+            routes, max_backlog=max_backlog
+        )
+        return router
@@ -0,0 +1,104 @@
+from datetime import timedelta
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.test import TransactionTestCase
+from django.test import override_settings
+from django.utils.timezone import now
+from django_rq import get_queue
+from fakeredis import FakeStrictRedis
+
+from envelope.deferred_jobs.activity import ActivityBuffer
+from envelope.deferred_jobs.activity import get_activity_buffer
+from envelope.deferred_jobs.activity import record_action
+from envelope.deferred_jobs.activity import write_actions
+from envelope.deferred_jobs.worker import EnvelopeJob
+from envelope.deferred_jobs.worker import EnvelopeWorker
+from envelope.models import Connection
+
+User = get_user_model()
+
+
+class WriteActionsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username="active")
+        cls.other = User.objects.create(username="other")
+
+    def test_update_and_create(self):
+        earlier = now() - timedelta(minutes=1)
+        later = now()
+        Connection.objects.create(user=self.user, channel_name="a", last_action=later)
+        Connection.objects.create(user=self.user, channel_name="b")
+        with self.assertNumQueries(3):
+            write_actions(
+                {
+                    (self.user.pk, "a"): earlier,
+                    (self.user.pk, "b"): later,
+                    (self.other.pk, "c"): later,
+                }
+            )
+        self.assertEqual(
+            {"a": later, "b": later, "c": later},
+            dict(Connection.objects.values_list("channel_name", "last_action")),
+        )
+
+    def test_one_query_when_all_exist(self):
+        Connection.objects.create(user=self.user, channel_name="a")
+        Connection.objects.create(user=self.other, channel_name="b")
+        with self.assertNumQueries(1):
+            write_actions({(self.user.pk, "a"): now(), (self.other.pk, "b"): now()})
+
+    def test_buffer_keeps_latest(self):
+        buffer = ActivityBuffer(10)
+        earlier = now() - timedelta(minutes=1)
+        later = now()
+        buffer.add(self.user.pk, "a", later)
+        buffer.add(self.user.pk, "a", earlier)
+        self.assertEqual({(self.user.pk, "a"): later}, buffer.pending)
+        self.assertEqual(1, buffer.flush())
+        self.assertEqual({}, buffer.pending)
+        self.assertEqual(0, buffer.flush())
+
+    def test_record_action_without_worker(self):
+        record_action(self.user.pk, "a", now())
+        self.assertTrue(Connection.objects.filter(channel_name="a").exists())
+
+    @override_settings(ENVELOPE_ACTIVITY_FLUSH_INTERVAL=None)
+    def test_record_action_disabled(self):
+        self.assertIsNone(get_activity_buffer())
+        record_action(self.user.pk, "a", now())
+        self.assertTrue(Connection.objects.filter(channel_name="a").exists())
+
+
+def _job(user_pk, channel_name):
+    record_action(user_pk, channel_name, now())
+
+
+class WorkerActivityTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="active")
+        self.connection = FakeStrictRedis()
+        self.queue = get_queue(connection=self.connection, job_class=EnvelopeJob)
+
+    def test_buffered_while_working(self):
+        buffer = get_activity_buffer()
+        self.assertFalse(buffer.active)
+        for name in ("a", "a", "b"):
+            self.queue.enqueue(f"{__name__}._job", self.user.pk, name)
+        worker = EnvelopeWorker([self.queue], connection=self.connection)
+        with patch(
+            "envelope.deferred_jobs.activity.write_actions", wraps=write_actions
+        ) as mock_write:
+            worker.work(burst=True)
+        self.assertFalse(buffer.active)
+        mock_write.assert_called_once()
+        self.assertEqual(
+            {(self.user.pk, "a"), (self.user.pk, "b")},
+            set(mock_write.call_args[0][0]),
+        )
+        self.assertEqual(
+            {"a", "b"},
+            set(Connection.objects.values_list("channel_name", flat=True)),
+        )
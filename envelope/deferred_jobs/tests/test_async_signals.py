@@ -1,4 +1,6 @@
+import asyncio
 from datetime import datetime
+from threading import current_thread
 from unittest import mock
 from unittest.mock import patch
 
@@ -11,10 +13,12 @@ from rq import Queue
 from rq import SimpleWorker
 
 from envelope import WS_INCOMING
+from envelope.async_signals import incoming_websocket_message
 from envelope.channels.messages import Subscribe
 from envelope.channels.messages import Subscribed
 from envelope.deferred_jobs.async_signals import queue_deferred_job
 from envelope.logging import getEventLogger
+from envelope.messages.common import Queued
 from envelope.messages.ping import Ping
 from envelope.models import Connection
 
@@ -190,10 +194,145 @@ class DeferredJobsAsyncSignalsTests(TestCase):
             "django_rq.queues.get_redis_connection",
             return_value=self.fake_redis_conn,
         ):
-            await queue_deferred_job(consumer=self.mock_consumer, message=Ping())
+            # Filtered by the signal rather than the receiver
+            self.assertTrue(incoming_websocket_message.has_listeners(Ping))
+            self.assertNotIn(
+                queue_deferred_job,
+                incoming_websocket_message.get_receivers(Ping),
+            )
 
         queue = self.fake_redis_queue(name="default")
         worker = SimpleWorker([queue], connection=self.fake_redis_conn)
         result = await sync_to_async(worker.work)(burst=True)
         self.assertFalse(result)
         self.assertIsNone(self.mock_consumer.last_job)
+
+    async def _enqueue_thread_name(self):
+        self.mock_consumer.user_pk = self.user.pk
+        msg = Subscribe(
+            mm={"user_pk": self.user.pk, "env": WS_INCOMING},
+            channel_type="user",
+            pk=self.user.pk,
+        )
+        msg.post_queue = mock.AsyncMock()
+        thread_names = []
+
+        def _enqueue(*args, **kwargs):
+            thread_names.append(current_thread().name)
+
+        with patch(
+            "django_rq.queues.get_redis_connection",
+            return_value=self.fake_redis_conn,
+        ):
+            with patch.object(Queue, "enqueue", side_effect=_enqueue):
+                await queue_deferred_job(consumer=self.mock_consumer, message=msg)
+        self.assertTrue(msg.post_queue.called)
+        return thread_names[0]
+
+    async def test_queue_deferred_job_enqueues_in_executor(self):
+        self.assertTrue(
+            (await self._enqueue_thread_name()).startswith("envelope-enqueue")
+        )
+
+    @override_settings(ENVELOPE_ENQUEUE_WORKERS=0)
+    async def test_queue_deferred_job_enqueues_on_loop(self):
+        self.assertEqual(current_thread().name, await self._enqueue_thread_name())
+
+    async def test_queue_deferred_jobs_batched(self):
+        self.mock_consumer.user_pk = self.user.pk
+        messages = [
+            Subscribe(
+                mm={"user_pk": self.user.pk, "env": WS_INCOMING, "id": str(i)},
+                channel_type="user",
+                pk=self.user.pk,
+            )
+            for i in range(3)
+        ]
+        with patch(
+            "django_rq.queues.get_redis_connection",
+            return_value=self.fake_redis_conn,
+        ):
+            with patch.object(
+                Queue, "enqueue_many", autospec=True, side_effect=Queue.enqueue_many
+            ) as mock_enqueue_many:
+                await asyncio.gather(
+                    *[
+                        queue_deferred_job(consumer=self.mock_consumer, message=msg)
+                        for msg in messages
+                    ]
+                )
+        self.assertEqual(1, mock_enqueue_many.call_count)
+        queue = self.fake_redis_queue(name="default")
+        self.assertEqual(3, queue.count)
+        self.assertEqual(["0", "1", "2"], [x.mm.id for x in self.mock_consumer.ws_out])
+
+    @override_settings(ENVELOPE_BATCH_ENQUEUE=False)
+    async def test_queue_deferred_jobs_not_batched(self):
+        self.mock_consumer.user_pk = self.user.pk
+        messages = [
+            Subscribe(
+                mm={"user_pk": self.user.pk, "env": WS_INCOMING},
+                channel_type="user",
+                pk=self.user.pk,
+            )
+            for _ in range(2)
+        ]
+        with patch(
+            "django_rq.queues.get_redis_connection",
+            return_value=self.fake_redis_conn,
+        ):
+            with patch.object(Queue, "enqueue_many") as mock_enqueue_many:
+                await asyncio.gather(
+                    *[
+                        queue_deferred_job(consumer=self.mock_consumer, message=msg)
+                        for msg in messages
+                    ]
+                )
+        self.assertFalse(mock_enqueue_many.called)
+        self.assertEqual(2, self.fake_redis_queue(name="default").count)
+
+    async def _queue_idempotent(self, *payloads):
+        self.mock_consumer.user_pk = self.user.pk
+
+        class IdempotentSubscribe(Subscribe):
+            idempotency_ttl = 10
+
+        messages = [
+            IdempotentSubscribe(
+                mm={"user_pk": self.user.pk, "env": WS_INCOMING, "id": "a"},
+                channel_type="user",
+                pk=pk,
+            )
+            for pk in payloads
+        ]
+        with patch(
+            "django_rq.queues.get_redis_connection",
+            return_value=self.fake_redis_conn,
+        ):
+            for msg in messages:
+                await queue_deferred_job(consumer=self.mock_consumer, message=msg)
+        return messages
+
+    async def test_queue_deferred_job_idempotent(self):
+        first, retry = await self._queue_idempotent(self.user.pk, self.user.pk)
+        queue = self.fake_redis_queue(name="default")
+        self.assertEqual([first.job_id], queue.job_ids)
+        self.assertIsNone(retry.job_id)
+        subscribed, queued = self.mock_consumer.ws_out
+        self.assertIsInstance(subscribed, Subscribed)
+        self.assertIsInstance(queued, Queued)
+        self.assertEqual(("a", "q"), (queued.mm.id, queued.mm.state))
+        self.assertEqual(first.job_id, queued.data.job_id)
+
+    async def test_queue_deferred_job_idempotent_other_payload(self):
+        await self._queue_idempotent(self.user.pk, self.user.pk + 1)
+        queue = self.fake_redis_queue(name="default")
+        self.assertEqual(2, queue.count)
+
+    async def test_queue_deferred_job_idempotent_released_on_error(self):
+        with patch.object(Queue, "enqueue", side_effect=ConnectionError):
+            with self.assertRaises(ConnectionError):
+                await self._queue_idempotent(self.user.pk)
+        await self._queue_idempotent(self.user.pk)
+        queue = self.fake_redis_queue(name="default")
+        self.assertEqual(1, queue.count)
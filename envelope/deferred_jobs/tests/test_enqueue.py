@@ -0,0 +1,90 @@
+import asyncio
+import threading
+from unittest.mock import Mock
+from unittest.mock import patch
+
+from django.test import SimpleTestCase
+from django.test import override_settings
+from fakeredis import FakeStrictRedis
+from rq import Queue
+
+from envelope import WS_INCOMING
+from envelope.channels.messages import Subscribe
+from envelope.deferred_jobs.enqueue import _tasks
+from envelope.deferred_jobs.enqueue import get_enqueue_semaphore
+from envelope.deferred_jobs.enqueue import run_enqueue
+
+
+class RunEnqueueTests(SimpleTestCase):
+    @override_settings(ENVELOPE_ENQUEUE_MAX_PENDING=1)
+    async def test_backpressure(self):
+        release = threading.Event()
+        started = []
+
+        def _blocking(name):
+            started.append(name)
+            release.wait(5)
+            return name
+
+        first = asyncio.create_task(run_enqueue(_blocking, "a"))
+        second = asyncio.create_task(run_enqueue(_blocking, "b"))
+        await asyncio.sleep(0.05)
+        # The second call waits on the loop, not in the executors queue
+        self.assertEqual(["a"], started)
+        self.assertTrue(get_enqueue_semaphore().locked())
+        release.set()
+        self.assertEqual(["a", "b"], await asyncio.gather(first, second))
+
+    @override_settings(ENVELOPE_ENQUEUE_MAX_PENDING=None)
+    async def test_no_limit(self):
+        self.assertIsNone(get_enqueue_semaphore())
+        self.assertEqual(3, await run_enqueue(sum, [1, 2]))
+
+
+class EnqueueBatcherTests(SimpleTestCase):
+    def setUp(self):
+        self.fake_redis_conn = FakeStrictRedis()
+        p = patch(
+            "django_rq.queues.get_redis_connection",
+            return_value=self.fake_redis_conn,
+        )
+        p.start()
+        self.addCleanup(p.stop)
+
+    def _msg(self, pk=1):
+        return Subscribe(
+            mm={"env": WS_INCOMING, "id": str(pk)}, pk=pk, channel_type="user"
+        )
+
+    async def test_options_kept(self):
+        with patch.object(
+            Queue, "enqueue_many", autospec=True, side_effect=Queue.enqueue_many
+        ) as mock_enqueue_many:
+            first, second = await asyncio.gather(
+                self._msg(1).async_enqueue(ttl=5, job_id="first"),
+                self._msg(2).async_enqueue(job_timeout=7),
+            )
+        mock_enqueue_many.assert_called_once()
+        self.assertEqual(("first", 5), (first.id, first.ttl))
+        self.assertEqual(7, second.timeout)
+
+    async def test_failing_message_enqueued_alone(self):
+        bad = self._msg(1)
+        bad.get_enqueue_kwargs = Mock(side_effect=ValueError("Bad"))
+        with self.assertLogs("envelope.deferred_jobs.enqueue", "WARNING"):
+            outcomes = await asyncio.gather(
+                bad.async_enqueue(),
+                self._msg(2).async_enqueue(),
+                return_exceptions=True,
+            )
+        self.assertIsInstance(outcomes[0], ValueError)
+        self.assertEqual(["2"], [x.kwargs["mm"]["id"] for x in outcomes[1:]])
+        self.assertEqual(1, Queue(connection=self.fake_redis_conn).count)
+
+    async def test_flush_task_kept(self):
+        enqueue = asyncio.create_task(self._msg().async_enqueue())
+        await asyncio.sleep(0)
+        self.assertEqual(1, len(_tasks))
+        await enqueue
+        await asyncio.sleep(0)
+        self.assertEqual(set(), _tasks)
@@ -0,0 +1,90 @@
+import asyncio
+import threading
+from threading import current_thread
+from unittest.mock import patch
+
+from django.test import TransactionTestCase
+from django.test import override_settings
+from django.utils.translation import get_language
+from fakeredis import FakeStrictRedis
+from rq import Queue
+
+from envelope import JobBackend
+from envelope import WS_INCOMING
+from envelope.deferred_jobs.async_signals import queue_deferred_job
+from envelope.deferred_jobs.local import _tasks
+from envelope.deferred_jobs.local import run_local
+from envelope.deferred_jobs.message import DeferredJob
+from envelope.deferred_jobs.tests.test_async_signals import _MockConsumer
+
+runs = []
+
+
+class LocalJob(DeferredJob):
+    name = "testing.local"
+    backend = JobBackend.LOCAL
+
+    def run_job(self):
+        if self.mm.id == "fail":
+            raise ValueError("Nope")
+        runs.append((current_thread().name, get_language()))
+
+
+class LocalBackendTests(TransactionTestCase):
+    def setUp(self):
+        runs.clear()
+        self.mock_consumer = _MockConsumer()
+        self.fake_redis_conn = FakeStrictRedis()
+
+    async def _queue(self, msg_id="a"):
+        msg = LocalJob(
+            mm={"env": WS_INCOMING, "id": msg_id, "language": "sv"},
+        )
+        with patch(
+            "django_rq.queues.get_redis_connection",
+            return_value=self.fake_redis_conn,
+        ):
+            with patch.object(LocalJob, "post_queue") as mock_post_queue:
+                await queue_deferred_job(consumer=self.mock_consumer, message=msg)
+                await asyncio.gather(*_tasks)
+        return mock_post_queue
+
+    async def test_run_local(self):
+        mock_post_queue = await self._queue()
+        self.assertEqual(1, len(runs))
+        thread_name, language = runs[0]
+        self.assertTrue(thread_name.startswith("envelope-job"))
+        self.assertEqual("sv", language)
+        self.assertIsNone(mock_post_queue.call_args.kwargs["job"])
+        self.assertEqual(0, Queue(connection=self.fake_redis_conn).count)
+
+    async def test_failure(self):
+        with patch.object(LocalJob, "send_job_failure") as mock_failure:
+            with self.assertLogs("envelope.deferred_jobs.local"):
+                await self._queue("fail")
+        self.assertEqual("fail", mock_failure.call_args.args[0]["id"])
+        self.assertIsInstance(mock_failure.call_args.args[1], ValueError)
+
+    @override_settings(ENVELOPE_FORCE_RQ=True)
+    async def test_force_rq(self):
+        mock_post_queue = await self._queue()
+        self.assertEqual([], runs)
+        self.assertIsNotNone(mock_post_queue.call_args.kwargs["job"])
+        self.assertEqual(1, Queue(connection=self.fake_redis_conn).count)
+
+    @override_settings(ENVELOPE_LOCAL_JOB_MAX_PENDING=1)
+    async def test_max_pending(self):
+        release = threading.Event()
+
+        def _blocking(message, job_kwargs):
+            release.wait(timeout=5)
+
+        with patch("envelope.deferred_jobs.local._run_job", _blocking):
+            first = await run_local(LocalJob(mm={"env": WS_INCOMING}))
+            second = asyncio.create_task(run_local(LocalJob(mm={"env": WS_INCOMING})))
+            await asyncio.sleep(0.05)
+            # Waits for the first job to finish
+            self.assertFalse(second.done())
+            release.set()
+            await first
+            await (await second)
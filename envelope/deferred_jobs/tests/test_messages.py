@@ -1,3 +1,4 @@
+import json
 from unittest.mock import patch
 
 from channels.layers import get_channel_layer
@@ -14,6 +15,8 @@ from envelope.deferred_jobs.message import DeferredJob
 from envelope.messages.errors import NotFoundError
 from envelope.messages.errors import UnauthorizedError
 from envelope.models import Connection
+from envelope.registries import unfrozen_registries
+from envelope.testing import mk_consumer
 from envelope.utils import get_message_registry
 
 User = get_user_model()
@@ -41,6 +44,34 @@ class NeverFoundJob(DeferredJob):
         raise NotFoundError.from_message(self, model="something", value="1")
 
 
+class ProgressJob(DeferredJob):
+    name = "progress_job"
+    progress_interval = 60
+
+    def run_job(self):
+        for i in range(1, 11):
+            self.report_progress(i, 100 if self.mm.id == "short" else 10)
+
+
+class PassthroughSchema(BaseModel):
+    num: int
+
+
+class PassthroughJob(DeferredJob):
+    name = "passthrough_job"
+    schema = PassthroughSchema
+    data: PassthroughSchema
+    passthrough = True
+
+    def run_job(self):
+        return self.data.num
+
+
+class StrictJob(PassthroughJob):
+    name = "strict_job"
+    passthrough = False
+
+
 class DummyContextAction(ContextAction):
     name = "dummy_context_action"
     permission = None
@@ -102,6 +133,30 @@ class DeferredJobTests(TestCase):
             job.result_ttl,
         )
 
+    def test_enqueue_many(self):
+        first = DummyJob(mm={"user_pk": self.user.pk, "env": WS_INCOMING})
+        second = DummyJob(mm={"user_pk": self.user.pk, "env": WS_INCOMING})
+        second.result_ttl = 99
+        second.job_timeout = 30
+        connection = FakeStrictRedis()
+        queue = get_queue(connection=connection)
+        with patch.object(connection, "pipeline", wraps=connection.pipeline) as mock:
+            jobs = DeferredJob.enqueue_many([first, second], queue)
+        self.assertEqual(1, mock.call_count)
+        self.assertEqual(2, queue.count)
+        self.assertEqual(
+            "envelope.deferred_jobs.tests.test_messages.DummyJob.init_job",
+            jobs[0].func_name,
+        )
+        self.assertEqual(first.mm.dict(), jobs[0].kwargs["mm"])
+        self.assertEqual((None, 99), (jobs[0].result_ttl, jobs[1].result_ttl))
+        self.assertEqual(30, jobs[1].timeout)
+        self.assertIsNotNone(jobs[0].failure_callback)
+        worker = SimpleWorker([queue], connection=connection)
+        self.assertTrue(worker.work(burst=True))
+        self.assertEqual(0, queue.count)
+        self.assertTrue(Connection.objects.filter(channel_name="abc").exists())
+
     def test_results(self):
         msg = DummyJob(mm={"user_pk": self.user.pk, "env": WS_INCOMING})
         connection = FakeStrictRedis()
@@ -138,6 +193,53 @@ class DeferredJobTests(TestCase):
             mock_send.call_args[0][1],
         )
 
+    def test_validation_error_without_passthrough_fails_job(self):
+        connection = FakeStrictRedis()
+        queue = get_queue(connection=connection)
+        job = queue.enqueue(
+            StrictJob.get_job_qualname(),
+            t=StrictJob.name,
+            mm={"consumer_name": "abc", "id": "x"},
+            data={"num": "Not a number"},
+        )
+        worker = SimpleWorker([queue], connection=connection)
+        with patch.object(get_channel_layer(), "send"):
+            worker.work(burst=True)
+        job.refresh()
+        self.assertTrue(job.is_failed)
+        self.assertIn("ValidationError", job.latest_result().exc_string)
+
+    def _run_progress(self, msg_id):
+        msg = ProgressJob(
+            mm={"env": WS_INCOMING, "consumer_name": "abc", "id": msg_id},
+        )
+        connection = FakeStrictRedis()
+        queue = get_queue(connection=connection)
+        msg.enqueue(queue)
+        worker = SimpleWorker([queue], connection=connection)
+        channel_layer = get_channel_layer()
+        with patch.object(channel_layer, "send") as mock_send:
+            # Sent within the job transaction, not on commit
+            with self.captureOnCommitCallbacks(execute=False):
+                self.assertTrue(worker.work(burst=True))
+        return [json.loads(x.args[1]["text_data"]) for x in mock_send.call_args_list]
+
+    def test_report_progress(self):
+        sent = self._run_progress("done")
+        self.assertEqual(
+            [
+                {"curr": 1, "total": 10, "msg": None},
+                {"curr": 10, "total": 10, "msg": None},
+            ],
+            [x["p"] for x in sent],
+        )
+        self.assertEqual({"progress.num"}, {x["t"] for x in sent})
+        self.assertEqual({"r"}, {x["s"] for x in sent})
+
+    def test_report_progress_latest_sent_when_done(self):
+        sent = self._run_progress("short")
+        self.assertEqual([1, 10], [x["p"]["curr"] for x in sent])
+
     def test_job_raises_catchable_error(self):
         msg = NeverFoundJob(
             mm={"user_pk": self.user.pk, "env": WS_INCOMING, "consumer_name": "abc"},
@@ -170,12 +272,14 @@ class DummyContextActionTests(TestCase):
         cls.user = User.objects.create(username="runner")
         cls.conn = Connection.objects.create(user=cls.user, channel_name="abc")
         cls.msg_reg = get_message_registry(WS_INCOMING)
-        cls.msg_reg[DummyContextAction.name] = DummyContextAction
+        with unfrozen_registries():
+            cls.msg_reg[DummyContextAction.name] = DummyContextAction
 
     @classmethod
     def tearDownClass(cls):
         super().tearDownClass()
-        cls.msg_reg.pop(DummyContextAction.name)
+        with unfrozen_registries():
+            cls.msg_reg.pop(DummyContextAction.name)
 
     def _mk_msg(self, **kwargs):
         msg = DummyContextAction(**kwargs)
@@ -245,3 +349,74 @@ class DummyContextActionTests(TestCase):
             },
             cm.exception.data.dict(),
         )
+
+
+class PassthroughTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username="runner")
+        cls.msg_reg = get_message_registry(WS_INCOMING)
+        with unfrozen_registries():
+            cls.msg_reg[PassthroughJob.name] = PassthroughJob
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        with unfrozen_registries():
+            cls.msg_reg.pop(PassthroughJob.name)
+
+    def _unpack(self, payload: dict):
+        from envelope.envelopes import incoming
+
+        data = incoming.schema(t=PassthroughJob.name, p=payload, i="x")
+        return incoming.unpack(data, consumer=mk_consumer(user=self.user))
+
+    def _run(self, msg: PassthroughJob):
+        connection = FakeStrictRedis()
+        queue = get_queue(connection=connection)
+        job = msg.enqueue(queue)
+        worker = SimpleWorker([queue], connection=connection)
+        channel_layer = get_channel_layer()
+        with patch.object(channel_layer, "send") as mock_send:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertTrue(worker.work(burst=True))
+        job.refresh()
+        return job, mock_send
+
+    def test_not_validated_on_unpack(self):
+        msg = self._unpack({"num": "Not a number"})
+        self.assertIsNone(msg.data)
+        self.assertEqual({"num": "Not a number"}, msg.raw_data)
+
+    def test_enqueue_raw_data(self):
+        msg = self._unpack({"num": "1"})
+        job, mock_send = self._run(msg)
+        self.assertEqual({"num": "1"}, job.kwargs["data"])
+        self.assertEqual(1, job.result)
+        self.assertFalse(mock_send.called)
+
+    def test_validation_error_sent_to_consumer(self):
+        msg = self._unpack({"num": "Not a number"})
+        job, mock_send = self._run(msg)
+        self.assertIsNone(job.result)
+        self.assertTrue(mock_send.called)
+        self.assertEqual("abc", mock_send.call_args[0][0])
+        self.assertEqual(
+            {
+                "t": "error.validation",
+                "p": {
+                    "msg": None,
+                    "errors": [
+                        {
+                            "loc": ("num",),
+                            "msg": "value is not a valid integer",
+                            "type": "type_error.integer",
+                        }
+                    ],
+                },
+                "i": "x",
+                "s": "f",
+                "type": "ws.error.send",
+            },
+            mock_send.call_args[0][1],
+        )
@@ -0,0 +1,73 @@
+from unittest.mock import patch
+
+from django.test import TestCase
+from django.test import override_settings
+from django_rq import get_queue
+from django_rq.settings import QUEUES
+from fakeredis import FakeStrictRedis
+
+from envelope import WS_INCOMING
+from envelope.channels.messages import Subscribe
+from envelope.deferred_jobs import routing
+from envelope.deferred_jobs.async_signals import queue_deferred_job
+from envelope.deferred_jobs.tests.test_async_signals import _MockConsumer
+
+
+@override_settings(
+    ENVELOPE_QUEUE_ROUTES={"interactive": ["fast", "default"]},
+    ENVELOPE_QUEUE_MAX_BACKLOG=2,
+)
+class QueueRoutingTests(TestCase):
+    def setUp(self):
+        routing._routers.clear()
+        self.fake_redis_conn = FakeStrictRedis()
+        self.mock_consumer = _MockConsumer()
+        for p in (
+            patch.dict(QUEUES, {"fast": QUEUES["default"]}),
+            patch(
+                "django_rq.queues.get_redis_connection",
+                return_value=self.fake_redis_conn,
+            ),
+        ):
+            p.start()
+            self.addCleanup(p.stop)
+
+    def _msg(self, **kwargs):
+        return Subscribe(mm={"env": WS_INCOMING}, channel_type="user", pk=1, **kwargs)
+
+    def test_route(self):
+        msg = self._msg()
+        self.assertEqual("fast", msg.route())
+        self.assertEqual("fast", msg.queue)
+        self.assertEqual("default", Subscribe.queue)
+
+    def test_enqueue(self):
+        self._msg().enqueue()
+        self.assertEqual(1, get_queue("fast").count)
+
+    @override_settings(ENVELOPE_QUEUE_ROUTES={"channel.subscribe": ["default"]})
+    def test_name_over_priority(self):
+        self.assertEqual("default", self._msg().route())
+
+    @override_settings(ENVELOPE_QUEUE_ROUTES={"normal": ["default", "fast"]})
+    def test_own_queue_not_priority_routed(self):
+        class BulkJob(Subscribe):
+            queue = "bulk"
+            priority = "normal"
+
+        msg = BulkJob(mm={"env": WS_INCOMING}, channel_type="user", pk=1)
+        self.assertEqual("bulk", msg.route())
+
+    def test_diverted(self):
+        for _ in range(2):
+            get_queue("fast").enqueue("time.sleep", 0)
+        with self.assertLogs("envelope.deferred_jobs.routing") as logs:
+            self.assertEqual("default", self._msg().route())
+        self.assertIn(
+            "Diverted channel.subscribe (priority interactive)", logs.output[0]
+        )
+
+    async def test_queue_deferred_job(self):
+        await queue_deferred_job(consumer=self.mock_consumer, message=self._msg())
+        self.assertEqual(1, get_queue("fast").count)
+        self.assertEqual(0, get_queue("default").count)
@@ -0,0 +1,281 @@
+from multiprocessing import get_context
+from unittest.mock import patch
+
+from channels.layers import get_channel_layer
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TransactionTestCase
+from django_rq import get_queue
+from fakeredis import FakeStrictRedis
+from rq import SimpleWorker
+from rq.job import JobStatus
+
+from envelope import WS_INCOMING
+from envelope.deferred_jobs.message import DeferredJob
+from envelope.deferred_jobs.pool import EnvelopeWorkerPool
+from envelope.deferred_jobs.worker import EnvelopeJob
+from envelope.deferred_jobs.worker import EnvelopeWorker
+from envelope.deferred_jobs.worker import ThreadedEnvelopeWorker
+from envelope.deferred_jobs.worker import run_threaded
+from envelope.messages.errors import NotFoundError
+from envelope.models import Connection
+from envelope.sender_loop import get_sender_loop
+
+User = get_user_model()
+
+
+def _job(value):
+    return value
+
+
+class EnvelopeWorkerTests(TransactionTestCase):
+    def setUp(self):
+        self.connection = FakeStrictRedis()
+        self.queue = get_queue(connection=self.connection, job_class=EnvelopeJob)
+
+    def _enqueue(self, count=2):
+        return [
+            self.queue.enqueue(f"{__name__}._job", i, job_timeout=5)
+            for i in range(count)
+        ]
+
+    def test_job_uses_preloaded_function(self):
+        from envelope.channels.messages import Subscribe
+
+        EnvelopeWorker([self.queue], connection=self.connection)
+        msg = Subscribe(mm={"env": WS_INCOMING}, pk=1, channel_type="user")
+        job = msg.enqueue(self.queue)
+        job = EnvelopeJob.fetch(job.id, connection=self.connection)
+        with patch("rq.job.import_attribute") as mock_import:
+            self.assertEqual(Subscribe.init_job, job.func)
+        self.assertFalse(mock_import.called)
+
+    def test_work(self):
+        jobs = self._enqueue()
+        worker = EnvelopeWorker([self.queue], connection=self.connection)
+        self.assertTrue(worker.work(burst=True))
+        for job in jobs:
+            job.refresh()
+            self.assertEqual(JobStatus.FINISHED, job.get_status())
+        self.assertEqual([0, 1], [x.return_value() for x in jobs])
+
+    def test_recycle_on_memory(self):
+        self._enqueue()
+        worker = EnvelopeWorker([self.queue], connection=self.connection)
+        worker.max_memory = 0
+        worker.work(burst=True)
+        self.assertEqual(1, self.queue.count)
+
+    def test_sends_flushed_after_each_job(self):
+        self._enqueue()
+        worker = EnvelopeWorker([self.queue], connection=self.connection)
+        sender_loop = get_sender_loop()
+        with patch.object(sender_loop, "flush", return_value=False) as mock_flush:
+            with self.assertLogs("rq.worker", "WARNING") as logs:
+                worker.work(burst=True)
+        # Once per job and once when stopping
+        self.assertEqual(3, mock_flush.call_count)
+        self.assertEqual(2, len(logs.records))
+
+    def test_threaded(self):
+        jobs = self._enqueue(6)
+        workers = [
+            ThreadedEnvelopeWorker([self.queue], connection=self.connection)
+            for _ in range(3)
+        ]
+        run_threaded(workers, burst=True)
+        for job in jobs:
+            self.assertEqual(JobStatus.FINISHED, job.get_status(refresh=True))
+
+    def test_threaded_recycle_stops_group(self):
+        self._enqueue(6)
+        workers = [
+            ThreadedEnvelopeWorker([self.queue], connection=self.connection)
+            for _ in range(2)
+        ]
+        workers[0].max_memory = workers[1].max_memory = 0
+        run_threaded(workers, burst=True)
+        self.assertLessEqual(4, self.queue.count)
+
+    def test_threaded_job_timeout(self):
+        job = self.queue.enqueue("time.sleep", 2, job_timeout=1)
+        worker = ThreadedEnvelopeWorker([self.queue], connection=self.connection)
+        run_threaded([worker], burst=True)
+        self.assertEqual(JobStatus.FAILED, job.get_status(refresh=True))
+
+    def test_command(self):
+        jobs = self._enqueue(4)
+        with patch(
+            "django_rq.queues.get_redis_connection", return_value=self.connection
+        ):
+            call_command("envelope_worker", burst=True, concurrency=2, verbosity=0)
+        for job in jobs:
+            self.assertEqual(JobStatus.FINISHED, job.get_status(refresh=True))
+
+    def test_command_processes(self):
+        with (
+            patch(
+                "django_rq.queues.get_redis_connection", return_value=self.connection
+            ),
+            patch.object(EnvelopeWorkerPool, "start", autospec=True) as mock_start,
+        ):
+            call_command(
+                "envelope_worker",
+                burst=True,
+                mode="processes",
+                concurrency=2,
+                max_memory=100,
+                verbosity=0,
+            )
+        pool = mock_start.call_args.args[0]
+        self.assertEqual(2, pool.num_workers)
+        self.assertEqual(100, pool.max_memory)
+        self.assertTrue(mock_start.call_args.kwargs["burst"])
+
+    def test_pooled_worker(self):
+        jobs = self._enqueue()
+        pool = EnvelopeWorkerPool(
+            [self.queue], connection=self.connection, max_memory=10000
+        )
+        process = pool.get_worker_process("abc", burst=True)
+        # Runs in this process, so it uses the same fake redis
+        with patch.object(EnvelopeWorker, "work", autospec=True) as mock_work:
+            process._target(*process._args, **process._kwargs)
+        worker = mock_work.call_args.args[0]
+        self.assertEqual(10000, worker.max_memory)
+        self.assertEqual(EnvelopeJob, worker.job_class)
+        worker.work(burst=True)
+        for job in jobs:
+            self.assertEqual(JobStatus.FINISHED, job.get_status(refresh=True))
+
+    def test_pooled_worker_spawned(self):
+        pool = EnvelopeWorkerPool([self.queue], connection=self.connection)
+        process = pool.get_worker_process("abc", burst=True, logging_level="WARNING")
+        # Not forked, so the worker process must set up Django on its own
+        spawned = get_context("spawn").Process(
+            target=process._target, args=process._args, kwargs=process._kwargs
+        )
+        spawned.start()
+        spawned.join(timeout=60)
+        self.assertEqual(0, spawned.exitcode)
+
+
+class BatchJob(DeferredJob):
+    name = "testing.batch"
+    batch_size = 3
+    batches = []
+
+    def run_job(self):
+        if self.mm.id == "fail":
+            Connection.objects.create(user_id=self.mm.user_pk, channel_name="fail")
+            raise ValueError("Nope")
+        if self.mm.id == "not_found":
+            raise NotFoundError.from_message(self, model="a", key="pk", value=1)
+        Connection.objects.create(user_id=self.mm.user_pk, channel_name=self.mm.id)
+        return self.mm.id
+
+    @classmethod
+    def run_jobs(cls, messages):
+        cls.batches.append([x.mm.id for x in messages])
+        return super().run_jobs(messages)
+
+
+class BatchTests(TransactionTestCase):
+    def setUp(self):
+        BatchJob.batches = []
+        self.user = User.objects.create(username="batched")
+        self.connection = FakeStrictRedis()
+        self.queue = get_queue(connection=self.connection, job_class=EnvelopeJob)
+
+    def _enqueue(self, *msg_ids):
+        return [
+            BatchJob(
+                mm={
+                    "env": WS_INCOMING,
+                    "id": x,
+                    "user_pk": self.user.pk,
+                    "consumer_name": "abc",
+                }
+            ).enqueue(self.queue)
+            for x in msg_ids
+        ]
+
+    def test_batched(self):
+        jobs = self._enqueue("a", "b")
+        other = self.queue.enqueue(f"{__name__}._job", 1)
+        jobs += self._enqueue("c", "d")
+        worker = EnvelopeWorker([self.queue], connection=self.connection)
+        worker.work(burst=True)
+        # A single job runs on its own
+        self.assertEqual([["a", "b", "c"]], BatchJob.batches)
+        for job in [*jobs, other]:
+            self.assertEqual(JobStatus.FINISHED, job.get_status(refresh=True))
+        self.assertEqual(["a", "b", "c", "d"], [x.return_value() for x in jobs])
+        self.assertEqual(4, Connection.objects.exclude(channel_name="abc").count())
+
+    def test_errors_isolated(self):
+        jobs = self._enqueue("a", "fail", "not_found")
+        worker = EnvelopeWorker([self.queue], connection=self.connection)
+        channel_layer = get_channel_layer()
+        with patch.object(channel_layer, "send") as mock_send:
+            worker.work(burst=True)
+        self.assertEqual([["a", "fail", "not_found"]], BatchJob.batches)
+        self.assertEqual(
+            [JobStatus.FINISHED, JobStatus.FAILED, JobStatus.FINISHED],
+            [x.get_status(refresh=True) for x in jobs],
+        )
+        self.assertEqual(
+            ["a"],
+            list(
+                Connection.objects.exclude(channel_name="abc").values_list(
+                    "channel_name", flat=True
+                )
+            ),
+        )
+        self.assertEqual(
+            [("abc", "error.not_found", "not_found"), ("abc", "error.job", "fail")],
+            [(x.args[0], x.args[1]["t"], x.args[1]["i"]) for x in mock_send.mock_calls],
+        )
+
+    def test_simple_worker_not_batched(self):
+        jobs = self._enqueue("a", "b")
+        worker = SimpleWorker([self.queue], connection=self.connection)
+        worker.work(burst=True)
+        self.assertEqual([], BatchJob.batches)
+        for job in jobs:
+            self.assertEqual(JobStatus.FINISHED, job.get_status(refresh=True))
+
+    def test_claimed_jobs_started(self):
+        first, *jobs = self._enqueue("a", "b", "c")
+        # The first one is being worked on, the last one was taken by another worker
+        self.queue.remove(first)
+        self.queue.remove(jobs[1])
+        worker = EnvelopeWorker([self.queue], connection=self.connection)
+        timeout = first.timeout or self.queue.DEFAULT_TIMEOUT
+        batch = worker.claim_batch(first, self.queue)
+        self.assertEqual([first.id, jobs[0].id], [x.id for x in batch])
+        # Gone from the queue, but RQ knows about it if the worker dies
+        self.assertEqual(0, self.queue.count)
+        self.assertEqual([jobs[0].id], self.queue.started_job_registry.get_job_ids())
+        self.assertEqual(timeout * 2, first.timeout)
+
+    def test_error_sent_not_done(self):
+        self._enqueue("a", "not_found")
+        worker = EnvelopeWorker([self.queue], connection=self.connection)
+        with patch.object(BatchJob, "job_done", autospec=True) as mock_done:
+            worker.work(burst=True)
+        self.assertEqual([["a", "not_found"]], BatchJob.batches)
+        self.assertEqual(["a"], [x.args[0].mm.id for x in mock_done.mock_calls])
+
+    def test_wrong_number_of_outcomes(self):
+        def run_jobs(cls, messages):
+            return [x.run_isolated() for x in messages][:1]
+
+        jobs = self._enqueue("a", "b")
+        worker = EnvelopeWorker([self.queue], connection=self.connection)
+        with patch.object(BatchJob, "run_jobs", classmethod(run_jobs)):
+            worker.work(burst=True)
+        for job in jobs:
+            self.assertEqual(JobStatus.FAILED, job.get_status(refresh=True))
+        # Rolled back
+        self.assertFalse(Connection.objects.exclude(channel_name="abc").exists())
@@ -0,0 +1,331 @@
+from __future__ import annotations
+
+import os
+import resource
+import signal
+import sys
+import threading
+from collections.abc import Callable
+from functools import partial
+from typing import TYPE_CHECKING
+from typing import Any
+
+from django.db import close_old_connections
+from rq import SimpleWorker
+from rq.job import Job
+from rq.timeouts import TimerDeathPenalty
+from rq.utils import current_timestamp
+
+from envelope.deferred_jobs.activity import get_activity_buffer
+from envelope.sender_loop import get_sender_loop
+
+if TYPE_CHECKING:
+    from rq import Queue
+    from envelope.deferred_jobs.message import DeferredJob
+
+__all__ = (
+    "EnvelopeJob",
+    "EnvelopeWorker",
+    "ThreadedEnvelopeWorker",
+    "preload_job_functions",
+    "get_memory_usage",
+    "run_threaded",
+)
+
+# Job functions by the name RQ stores them with, see preload_job_functions
+_job_functions: dict[str, Callable] = {}
+# Batches claimed by workers by the id of their first job, and results for the other jobs by id.
+# See EnvelopeWorker.claim_batch
+_batches: dict[str, list[Job]] = {}
+_batch_results: dict[str, Any] = {}
+
+
+def preload_job_functions() -> dict[str, Callable]:
+    """
+    Import init_job of every DeferredJob in the message registries, and the connection jobs,
+    so workers won't have to look them up for each job.
+
+    >>> funcs = preload_job_functions()
+    >>> funcs['envelope.channels.messages.Subscribe.init_job']
+    <bound method DeferredJob.init_job of <class 'envelope.channels.messages.Subscribe'>>
+    >>> 'envelope.deferred_jobs.jobs.mark_connection_action' in funcs
+    True
+    """
+    from envelope.deferred_jobs import jobs
+    from envelope.deferred_jobs.message import DeferredJob
+    from envelope.utils import get_global_message_registry
+
+    for message_types in get_global_message_registry().values():
+        for msg_class in message_types.values():
+            if issubclass(msg_class, DeferredJob):
+                _job_functions[msg_class.get_job_qualname()] = msg_class.init_job
+    for func in (
+        jobs.create_connection_status_on_websocket_connect,
+        jobs.update_connection_status_on_websocket_close,
+        jobs.mark_connection_action,
+    ):
+        _job_functions[f"{func.__module__}.{func.__name__}"] = func
+    return _job_functions
+
+
+def get_memory_usage() -> float:
+    """
+    Resident memory of this process in MB.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError):  # pragma: no cover
+        # Peak rather than current. KB on Linux, bytes on macOS.
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss / 1024 / (1024 if sys.platform == "darwin" else 1)
+
+
+def get_batch_class(job: Job) -> type[DeferredJob] | None:
+    """
+    The DeferredJob class of job if it has a batch_size.
+    """
+    from envelope.deferred_jobs.message import DeferredJob
+
+    msg_class = getattr(job.func, "__self__", None)
+    if (
+        isinstance(msg_class, type)
+        and issubclass(msg_class, DeferredJob)
+        and msg_class.batch_size
+        and job.func_name == msg_class.get_job_qualname()
+    ):
+        return msg_class
+
+
+def _run_batch(job_id: str, **kwargs):
+    jobs = _batches.pop(job_id)
+    try:
+        results = get_batch_class(jobs[0]).init_jobs([x.kwargs for x in jobs])
+    except Exception as exc:
+        # The others would run on their own otherwise
+        results = [exc] * len(jobs)
+    for job, result in zip(jobs[1:], results[1:]):
+        _batch_results[job.id] = result
+    return _raise_or_return(results[0])
+
+
+def _batch_result(job_id: str, **kwargs):
+    return _raise_or_return(_batch_results.pop(job_id))
+
+
+def _raise_or_return(result):
+    if isinstance(result, BaseException):
+        raise result
+    return result
+
+
+class EnvelopeJob(Job):
+    """
+    Uses preloaded job functions when possible.
+    Jobs in a batch run all of them, or return their result from the batch.
+    """
+
+    @property
+    def func(self):
+        if self.id in _batches:
+            return partial(_run_batch, self.id)
+        if self.id in _batch_results:
+            return partial(_batch_result, self.id)
+        if self.instance is None:
+            try:
+                return _job_functions[self.func_name]
+            except KeyError:
+                pass
+        return super().func
+
+
+class EnvelopeWorker(SimpleWorker):
+    """
+    Runs jobs within the worker process instead of forking for each one, so Django stays loaded
+    and database connections are reused between jobs (according to CONN_MAX_AGE).
+    Stops after the current job if it uses more than max_memory MB, so it can be replaced.
+    Connection.last_action is buffered while working, see ActivityBuffer, and messages are sent
+    from a long lived event loop, see SenderLoop.
+    DeferredJobs with batch_size are run together, see claim_batch.
+    Use the management command envelope_worker to start workers.
+    """
+
+    max_memory: int | None = None
+    # Seconds to wait for sends from a job to be delivered before starting the next one
+    send_timeout: float = 10
+
+    def __init__(self, *args, max_memory: int | None = None, **kwargs):
+        kwargs.setdefault("job_class", EnvelopeJob)
+        super().__init__(*args, **kwargs)
+        if max_memory is not None:
+            self.max_memory = max_memory
+        if not _job_functions:
+            preload_job_functions()
+
+    def work(self, *args, **kwargs) -> bool:
+        services = [x for x in (get_activity_buffer(), get_sender_loop()) if x]
+        for service in services:
+            service.start()
+        try:
+            return super().work(*args, **kwargs)
+        finally:
+            for service in reversed(services):
+                service.stop()
+
+    def execute_job(self, job: Job, queue: Queue):
+        batch = self.claim_batch(job, queue)
+        if len(batch) > 1:
+            _batches[job.id] = batch
+        try:
+            for item in batch:
+                close_old_connections()
+                try:
+                    super().execute_job(item, queue)
+                finally:
+                    close_old_connections()
+                    self.flush_sends(item)
+        finally:
+            _batches.pop(job.id, None)
+            for item in batch:
+                _batch_results.pop(item.id, None)
+        if self.max_memory is not None:
+            usage = get_memory_usage()
+            if usage > self.max_memory:
+                self.log.info(
+                    "Worker %s: using %.0f MB of max %s, recycling",
+                    self.key,
+                    usage,
+                    self.max_memory,
+                )
+                self.recycle()
+
+    def flush_sends(self, job: Job):
+        """
+        Wait for messages sent without blocking during the job, so failed sends are logged before
+        the next job starts. The sender loop is shared within the process, so this waits for
+        sends from other threaded workers as well.
+        """
+        sender_loop = get_sender_loop()
+        if sender_loop is None or not sender_loop.active:
+            return
+        if not sender_loop.flush(timeout=self.send_timeout):
+            self.log.warning(
+                "Job %s: sends not delivered within %s seconds",
+                job.id,
+                self.send_timeout,
+            )
+
+    def recycle(self):
+        """
+        Stop after the current job.
+        """
+        self._stop_requested = True
+
+    def claim_batch(self, job: Job, queue: Queue) -> list[Job]:
+        """
+        If job is a DeferredJob with batch_size, take up to batch_size - 1 more queued jobs
+        of the same type from the queue, looking ahead twice that many jobs.
+        The first job runs them all with DeferredJob.init_jobs, the others get their result from it.
+
+        Claimed jobs are moved to the started job registry along with their removal from the queue,
+        so RQ will fail or retry them if the worker dies before they're done. The first job's timeout
+        is multiplied by the number of jobs in the batch, since it's the one running all of them.
+        """
+        msg_class = get_batch_class(job)
+        if msg_class is None:
+            return [job]
+        job_ids = queue.get_job_ids(0, msg_class.batch_size * 2)
+        candidates = [
+            x
+            for x in self.job_class.fetch_many(
+                job_ids, connection=self.connection, serializer=self.serializer
+            )
+            if x is not None and x.func_name == job.func_name
+        ][: msg_class.batch_size - 1]
+        if not candidates:
+            return [job]
+        timeout = job.timeout or queue.DEFAULT_TIMEOUT
+        # Until the batch has been run, with the margin RQ uses for heartbeats
+        if timeout == -1:
+            score = "+inf"
+        else:
+            score = current_timestamp() + timeout * (len(candidates) + 1) + 60
+        registry = queue.started_job_registry
+        with self.connection.pipeline() as pipeline:
+            for candidate in candidates:
+                queue.remove(candidate.id, pipeline=pipeline)
+                pipeline.zadd(registry.key, {candidate.id: score}, nx=True)
+            results = pipeline.execute()
+        batch = [job]
+        with self.connection.pipeline() as pipeline:
+            for candidate, removed, added in zip(
+                candidates, results[::2], results[1::2]
+            ):
+                if removed:
+                    batch.append(candidate)
+                elif added:
+                    # Another worker took it and registers it on its own
+                    registry.remove(candidate, pipeline=pipeline)
+            pipeline.execute()
+        if timeout != -1:
+            job.timeout = timeout * len(batch)
+        return batch
+
+
+class ThreadedEnvelopeWorker(EnvelopeWorker):
+    """
+    Worker that runs in a thread next to others, see run_threaded.
+    Signals are handled by the main thread and job timeouts use timers.
+    Memory is shared, so all workers in the group stop when one of them is over the limit.
+    """
+
+    death_penalty_class = TimerDeathPenalty
+    # Seconds to block waiting for jobs, i.e. how long it may take to stop an idle worker
+    dequeue_timeout = 5
+    group: list[ThreadedEnvelopeWorker]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.group = [self]
+
+    def _install_signal_handlers(self):
+        pass
+
+    def recycle(self):
+        for worker in self.group:
+            worker._stop_requested = True
+
+
+def run_threaded(workers: list[ThreadedEnvelopeWorker], **work_kwargs) -> None:
+    """
+    Run workers in one thread each until they're done. SIGINT or SIGTERM stops them after their
+    current job, a second signal exits right away.
+    """
+    for worker in workers:
+        worker.group = workers
+    stopping = False
+
+    def _stop(signum, frame):
+        nonlocal stopping
+        if stopping:
+            raise SystemExit(1)
+        stopping = True
+        workers[0].log.info("Warm shut down requested, waiting for jobs to finish")
+        workers[0].recycle()
+
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGINT, _stop)
+        signal.signal(signal.SIGTERM, _stop)
+    threads = [
+        threading.Thread(
+            target=worker.work, kwargs=work_kwargs, name=worker.name, daemon=True
+        )
+        for worker in workers
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        while thread.is_alive():
+            # With a timeout so signals are handled
+            thread.join(timeout=1)
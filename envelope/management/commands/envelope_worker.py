@@ -0,0 +1,102 @@
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django_rq.queues import get_queues
+from redis.exceptions import ConnectionError
+from rq.logutils import setup_loghandlers
+
+from envelope import DEFAULT_QUEUE_NAME
+from envelope.deferred_jobs.pool import EnvelopeWorkerPool
+from envelope.deferred_jobs.worker import EnvelopeJob
+from envelope.deferred_jobs.worker import EnvelopeWorker
+from envelope.deferred_jobs.worker import ThreadedEnvelopeWorker
+from envelope.deferred_jobs.worker import preload_job_functions
+from envelope.deferred_jobs.worker import run_threaded
+
+
+class Command(BaseCommand):
+    """
+    Runs envelope workers on the specified queues. Jobs run within the worker without forking.
+
+    Example usage:
+    python manage.py envelope_worker default --concurrency 4 --max-memory 500
+    """
+
+    help = "Run envelope workers that keep Django loaded and run jobs without forking."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "queues",
+            nargs="*",
+            default=[DEFAULT_QUEUE_NAME],
+            help="The queues to work on, separated by space",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=1,
+            help="Number of workers",
+        )
+        parser.add_argument(
+            "--mode",
+            choices=["threads", "processes"],
+            default="threads",
+            help="Run workers as threads in this process, or as processes forked once at start",
+        )
+        parser.add_argument(
+            "--max-memory",
+            type=int,
+            default=None,
+            help="Recycle workers that use more than this many MB",
+        )
+        parser.add_argument(
+            "--max-jobs",
+            type=int,
+            default=None,
+            help="Recycle workers after this many jobs",
+        )
+        parser.add_argument(
+            "--burst",
+            action="store_true",
+            default=False,
+            help="Quit when the queues are empty",
+        )
+
+    def handle(self, *args, **options):
+        verbosity = options["verbosity"]
+        level = "DEBUG" if verbosity >= 2 else "WARNING" if verbosity == 0 else "INFO"
+        setup_loghandlers(level)
+        preload_job_functions()
+        queues = get_queues(*options["queues"], job_class=EnvelopeJob)
+        connection = queues[0].connection
+        concurrency = options["concurrency"]
+        work_kwargs = dict(
+            burst=options["burst"], logging_level=level, max_jobs=options["max_jobs"]
+        )
+        max_memory = options["max_memory"]
+        try:
+            if options["mode"] == "processes":
+                # Children get their own database connections
+                connections.close_all()
+                pool = EnvelopeWorkerPool(
+                    queues,
+                    connection=connection,
+                    num_workers=concurrency,
+                    max_memory=max_memory,
+                )
+                pool.start(burst=options["burst"], logging_level=level)
+            elif concurrency == 1:
+                worker = EnvelopeWorker(
+                    queues, connection=connection, max_memory=max_memory
+                )
+                worker.work(**work_kwargs)
+            else:
+                workers = [
+                    ThreadedEnvelopeWorker(
+                        queues, connection=connection, max_memory=max_memory
+                    )
+                    for _ in range(concurrency)
+                ]
+                run_threaded(workers, **work_kwargs)
+        except ConnectionError as exc:
+            self.stderr.write(str(exc))
+            raise SystemExit(1)
@@ -4,6 +4,7 @@ from abc import abstractmethod
 from pydantic import BaseModel
 
 from envelope import INTERNAL
+from envelope import WS_INCOMING
 from envelope import WS_OUTGOING
 from envelope.consumers.websocket import WebsocketConsumer
 from envelope.core import AsyncRunnable
@@ -22,6 +23,7 @@ class ProgressNum(Message):
     name = "progress.num"
     schema = ProgressSchema
     data: ProgressSchema
+    trusted = True
 
 
 @add_message(WS_OUTGOING)
@@ -29,6 +31,22 @@ class Status(Message):
     name = "s.stat"
 
 
+class QueuedSchema(BaseModel):
+    job_id: str
+
+
+@add_message(WS_OUTGOING)
+class Queued(Message):
+    """
+    Sent with state queued when a retried message is already queued, see DeferredJob.idempotency_ttl.
+    """
+
+    name = "s.queued"
+    schema = QueuedSchema
+    data: QueuedSchema
+    trusted = True
+
+
 class ClosingSchema(BaseModel):
     code: int = 1000
 
@@ -38,6 +56,7 @@ class ClosingConnection(Message):
     name = "s.closing"
     schema = ClosingSchema
     data: ClosingSchema
+    trusted = True
 
 
 @add_message(INTERNAL)
@@ -52,6 +71,43 @@ class CloseConnection(AsyncRunnable):
         await consumer.close(self.data.code)
 
 
+class CapabilitiesSchema(BaseModel):
+    compression: list[str] = []  # Supported compressors, in order of preference
+    batch: bool = False  # Batch messages are supported
+
+
+class AcceptedCapabilitiesSchema(BaseModel):
+    compression: str | None = None
+    batch: bool = False  # Frames will be coalesced into batch messages
+
+
+@add_message(WS_INCOMING)
+class Capabilities(AsyncRunnable):
+    """
+    Sent by clients to tell us what they support. Sending it again replaces the previous settings.
+    """
+
+    name = "s.capabilities"
+    schema = CapabilitiesSchema
+    data: CapabilitiesSchema
+
+    async def run(self, *, consumer: WebsocketConsumer, **kwargs):
+        compression = consumer.set_compression(self.data.compression)
+        batch = consumer.set_coalesce(self.data.batch)
+        msg = AcceptedCapabilities.from_message(
+            self, state=self.SUCCESS, compression=compression, batch=batch
+        )
+        await consumer.send_ws_message(msg)
+
+
+@add_message(WS_OUTGOING)
+class AcceptedCapabilities(Message):
+    name = "s.capabilities_accepted"
+    schema = AcceptedCapabilitiesSchema
+    data: AcceptedCapabilitiesSchema
+    trusted = True
+
+
 class BatchSchema(BaseModel):
     t: str
     payloads: list[dict | BaseModel | None]
@@ -73,6 +129,7 @@ class Batch(BatchMessage):
     name = "s.batch"
     schema = BatchSchema
     data: BatchSchema
+    trusted = True
 
     @classmethod
     def start(cls, msg: Message):
@@ -86,7 +143,7 @@ class Batch(BatchMessage):
         >>> progress = ProgressNum(curr=1, total=2)
         >>> batch = Batch.start(progress)
         >>> batch.data
-        BatchSchema(t='progress.num', payloads=[{'curr': 1, 'total': 2, 'msg': None}])
+        BatchSchema(t='progress.num', payloads=[ProgressSchema(curr=1, total=2, msg=None)])
         """
         if msg.data is None:
             payloads = [None]
@@ -109,9 +166,9 @@ class Batch(BatchMessage):
         >>> batch.append(progress)
         >>> batch.data
         BatchSchema(t='progress.num', \
-        payloads=[{'curr': 1, 'total': 2, 'msg': None}, ProgressSchema(curr=1, total=2, msg=None)])
+        payloads=[ProgressSchema(curr=1, total=2, msg=None), ProgressSchema(curr=1, total=2, msg=None)])
 
-        Note the mixed payloads-content - but that doesn't matter later on
+        Batch is trusted, so payloads are kept as they are until serialization
 
         >>> batch.data.dict()
         {'t': 'progress.num', \
@@ -140,6 +197,7 @@ class Batch2(BatchMessage):
     name = "s.batch2"
     schema = Batch2Schema
     data: Batch2Schema
+    trusted = True
 
     @classmethod
     def start(cls, msg: Message, common: dict | None = None):
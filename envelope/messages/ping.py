@@ -25,3 +25,4 @@ class Ping(AsyncRunnable):
 @add_message(WS_OUTGOING)
 class Pong(Message):
     name = "s.pong"
+    allow_batch = False  # Latency matters
@@ -1,8 +1,8 @@
 from __future__ import annotations
 from collections import UserDict
+from contextlib import contextmanager
 from typing import TYPE_CHECKING
 
-
 if TYPE_CHECKING:
     from envelope.core.message import Message
     from envelope.core.envelope import Envelope
@@ -10,6 +10,9 @@ if TYPE_CHECKING:
     from envelope.channels.models import PubSubChannel
 
 __all__ = (
+    "FrozenRegistryError",
+    "Registry",
+    "MessageTypes",
     "MessageRegistry",
     "EnvelopeRegistry",
     "PubSubChannelRegistry",
@@ -18,22 +21,117 @@ __all__ = (
     "envelope_registry",
     "pubsub_channel_registry",
     "context_channel_registry",
+    "freeze_registries",
+    "unfreeze_registries",
+    "unfrozen_registries",
 )
 
 
-class MessageRegistry(UserDict):
-    data: dict[str, dict[str, type[Message]]]
+class FrozenRegistryError(RuntimeError):
+    pass
+
+
+class Registry(UserDict):
+    """
+    Registries are frozen when the app is ready, unless ENVELOPE_FREEZE_REGISTRIES is False.
+    Changes after that will raise FrozenRegistryError.
+    version is incremented on each change, so anything computed from a registry knows when to rebuild.
+
+    >>> reg = Registry(a=1)
+    >>> reg.version
+    1
+    >>> reg.freeze()
+    >>> reg['b'] = 2
+    Traceback (most recent call last):
+    ...
+    envelope.registries.FrozenRegistryError: Registry is frozen, can't change 'b'. ...
+    >>> del reg['a']
+    Traceback (most recent call last):
+    ...
+    envelope.registries.FrozenRegistryError: Registry is frozen, can't change 'a'. ...
+    >>> reg.unfreeze()
+    >>> reg['b'] = 2
+    >>> reg.version
+    2
+    """
+
+    frozen: bool = False
+    version: int = 0
+
+    def __setitem__(self, key, value):
+        self.check_frozen(key)
+        super().__setitem__(key, value)
+        self.version += 1
+
+    def __delitem__(self, key):
+        self.check_frozen(key)
+        super().__delitem__(key)
+        self.version += 1
+
+    def check_frozen(self, key):
+        if self.frozen:
+            raise FrozenRegistryError(
+                f"{self.__class__.__name__} is frozen, can't change {key!r}. "
+                "Register everything before ChannelsEnvelopeConfig.ready() has finished, "
+                "or set ENVELOPE_FREEZE_REGISTRIES to False."
+            )
+
+    def freeze(self):
+        self.frozen = True
+
+    def unfreeze(self):
+        self.frozen = False
+
+
+class MessageTypes(Registry):
+    """
+    Message types within one envelope, by name.
+    """
+
+    data: dict[str, type[Message]]
+
 
+class MessageRegistry(Registry):
+    """
+    Registry of MessageTypes by envelope name. Plain dicts are converted.
 
-class EnvelopeRegistry(UserDict):
+    >>> reg = MessageRegistry()
+    >>> type(reg.setdefault('hello', {}))
+    <class 'envelope.registries.MessageTypes'>
+    """
+
+    data: dict[str, MessageTypes]
+
+    def __setitem__(self, key, value):
+        if not isinstance(value, MessageTypes):
+            value = MessageTypes(value)
+        super().__setitem__(key, value)
+
+    def setdefault(self, key, default=None) -> MessageTypes:
+        if key not in self:
+            self[key] = {} if default is None else default
+        return self[key]
+
+    def freeze(self):
+        super().freeze()
+        for reg in self.values():
+            reg.freeze()
+
+    def unfreeze(self):
+        super().unfreeze()
+        for reg in self.values():
+            reg.unfreeze()
+
+
+class EnvelopeRegistry(Registry):
     data: dict[str, Envelope]
 
 
-class PubSubChannelRegistry(UserDict):
+class PubSubChannelRegistry(Registry):
     data: dict[str, type[PubSubChannel]]
 
 
-class ContextChannelRegistry(UserDict):
+class ContextChannelRegistry(Registry):
     data: dict[str, type[ContextChannel]]
 
 
@@ -41,3 +139,60 @@ message_registry = MessageRegistry()
 envelope_registry = EnvelopeRegistry()
 pubsub_channel_registry = PubSubChannelRegistry()
 context_channel_registry = ContextChannelRegistry()
+
+
+def freeze_registries():
+    """
+    Freeze all registries and build each envelopes routing table.
+    Called when the app is ready.
+    """
+    for reg in (
+        message_registry,
+        envelope_registry,
+        pubsub_channel_registry,
+        context_channel_registry,
+    ):
+        reg.freeze()
+    for envelope in envelope_registry.values():
+        envelope.build_routes()
+
+
+def unfreeze_registries():
+    for reg in (
+        message_registry,
+        envelope_registry,
+        pubsub_channel_registry,
+        context_channel_registry,
+    ):
+        reg.unfreeze()
+
+
+@contextmanager
+def unfrozen_registries():
+    """
+    Allow registering things late within this block, like the helpers in envelope.testing.
+    Registries that were frozen are frozen again afterwards, which rebuilds routing tables.
+
+    >>> was_frozen = message_registry.frozen
+    >>> freeze_registries()
+    >>> with unfrozen_registries():
+    ...     message_registry['testing_late'] = {}
+    >>> message_registry.frozen
+    True
+    >>> del message_registry['testing_late']
+    Traceback (most recent call last):
+    ...
+    envelope.registries.FrozenRegistryError: MessageRegistry is frozen, can't change 'testing_late'. ...
+    >>> with unfrozen_registries():
+    ...     del message_registry['testing_late']
+    >>> if not was_frozen:
+    ...     unfreeze_registries()
+    """
+    frozen = message_registry.frozen
+    if frozen:
+        unfreeze_registries()
+    try:
+        yield
+    finally:
+        if frozen:
+            freeze_registries()
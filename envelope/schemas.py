@@ -1,10 +1,12 @@
+from __future__ import annotations
+
 from pydantic import BaseModel
 from pydantic import Field
 
 from envelope import MessageStates
 
 
-class MessageMeta(BaseModel):
+class MessageMeta:
     """
     Information about the nature of the message itself.
     It's never sent to the user but used
@@ -18,17 +20,90 @@ class MessageMeta(BaseModel):
     consumer_name:
         The consumers name (id) this message passed. Any reply to the author (for instance an error message)
         should be directed here.
+
+    This is created for every message, so it's a plain slotted object rather than a pydantic model.
+    Short keys from envelopes work too, and unknown keys are ignored.
+
+    >>> mm = MessageMeta(i=5, s='a', l='sv', user_pk='1', p={'dropped': True})
+    >>> mm
+    MessageMeta(id='5', user_pk=1, consumer_name=None, language='sv', state='a', env=None)
+    >>> mm.dict(exclude_none=True)
+    {'id': '5', 'user_pk': 1, 'language': 'sv', 'state': 'a'}
+    >>> mm == MessageMeta(**mm.dict())
+    True
+
+    Derive a copy with some values changed, the original won't be touched
+    >>> mm.derive(state='s')
+    MessageMeta(id='5', user_pk=1, consumer_name=None, language='sv', state='s', env=None)
+    >>> mm.state
+    'a'
     """
 
-    id: str | None = Field(alias="i")
+    __slots__ = ("id", "user_pk", "consumer_name", "language", "state", "env")
+
+    id: str | None
     user_pk: int | None
     consumer_name: str | None
-    language: str | None = Field(alias="l")
-    state: str | None = Field(alias="s")
-    env: str | None = None
-
-    class Config:
-        allow_population_by_field_name = True
+    language: str | None
+    state: str | None
+    env: str | None
+
+    def __init__(
+        self,
+        id: str | int | None = None,
+        user_pk: int | str | None = None,
+        consumer_name: str | None = None,
+        language: str | None = None,
+        state: str | None = None,
+        env: str | None = None,
+        *,
+        i: str | int | None = None,
+        l: str | None = None,
+        s: str | None = None,
+        **kwargs,
+    ):
+        if i is not None:
+            id = i
+        self.id = None if id is None else str(id)
+        self.user_pk = None if user_pk is None else int(user_pk)
+        self.consumer_name = consumer_name
+        self.language = language if l is None else l
+        self.state = state if s is None else s
+        self.env = env
+
+    def derive(self, **changes) -> MessageMeta:
+        mm = object.__new__(MessageMeta)
+        mm.id = changes.pop("id", self.id)
+        mm.user_pk = changes.pop("user_pk", self.user_pk)
+        mm.consumer_name = changes.pop("consumer_name", self.consumer_name)
+        mm.language = changes.pop("language", self.language)
+        mm.state = changes.pop("state", self.state)
+        mm.env = changes.pop("env", self.env)
+        if changes:
+            raise TypeError(f"Unknown MessageMeta attributes: {', '.join(changes)}")
+        return mm
+
+    def dict(
+        self, *, exclude: set[str] | None = None, exclude_none: bool = False
+    ) -> dict:
+        data = {}
+        for name in self.__slots__:
+            if exclude and name in exclude:
+                continue
+            value = getattr(self, name)
+            if value is None and exclude_none:
+                continue
+            data[name] = value
+        return data
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, MessageMeta):
+            return all(getattr(self, x) == getattr(other, x) for x in self.__slots__)
+        return NotImplemented
+
+    def __repr__(self):
+        values = ", ".join(f"{x}={getattr(self, x)!r}" for x in self.__slots__)
+        return f"{self.__class__.__name__}({values})"
 
 
 class NoPayload(BaseModel):
@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+from collections.abc import Awaitable
+from collections.abc import Callable
+from collections.abc import Hashable
+from concurrent.futures import Future
+from concurrent.futures import wait
+from logging import getLogger
+from typing import Any
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+
+__all__ = (
+    "SenderLoop",
+    "get_sender_loop",
+    "run_sync",
+)
+
+logger = getLogger(__name__)
+
+_sender_loop: SenderLoop | None = None
+
+
+class SenderLoop:
+    """
+    An event loop in a thread of its own, for sending to the channel layer from sync code
+    without setting up async_to_sync for each message. Channel layers keep their connections
+    per event loop, so they're reused as well.
+
+    Work submitted with the same key runs in the order it was submitted, other work runs concurrently.
+    Workers start the loop when they start working and stop it when they're done,
+    the last one to stop waits for everything submitted. Until then, senders use async_to_sync.
+
+    >>> loop = SenderLoop()
+    >>> loop.start()
+    >>> async def hello(name):
+    ...     return f"Hello {name}"
+    >>> loop.submit(hello, "world").result()
+    'Hello world'
+    >>> loop.stop()
+    >>> loop.active
+    False
+    """
+
+    def __init__(self):
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.lock = threading.Lock()
+        self.users = 0
+        self.pending: set[Future] = set()
+        # Last task for each key, see submit
+        self.tails: dict[Hashable, asyncio.Future] = {}
+        self._thread: threading.Thread | None = None
+
+    @property
+    def active(self) -> bool:
+        return self.users > 0
+
+    def start(self):
+        with self.lock:
+            self.users += 1
+            if self._thread is not None:
+                return
+            self.loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(
+                target=self.loop.run_forever, name="envelope-sender", daemon=True
+            )
+        self._thread.start()
+
+    def stop(self):
+        with self.lock:
+            self.users = max(self.users - 1, 0)
+            if self.users or self._thread is None:
+                return
+            thread, self._thread = self._thread, None
+        self.flush()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        thread.join()
+        self.loop.close()
+        self.tails.clear()
+
+    def submit(
+        self,
+        func: Callable[..., Awaitable],
+        *args,
+        key: Hashable | None = None,
+        **kwargs,
+    ) -> Future:
+        """
+        Run func on the loop without waiting for it. Returns a future for the result.
+        """
+        future = Future()
+        with self.lock:
+            self.pending.add(future)
+        future.add_done_callback(self._done)
+        self.loop.call_soon_threadsafe(self._schedule, key, future, func, args, kwargs)
+        return future
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """
+        Wait for everything submitted so far. Returns False on timeout.
+        """
+        with self.lock:
+            pending = list(self.pending)
+        if not pending:
+            return True
+        return not wait(pending, timeout=timeout).not_done
+
+    def _schedule(self, key, future: Future, func, args, kwargs):
+        previous = self.tails.get(key) if key is not None else None
+        task = self.loop.create_task(self._run(previous, future, func, args, kwargs))
+        if key is not None:
+            self.tails[key] = task
+            task.add_done_callback(
+                lambda t: self.tails.get(key) is t and self.tails.pop(key)
+            )
+
+    @staticmethod
+    async def _run(previous: asyncio.Future | None, future: Future, func, args, kwargs):
+        if previous is not None:
+            await asyncio.wait([previous])
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(await func(*args, **kwargs))
+        except BaseException as exc:
+            future.set_exception(exc)
+
+    def _done(self, future: Future):
+        with self.lock:
+            self.pending.discard(future)
+        if not future.cancelled() and (exc := future.exception()) is not None:
+            logger.error("Send failed", exc_info=exc)
+
+
+def get_sender_loop() -> SenderLoop | None:
+    """
+    Sender loop for this process, or None if ENVELOPE_SENDER_LOOP is False.
+    """
+    global _sender_loop
+    if not getattr(settings, "ENVELOPE_SENDER_LOOP", True):
+        return None
+    if _sender_loop is None:
+        _sender_loop = SenderLoop()
+    return _sender_loop
+
+
+def run_sync(func: Callable[..., Awaitable], *args, **kwargs) -> Any:
+    """
+    Run an async function from sync code and wait for the result,
+    on the sender loop if it's running or with async_to_sync otherwise.
+    """
+    sender_loop = get_sender_loop()
+    if sender_loop is not None and sender_loop.active:
+        return sender_loop.submit(func, *args, **kwargs).result()
+    return async_to_sync(func)(*args, **kwargs)
@@ -29,6 +29,7 @@ from envelope.core.transport import DictTransport
 from envelope.decorators import add_message
 from envelope.messages.testing import ClientInfo
 from envelope.messages.testing import SendClientInfo
+from envelope.registries import unfrozen_registries
 from envelope.schemas import OutgoingEnvelopeSchema
 from envelope.utils import add_envelopes
 from envelope.utils import get_envelope
@@ -51,16 +52,19 @@ testing_envelope = Envelope(
     allow_batch=True,
 )
 
-add_envelopes(testing_envelope)
 
-
-@add_message(TESTING_NS)
 class WebsocketHello(AsyncRunnable):
     name = "testing.hello"
 
     async def run(self, **kwargs): ...
 
 
+# Importing this module from tests happens after the app is ready
+with unfrozen_registries():
+    add_envelopes(testing_envelope)
+    add_message(TESTING_NS)(WebsocketHello)
+
+
 def mk_simple_worker(queue="default") -> SimpleWorker:
     if isinstance(queue, str):
         queue = get_queue(name=queue)
@@ -94,7 +98,24 @@ def load_doctests(tests, package, ignore_names: set[str] = frozenset()) -> None:
     for importer, name, ispkg in walk_packages(
         package.__path__, package.__name__ + "."
     ):
-        tests.addTests(doctest.DocTestSuite(name, optionflags=opts))
+        tests.addTests(
+            doctest.DocTestSuite(
+                name,
+                optionflags=opts,
+                setUp=_unfreeze_for_doctest,
+                tearDown=_refreeze_after_doctest,
+            )
+        )
+
+
+def _unfreeze_for_doctest(test: doctest.DocTest):
+    # Examples register things the way apps do before they're ready
+    test.globs["_unfrozen_registries"] = unfrozen = unfrozen_registries()
+    unfrozen.__enter__()
+
+
+def _refreeze_after_doctest(test: doctest.DocTest):
+    test.globs.pop("_unfrozen_registries").__exit__(None, None, None)
 
 
 class TempSignal:
@@ -128,8 +149,7 @@ class EnvelopeWebsocketCommunicator(WebsocketCommunicator):
         assert (
             msg.name in envelope.registry
         ), f"{msg.name} doesn't exist in message registry registry {envelope.name}"
-        payload = envelope.pack(msg)
-        text_data = payload.json()
+        text_data = envelope.serialize(msg)
         await self.send_to(text_data=text_data)
 
     async def send_internal(self, msg: Message):
@@ -137,8 +157,7 @@ class EnvelopeWebsocketCommunicator(WebsocketCommunicator):
         assert (
             msg.name in envelope.registry
         ), f"{msg.name} doesn't exist in message registry registry {envelope.name}"
-        payload = envelope.pack(msg)
-        data = payload.dict()
+        data = envelope.get_serializer(msg.__class__)(msg)
         await self.send_input({"type": "internal.msg", **data})
 
     async def receive_msg(self) -> Message:
@@ -163,7 +182,7 @@ class EnvelopeWebsocketCommunicator(WebsocketCommunicator):
         return response.data.consumer_name
 
 
-async def mk_communicator(client=None, drain=True, headers=()):
+async def mk_communicator(client=None, drain=True, headers=(), subprotocols=None):
     from envelope.consumers.websocket import WebsocketConsumer
 
     headers = list(headers)
@@ -178,6 +197,7 @@ async def mk_communicator(client=None, drain=True, headers=()):
         AuthMiddlewareStack(WebsocketConsumer.as_asgi()),
         "/testws/",
         headers=headers,
+        subprotocols=subprotocols,
     )
     connected, subprotocol = await communicator.connect()
     assert connected, "Not connected"
@@ -1,10 +1,21 @@
+import asyncio
+import gc
+from time import monotonic
 from unittest.mock import patch
 
+from asgiref.sync import async_to_sync
 from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase
 from django.test import TestCase
+from django.test import override_settings
 
+from envelope.async_signals import concurrent
 from envelope.async_signals import incoming_websocket_message
+from envelope.async_signals import message_types
 from envelope.channels.messages import Subscriptions
+from envelope.core.message import AsyncRunnable
+from envelope.messages.ping import Ping
+from envelope.messages.ping import Pong
 from envelope.testing import mk_consumer
 
 User = get_user_model()
@@ -23,3 +34,147 @@ class RunAsyncRunnableTest(TestCase):
         self.assertTrue(mocked_send.called)
         msg = mocked_send.mock_calls[0].args[0]
         self.assertIsInstance(msg, Subscriptions)
+
+
+class MessageSignalTests(SimpleTestCase):
+    def _mk_signal(self):
+        from envelope.async_signals import MessageSignal
+
+        return MessageSignal()
+
+    def test_plan_cached_and_cleared(self):
+        signal = self._mk_signal()
+
+        async def receiver(**kwargs):
+            pass
+
+        self.assertFalse(signal.has_listeners(Ping))
+        self.assertIn(Ping, signal.plans)
+        signal.connect(receiver)
+        self.assertEqual({}, signal.plans)
+        self.assertTrue(signal.has_listeners(Ping))
+        plan = signal.plans[Ping]
+        self.assertIs(plan, signal.get_plan(Ping))
+        signal.disconnect(receiver)
+        self.assertFalse(signal.has_listeners(Ping))
+
+    def test_message_types_and_sender(self):
+        signal = self._mk_signal()
+        calls = []
+
+        @message_types(AsyncRunnable)
+        async def runnable_receiver(*, sender, **kwargs):
+            calls.append(("runnable", sender))
+
+        def pong_receiver(*, sender, **kwargs):
+            calls.append(("pong", sender))
+
+        signal.connect(runnable_receiver)
+        signal.connect(pong_receiver, sender=Pong)
+        async_to_sync(signal.send)(Ping, message=Ping())
+        async_to_sync(signal.send)(Pong, message=Pong())
+        self.assertEqual([("runnable", Ping), ("pong", Pong)], calls)
+
+    def test_dead_receiver(self):
+        signal = self._mk_signal()
+
+        async def receiver(**kwargs):
+            pass
+
+        signal.connect(receiver)
+        self.assertTrue(signal.has_listeners(Ping))
+        del receiver
+        gc.collect()
+        self.assertFalse(signal.has_listeners(Ping))
+
+    def test_debug(self):
+        signal = self._mk_signal()
+        with override_settings(ENVELOPE_SIGNAL_DEBUG=False):
+            signal.connect(lambda message: None)  # Not checked
+        with override_settings(ENVELOPE_SIGNAL_DEBUG=True):
+            with self.assertRaises(ValueError):
+                signal.connect(lambda message: None)
+
+    def test_send_robust(self):
+        signal = self._mk_signal()
+
+        def receiver(**kwargs):
+            raise ValueError("Oh no")
+
+        signal.connect(receiver)
+        with self.assertLogs("async_signals.dispatch", level="ERROR"):
+            responses = async_to_sync(signal.send_robust)(Ping, message=Ping())
+        self.assertIsInstance(responses[0][1], ValueError)
+
+
+class ConcurrentReceiversTests(SimpleTestCase):
+    def setUp(self):
+        from envelope.async_signals import MessageSignal
+
+        self.signal = MessageSignal()
+        self.calls = []
+
+    def _mk_receiver(self, name, delay=0.0, concurrent_=False, exc=None):
+        async def _receiver(**kwargs):
+            self.calls.append(f"{name} start")
+            await asyncio.sleep(delay)
+            self.calls.append(f"{name} end")
+            if exc:
+                raise exc
+            return name
+
+        _receiver.__qualname__ = name
+        if concurrent_:
+            concurrent(_receiver)
+        self.signal.connect(_receiver, weak=False)
+        return _receiver
+
+    async def test_concurrent_receivers(self):
+        self._mk_receiver("first")
+        self._mk_receiver("slow_a", delay=0.05, concurrent_=True)
+        self._mk_receiver("slow_b", delay=0.05, concurrent_=True)
+        self._mk_receiver("second")
+        start = monotonic()
+        responses = await self.signal.send(Ping, message=Ping())
+        self.assertLess(monotonic() - start, 0.09)
+        # Responses in connected order
+        self.assertEqual(
+            ["first", "slow_a", "slow_b", "second"], [x[1] for x in responses]
+        )
+        # Ordered receivers kept their order
+        ordered = [x for x in self.calls if x.startswith(("first", "second"))]
+        self.assertEqual(
+            ["first start", "first end", "second start", "second end"], ordered
+        )
+
+    @override_settings(ENVELOPE_CONCURRENT_RECEIVERS=False)
+    async def test_concurrent_disabled(self):
+        self._mk_receiver("slow_a", delay=0.01, concurrent_=True)
+        self._mk_receiver("slow_b", delay=0.01, concurrent_=True)
+        await self.signal.send(Ping, message=Ping())
+        self.assertEqual(
+            ["slow_a start", "slow_a end", "slow_b start", "slow_b end"], self.calls
+        )
+
+    async def test_exceptions_reported_per_receiver(self):
+        self._mk_receiver("ordered_bad", exc=ValueError("ordered"))
+        self._mk_receiver("never")
+        self._mk_receiver("concurrent_bad", concurrent_=True, exc=KeyError("conc"))
+        self._mk_receiver("concurrent_ok", concurrent_=True)
+        with self.assertLogs("async_signals.dispatch", level="ERROR") as logs:
+            with self.assertRaises(ValueError):
+                await self.signal.send(Ping, message=Ping())
+        self.assertEqual(2, len(logs.records))
+        self.assertNotIn("never start", self.calls)
+        self.assertIn("concurrent_ok end", self.calls)
+
+    async def test_send_robust(self):
+        self._mk_receiver("ordered_bad", exc=ValueError("ordered"))
+        self._mk_receiver("ordered_ok")
+        self._mk_receiver("concurrent_bad", concurrent_=True, exc=KeyError("conc"))
+        with self.assertLogs("async_signals.dispatch", level="ERROR"):
+            responses = await self.signal.send_robust(Ping, message=Ping())
+        results = [x[1] for x in responses]
+        self.assertIsInstance(results[0], ValueError)
+        self.assertEqual("ordered_ok", results[1])
+        self.assertIsInstance(results[2], KeyError)
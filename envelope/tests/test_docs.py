@@ -4,6 +4,7 @@ import os
 from django.contrib.auth import get_user_model
 from django.test import TestCase
 from django.test import override_settings
+from envelope.registries import unfrozen_registries
 from envelope.testing import load_doctests
 from envelope.testing import testing_channel_layers_setting
 
@@ -24,11 +25,12 @@ class RunDocTests(TestCase):
         self.client.force_login(self.user)
 
     def _doctest_file(self, fn):
-        result = doctest.testfile(
-            os.path.join(self.ROOT_RELATIVE, fn),
-            optionflags=self.FLAGS,
-            extraglobs={"test": self},
-        )
+        with unfrozen_registries():
+            result = doctest.testfile(
+                os.path.join(self.ROOT_RELATIVE, fn),
+                optionflags=self.FLAGS,
+                extraglobs={"test": self},
+            )
         if result.failed:
             self.fail(f"DocTest {fn} has {result.failed} fails")
 
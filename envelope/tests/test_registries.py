@@ -0,0 +1,60 @@
+from unittest.mock import patch
+
+from django.test import SimpleTestCase
+
+from envelope import Handler
+from envelope import WS_INCOMING
+from envelope.core.message import Message
+from envelope.decorators import add_message
+from envelope.envelopes import incoming
+from envelope.registries import FrozenRegistryError
+from envelope.registries import freeze_registries
+from envelope.registries import message_registry
+from envelope.registries import unfreeze_registries
+from envelope.registries import unfrozen_registries
+
+
+class LateMessage(Message):
+    name = "testing.late"
+
+
+class RegistryTests(SimpleTestCase):
+    def setUp(self):
+        self.frozen = message_registry.frozen
+
+    def tearDown(self):
+        unfreeze_registries()
+        message_registry[WS_INCOMING].pop(LateMessage.name, None)
+        if self.frozen:
+            freeze_registries()
+
+    def test_late_registration_when_frozen(self):
+        freeze_registries()
+        with self.assertRaises(FrozenRegistryError):
+            add_message(WS_INCOMING)(LateMessage)
+        self.assertNotIn(LateMessage.name, incoming.routes)
+
+    def test_routes_rebuilt_when_not_frozen(self):
+        unfreeze_registries()
+        routes = incoming.routes
+        self.assertIs(routes, incoming.routes)
+        add_message(WS_INCOMING)(LateMessage)
+        self.assertIsNot(routes, incoming.routes)
+        self.assertEqual(LateMessage, incoming.routes[LateMessage.name].msg_class)
+        self.assertEqual(Handler.MESSAGE, incoming.routes[LateMessage.name].handler)
+
+    def test_frozen_by_default(self):
+        self.assertTrue(message_registry.frozen)
+
+    def test_late_registration_unfrozen(self):
+        freeze_registries()
+        with unfrozen_registries():
+            add_message(WS_INCOMING)(LateMessage)
+        self.assertTrue(message_registry.frozen)
+        self.assertEqual(LateMessage, incoming.routes[LateMessage.name].msg_class)
+
+    def test_frozen_routes_not_checked(self):
+        freeze_registries()
+        with patch.object(incoming, "get_routes_key") as mock_key:
+            self.assertEqual(Handler.ASYNC_RUNNABLE, incoming.routes["s.ping"].handler)
+        self.assertFalse(mock_key.called)
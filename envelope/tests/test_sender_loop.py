@@ -0,0 +1,85 @@
+import asyncio
+from threading import current_thread
+from unittest.mock import patch
+
+from channels.layers import get_channel_layer
+from django.test import SimpleTestCase
+from django.test import override_settings
+
+from envelope.messages.ping import Pong
+from envelope.sender_loop import SenderLoop
+from envelope.sender_loop import get_sender_loop
+from envelope.sender_loop import run_sync
+from envelope.testing import testing_channel_layers_setting
+from envelope.utils import websocket_send
+
+
+@override_settings(CHANNEL_LAYERS=testing_channel_layers_setting)
+class SenderLoopTests(SimpleTestCase):
+    def setUp(self):
+        self.sender_loop = get_sender_loop()
+        self.sender_loop.start()
+        self.addCleanup(self.sender_loop.stop)
+        self.done = []
+
+    async def _append(self, value, delay=0.0):
+        await asyncio.sleep(delay)
+        self.done.append(value)
+        return current_thread().name
+
+    def test_same_key_in_order(self):
+        self.sender_loop.submit(self._append, 1, 0.05, key="a")
+        self.sender_loop.submit(self._append, 2, key="a")
+        self.sender_loop.submit(self._append, 3, key="b")
+        self.assertTrue(self.sender_loop.flush(timeout=1))
+        self.assertEqual([3, 1, 2], self.done)
+        self.assertEqual({}, self.sender_loop.tails)
+
+    def test_run_sync(self):
+        self.assertEqual("envelope-sender", run_sync(self._append, 1))
+
+    def test_run_sync_inactive(self):
+        loop = SenderLoop()
+        with patch("envelope.sender_loop._sender_loop", loop):
+            self.assertNotEqual("envelope-sender", run_sync(self._append, 1))
+        self.assertIsNone(loop.loop)
+
+    def test_failure_logged(self):
+        async def fail():
+            raise ValueError("Nope")
+
+        with self.assertLogs("envelope.sender_loop", "ERROR"):
+            future = self.sender_loop.submit(fail)
+            self.assertTrue(self.sender_loop.flush(timeout=1))
+        self.assertIsInstance(future.exception(), ValueError)
+
+    def test_websocket_send(self):
+        layer = get_channel_layer()
+        threads = []
+
+        async def _send(*args):
+            threads.append(current_thread().name)
+
+        with patch.object(layer, "send", side_effect=_send) as mock_send:
+            for _ in range(3):
+                websocket_send(Pong(), channel_name="abc", on_commit=False)
+            self.sender_loop.flush()
+        self.assertEqual(3, mock_send.call_count)
+        self.assertEqual({"envelope-sender"}, set(threads))
+
+    def test_websocket_send_serialized_right_away(self):
+        layer = get_channel_layer()
+        msg = Pong()
+        with patch.object(layer, "send") as mock_send:
+            websocket_send(msg, channel_name="abc", state="r", on_commit=False)
+            websocket_send(msg, channel_name="abc", state="s", on_commit=False)
+            self.sender_loop.flush()
+        self.assertEqual(["r", "s"], [x.args[1]["s"] for x in mock_send.mock_calls])
+
+    def test_stop_waits(self):
+        loop = SenderLoop()
+        loop.start()
+        loop.submit(self._append, 1, 0.05)
+        loop.stop()
+        self.assertEqual([1], self.done)
+        self.assertFalse(loop.active)
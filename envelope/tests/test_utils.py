@@ -1,19 +1,27 @@
 from datetime import datetime
+from datetime import timedelta
+from unittest import skipIf
 from unittest.mock import patch
 
+import django
 from django.contrib.auth import get_user_model
+from django.db import connection
 from django.db.transaction import TransactionManagementError
 from django.db.transaction import get_connection
 from django.test import SimpleTestCase
 from django.test import TestCase
 from django.test import override_settings
+from django.utils.timezone import now
 
 from envelope.messages.errors import BadRequestError
 from envelope.messages.ping import Pong
+from envelope.models import Connection
 from envelope.testing import testing_channel_layers_setting
 from envelope.utils import get_or_create_txn_sender
 
 User = get_user_model()
+# Connections are upserted with bulk_create from Django 5.0, see upsert_connection_statuses
+skip_without_upserts = skipIf(django.VERSION < (5, 0), "update_or_create is used")
 
 
 class UpdateConnectionStatusTests(TestCase):
@@ -33,6 +41,101 @@ class UpdateConnectionStatusTests(TestCase):
         self.assertIsInstance(conn.online_at, datetime)
         self.assertEqual(self.user, conn.user)
 
+    @skip_without_upserts
+    def test_update_connection_status_one_query(self):
+        with self.assertNumQueries(1):
+            conn = self._fut(self.user.pk, "abc")
+        self.assertIsNotNone(conn.pk)
+        self.assertEqual(
+            {"awol", "online_at", "offline_at", "last_action"},
+            conn.get_deferred_fields(),
+        )
+
+    @skip_without_upserts
+    def test_update_connection_status_existing(self):
+        online_at = now() - timedelta(minutes=1)
+        existing = Connection.objects.create(
+            user=self.user, channel_name="abc", online_at=online_at
+        )
+        offline_at = now()
+        with self.assertNumQueries(1):
+            conn = self._fut(self.user.pk, "abc", online=False, offline_at=offline_at)
+        self.assertEqual(existing.pk, conn.pk)
+        self.assertFalse(conn.online)
+        self.assertEqual(online_at, conn.online_at)
+        existing.refresh_from_db()
+        self.assertFalse(existing.online)
+        self.assertEqual(offline_at, existing.offline_at)
+
+
+class UpsertConnectionStatusesTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username="connecter")
+
+    @property
+    def _fut(self):
+        from envelope.utils import upsert_connection_statuses
+
+        return upsert_connection_statuses
+
+    @skip_without_upserts
+    def test_grouped_by_fields(self):
+        at = now()
+        with self.assertNumQueries(2):
+            conns = self._fut(
+                [
+                    {"user_pk": self.user.pk, "channel_name": "a", "online_at": at},
+                    {"user_pk": self.user.pk, "channel_name": "b", "online_at": at},
+                    {"user_pk": self.user.pk, "channel_name": "c", "online": False},
+                ]
+            )
+        self.assertEqual(["a", "b", "c"], [x.channel_name for x in conns])
+        self.assertEqual(3, Connection.objects.filter(user=self.user).count())
+
+    def test_same_connection_merged(self):
+        at = now()
+        conns = self._fut(
+            [
+                {"user_pk": self.user.pk, "channel_name": "a", "online_at": at},
+                {"user_pk": self.user.pk, "channel_name": "a", "online": False},
+                {"user_pk": self.user.pk, "channel_name": "a", "offline_at": None},
+            ]
+        )
+        self.assertEqual(1, len(conns))
+        conn = Connection.objects.get()
+        self.assertEqual(at, conn.online_at)
+        self.assertFalse(conn.online)
+        self.assertIsNone(conn.offline_at)
+
+    def test_nothing_to_change(self):
+        existing = Connection.objects.create(
+            user=self.user, channel_name="a", online=False
+        )
+        conns = self._fut([{"user_pk": self.user.pk, "channel_name": "a"}])
+        self.assertEqual(existing.pk, conns[0].pk)
+        self.assertFalse(conns[0].online)
+
+    def test_without_update_conflicts(self):
+        existing = Connection.objects.create(
+            user=self.user, channel_name="a", online=False
+        )
+        at = now()
+        with patch.object(
+            connection.features, "supports_update_conflicts_with_target", False
+        ):
+            conns = self._fut(
+                [
+                    {"user_pk": self.user.pk, "channel_name": "a", "online": True},
+                    {"user_pk": self.user.pk, "channel_name": "b", "online_at": at},
+                ]
+            )
+        self.assertEqual(existing.pk, conns[0].pk)
+        self.assertTrue(conns[0].online)
+        self.assertEqual(at, conns[1].online_at)
+        self.assertEqual(2, Connection.objects.filter(user=self.user).count())
+
 
 @override_settings(
     CHANNEL_LAYERS=testing_channel_layers_setting,
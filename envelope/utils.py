@@ -1,12 +1,16 @@
 from __future__ import annotations
 
 from collections import defaultdict
+from collections.abc import Iterable
 from datetime import datetime
 from typing import TYPE_CHECKING
 
+import django
 from asgiref.sync import async_to_sync
 from channels.layers import get_channel_layer
 from django.conf import settings
+from django.db import connections
+from django.db import router
 from django.db import transaction
 from django.db.transaction import TransactionManagementError
 from django.db.transaction import get_connection
@@ -17,28 +21,32 @@ from envelope import ERRORS
 from envelope import INTERNAL
 from envelope import WS_OUTGOING
 from envelope.models import Connection
+from envelope.registries import context_channel_registry
+from envelope.registries import envelope_registry
+from envelope.registries import message_registry
+from envelope.sender_loop import get_sender_loop
 
 if TYPE_CHECKING:
+    from envelope.core.codecs import Codec
+    from envelope.core.compression import Compressor
     from envelope.core.message import ErrorMessage
     from envelope.core.message import Message
     from envelope.core.envelope import Envelope
+    from envelope.registries import ContextChannelRegistry
     from envelope.registries import MessageRegistry
+    from envelope.registries import MessageTypes
     from envelope.messages.common import BatchMessage
 
 
 def get_global_message_registry() -> MessageRegistry:
-    from envelope.registries import message_registry
-
     return message_registry
 
 
-def get_message_registry(name: str):
-    return get_global_message_registry()[name]
-
+def get_message_registry(name: str) -> MessageTypes:
+    return message_registry[name]
 
-def get_context_channel_registry():
-    from envelope.registries import context_channel_registry
 
+def get_context_channel_registry() -> ContextChannelRegistry:
     return context_channel_registry
 
 
@@ -47,8 +55,6 @@ def get_error_type(name) -> type[ErrorMessage]:
 
 
 def get_envelope(name) -> Envelope:
-    from envelope.registries import envelope_registry
-
     return envelope_registry[name]
 
 
@@ -78,6 +84,95 @@ def get_sender_util() -> type[SenderUtil]:
         return SenderUtil
 
 
+_codecs: dict[str, Codec] = {}
+_compressors: dict[str, Compressor] = {}
+
+
+def get_codec(name: str | None = None) -> Codec:
+    """
+    Returns a shared instance of the codec specified by name, or whatever we've set as ENVELOPE_CODEC.
+
+    >>> from django.test import override_settings
+    >>> get_codec()
+    <envelope.core.codecs.JSONCodec object at ...>
+    >>> with override_settings(ENVELOPE_CODEC='envelope.core.codecs.OrjsonCodec'):
+    ...     get_codec()
+    <envelope.core.codecs.OrjsonCodec object at ...>
+    >>> get_codec('envelope.core.codecs.OrjsonCodec') is get_codec('envelope.core.codecs.OrjsonCodec')
+    True
+    """
+    if name is None:
+        name = getattr(settings, "ENVELOPE_CODEC", "envelope.core.codecs.JSONCodec")
+    try:
+        return _codecs[name]
+    except KeyError:
+        codec = _codecs[name] = import_string(name)()
+        return codec
+
+
+def get_compressors() -> dict[str, Compressor]:
+    """
+    Compressors from ENVELOPE_COMPRESSORS by name, in order of preference.
+
+    >>> get_compressors()
+    {'zlib': <envelope.core.compression.ZlibCompressor object at ...>}
+    """
+    names = getattr(
+        settings, "ENVELOPE_COMPRESSORS", ["envelope.core.compression.ZlibCompressor"]
+    )
+    compressors = {}
+    for name in names:
+        try:
+            compressor = _compressors[name]
+        except KeyError:
+            compressor = _compressors[name] = import_string(name)()
+        compressors[compressor.name] = compressor
+    return compressors
+
+
+def get_compression_threshold() -> int | None:
+    """
+    Encoded frames of at least this size are compressed for clients that support it.
+    None means compression is disabled.
+    """
+    return getattr(settings, "ENVELOPE_COMPRESSION_THRESHOLD", None)
+
+
+def get_coalesce_window() -> float | None:
+    """
+    Seconds to gather websocket_send frames for batching, from ENVELOPE_COALESCE_WINDOW in ms.
+    None means frames aren't coalesced, 0 means within one loop tick.
+
+    >>> from django.test import override_settings
+    >>> get_coalesce_window() is None
+    True
+    >>> with override_settings(ENVELOPE_COALESCE_WINDOW=5):
+    ...     get_coalesce_window()
+    0.005
+    """
+    window = getattr(settings, "ENVELOPE_COALESCE_WINDOW", None)
+    if window is None:
+        return None
+    return window / 1000
+
+
+def get_subprotocol_codecs() -> dict[str, Codec]:
+    """
+    Websocket subprotocols clients may ask for, and the codec to use for each, from ENVELOPE_SUBPROTOCOLS.
+
+    >>> from django.test import override_settings
+    >>> get_subprotocol_codecs()
+    {}
+    >>> with override_settings(ENVELOPE_SUBPROTOCOLS={'envelope.msgpack': 'envelope.core.codecs.MsgPackCodec'}):
+    ...     get_subprotocol_codecs()
+    {'envelope.msgpack': <envelope.core.codecs.MsgPackCodec object at ...>}
+    """
+    return {
+        subprotocol: get_codec(name)
+        for subprotocol, name in getattr(settings, "ENVELOPE_SUBPROTOCOLS", {}).items()
+    }
+
+
 def add_envelopes(*envelopes: Envelope):
     """
     Decorator to add handlers to several namespaces.
@@ -97,14 +192,15 @@ def add_envelopes(*envelopes: Envelope):
     >>> del envelope_registry['hello']
     >>> del message_registry['hello']
     """
-    from envelope.registries import envelope_registry
-    from envelope.registries import message_registry
-
     for envelope in envelopes:
         envelope_registry[envelope.name] = envelope
         message_registry.setdefault(envelope.name, {})
 
 
+# Connection values that update_connection_status and upsert_connection_statuses can change
+CONNECTION_STATUS_FIELDS = ("online", "awol", "online_at", "offline_at", "last_action")
+
+
 def update_connection_status(
     user_pk: int,
     channel_name: str,
@@ -117,21 +213,74 @@ def update_connection_status(
     """
     This is sync-only code so don't call this in any async context!
     """
-    new_values = {
-        "online": online,
-        "awol": awol,
-        "online_at": online_at,
-        "offline_at": offline_at,
-        "last_action": last_action,
-    }
-    # None means we shouldn't touch it
-    new_values = {k: v for k, v in new_values.items() if v is not None}
-    conn, created = Connection.objects.update_or_create(
-        user_id=user_pk,
-        channel_name=channel_name,
-        defaults=new_values,
-    )
-    return conn
+    return upsert_connection_statuses(
+        [
+            {
+                "user_pk": user_pk,
+                "channel_name": channel_name,
+                "online": online,
+                "awol": awol,
+                "online_at": online_at,
+                "offline_at": offline_at,
+                "last_action": last_action,
+            }
+        ]
+    )[0]
+
+
+def upsert_connection_statuses(statuses: Iterable[dict]) -> list[Connection]:
+    """
+    Create or update connections with one INSERT ... ON CONFLICT per combination of changed fields.
+    Each status is a dict with user_pk, channel_name and any of the values update_connection_status takes.
+    None means we shouldn't touch it. Later statuses for the same connection override earlier ones.
+
+    Returns one connection per user_pk and channel_name. Values that weren't changed are
+    deferred, so they're loaded from the database if they're accessed.
+
+    Databases without ON CONFLICT support for bulk_create, and Django before 5.0 which doesn't
+    set pk on the returned rows, use update_or_create for each connection instead.
+
+    Sync code only.
+    """
+    merged: dict[tuple[int, str], dict] = {}
+    for status in statuses:
+        key = (status["user_pk"], status["channel_name"])
+        values = merged.setdefault(key, {})
+        for field_name in CONNECTION_STATUS_FIELDS:
+            if status.get(field_name) is not None:
+                values[field_name] = status[field_name]
+    alias = router.db_for_write(Connection)
+    if django.VERSION < (5, 0) or not getattr(
+        connections[alias].features, "supports_update_conflicts_with_target", False
+    ):
+        with transaction.atomic(using=alias, savepoint=False):
+            return [
+                Connection.objects.update_or_create(
+                    user_id=user_pk, channel_name=channel_name, defaults=values
+                )[0]
+                for (user_pk, channel_name), values in merged.items()
+            ]
+    by_fields: dict[tuple[str, ...], list[Connection]] = defaultdict(list)
+    results = []
+    for (user_pk, channel_name), values in merged.items():
+        conn = Connection(user_id=user_pk, channel_name=channel_name, **values)
+        by_fields[tuple(sorted(values))].append(conn)
+        results.append((conn, values))
+    with transaction.atomic(using=alias, savepoint=False):
+        for field_names, conns in by_fields.items():
+            Connection.objects.bulk_create(
+                conns,
+                # Nothing to update means we'll still want the existing row back
+                update_conflicts=True,
+                unique_fields=["user", "channel_name"],
+                update_fields=field_names or ["channel_name"],
+            )
+    for conn, values in results:
+        # Defaults for fields we didn't change might not be what's stored
+        for field_name in CONNECTION_STATUS_FIELDS:
+            if field_name not in values:
+                del conn.__dict__[field_name]
+    return [x[0] for x in results]
 
 
 class SenderUtil:
@@ -162,7 +311,14 @@ class SenderUtil:
             )
 
     def __call__(self):
-        async_to_sync(self.async_send)()
+        # Serialized right away, so later changes to the message aren't sent and errors are raised here
+        payload = self.get_payload()
+        sender_loop = get_sender_loop()
+        if sender_loop is not None and sender_loop.active:
+            # Messages to the same channel are kept in order
+            sender_loop.submit(self.async_send, payload, key=self.channel_name)
+        else:
+            async_to_sync(self.async_send)(payload)
 
     @property
     def group_key(self):
@@ -175,8 +331,12 @@ class SenderUtil:
     def batch(self) -> bool:
         return self.envelope.allow_batch and self.message.allow_batch
 
-    async def async_send(self):
-        payload = self.envelope.transport(self.envelope, self.message)
+    def get_payload(self) -> dict:
+        return self.envelope.transport(self.envelope, self.message)
+
+    async def async_send(self, payload: dict | None = None):
+        if payload is None:
+            payload = self.get_payload()
         channel_layer = get_channel_layer(self.envelope.layer_name)
         if self.group:
             await channel_layer.group_send(self.channel_name, payload)